@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import asyncio
+import functools
 import json
 import os
 import shutil
@@ -20,8 +21,12 @@ from aiohttp import web
 from server import PromptServer
 
 from comfy_pack.hash import async_batch_get_sha256
-from comfy_pack.model_helper import alookup_model_source
+from comfy_pack.inventory import ModelInventory
+from comfy_pack.model_helper import abatch_lookup_model_sources
 from comfy_pack.package import build_bento
+from comfy_pack.utils import link_or_copy
+
+from .monkeypatch import output_cache_stats
 
 ZPath = Union[Path, zipfile.Path]
 TEMP_FOLDER = Path(__file__).parent.parent / "temp"
@@ -114,6 +119,53 @@ def _is_file_refered(file_path: Path, workflow_api: dict) -> bool:
     return str(relpath) in all_inputs
 
 
+@functools.lru_cache
+def _get_model_inventory() -> ModelInventory:
+    return ModelInventory(folder_paths.models_dir)
+
+
+def _store_model(filename: str, relpath: str, model_tag: str) -> None:
+    import bentoml
+
+    # `create` copies the model directory into the store when it exits, so
+    # register an empty model and place the weights in the store directly
+    with bentoml.models.create(model_tag, labels={"filename": relpath}):
+        pass
+    model = bentoml.models.get(model_tag)
+    try:
+        method = link_or_copy(filename, model.path_of("model.bin"))
+    except BaseException:
+        bentoml.models.delete(model_tag)
+        raise
+    print(f"Package => Stored model {relpath} as {model_tag} ({method})")
+
+
+async def _store_models(models: list[dict], concurrency: int = 4) -> None:
+    """Register the models in the BentoML store, skipping the known ones."""
+    import bentoml
+
+    try:
+        existing = {str(m.tag) for m in bentoml.models.list("cpack-model")}
+    except bentoml.exceptions.NotFound:
+        existing = set()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def store(model_data: dict) -> None:
+        async with limit:
+            await asyncio.to_thread(
+                _store_model,
+                os.path.join(folder_paths.base_path, model_data["filename"]),
+                model_data["filename"],
+                model_data["model_tag"],
+            )
+
+    pending = {}
+    for model_data in models:
+        if model_data.get("model_tag") and model_data["model_tag"] not in existing:
+            pending.setdefault(model_data["model_tag"], model_data)
+    await asyncio.gather(*(store(m) for m in pending.values()))
+
+
 async def _get_models(
     store_models: bool = False,
     workflow_api: dict | None = None,
@@ -121,44 +173,41 @@ async def _get_models(
     ensure_sha=True,
     ensure_source=True,
 ) -> list:
-    proc = await asyncio.subprocess.create_subprocess_exec(
-        "git",
-        "ls-files",
-        "--others",
-        folder_paths.models_dir,
-        stdout=subprocess.PIPE,
-    )
-    stdout, _ = await proc.communicate()
+    model_files = await asyncio.to_thread(_get_model_inventory().refresh)
 
     models = []
-    model_filenames = [
-        os.path.abspath(line)
-        for line in stdout.decode().splitlines()
-        if not os.path.basename(line).startswith(".")
-    ]
+    model_filenames = [f.path for f in model_files]
+    cache_only = not (ensure_sha or store_models)
     model_hashes = await async_batch_get_sha256(
         model_filenames,
-        cache_only=not (ensure_sha or store_models),
+        cache_only=cache_only,
+        # files replaced in place keep their directory mtime, stat them
+        # again when the hashes are going to be packed
+        known_stats={f.path: (f.size, f.ctime) for f in model_files}
+        if cache_only
+        else None,
+    )
+    model_sources = await abatch_lookup_model_sources(
+        list(model_hashes.values()),
+        cache_only=not ensure_source,
     )
 
-    for filename in model_filenames:
+    for model_file in model_files:
+        filename = model_file.path
         relpath = os.path.relpath(filename, folder_paths.base_path)
 
         model_data = {
             "filename": relpath,
-            "size": os.path.getsize(filename),
-            "atime": os.path.getatime(filename),
-            "ctime": os.path.getctime(filename),
+            "size": model_file.size,
+            "atime": model_file.atime,
+            "ctime": model_file.ctime,
             "disabled": relpath not in model_filter
             if model_filter is not None
             else False,
             "sha256": model_hashes.get(filename),
         }
 
-        model_data["source"] = await alookup_model_source(
-            model_data["sha256"],
-            cache_only=not ensure_source,
-        )
+        model_data["source"] = model_sources.get(model_data["sha256"], {})
         # should_store = store_models and (
         #     model_data["source"].get("source") != "huggingface"
         #     or model_data["source"].get("repo", "").startswith("datasets/")
@@ -166,18 +215,10 @@ async def _get_models(
         should_store = store_models
 
         if should_store:
-            import bentoml
-
-            model_tag = f"cpack-model:{model_data['sha256'][:16]}"
-            try:
-                model = bentoml.models.get(model_tag)
-            except bentoml.exceptions.NotFound:
-                with bentoml.models.create(
-                    model_tag, labels={"filename": relpath}
-                ) as model:
-                    shutil.copy(filename, model.path_of("model.bin"))
-            model_data["model_tag"] = model_tag
+            model_data["model_tag"] = f"cpack-model:{model_data['sha256'][:16]}"
         models.append(model_data)
+    if store_models:
+        await _store_models(models)
     if workflow_api:
         for model in models:
             model["refered"] = _is_file_refered(Path(model["filename"]), workflow_api)
@@ -423,6 +464,11 @@ async def terminate(_):
     return web.json_response({"result": "success"})
 
 
+@PromptServer.instance.routes.get("/bentoml/output_cache/stats")
+async def get_output_cache_stats(_):
+    return web.json_response(output_cache_stats())
+
+
 @PromptServer.instance.routes.get("/bentoml/download/{zip_filename}")
 async def download_workspace(request):
     zip_filename = request.match_info["zip_filename"]
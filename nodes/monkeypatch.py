@@ -1,31 +1,107 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import sys
 from threading import Lock
 
 import execution
+import folder_paths
 
-CPACK_LAST_ID = None
-CPACK_OUTPUT_CACHE = {}
+from comfy_pack.lazy_models import patch_folder_paths
 
+
+class PromptOutputCache:
+    """Values reported by comfy-pack input nodes while one prompt is validated"""
+
+    __slots__ = ("last_id", "outputs")
+
+    def __init__(self):
+        self.last_id = None
+        self.outputs = {}
+
+    def nbytes(self) -> int:
+        size = sys.getsizeof(self.outputs)
+        for output in list(self.outputs.values()):
+            size += sys.getsizeof(output)
+            for item in output:
+                size += sum(sys.getsizeof(v) for v in item)
+        return size
+
+
+# Used when a node is validated outside of `execution.validate_prompt`
+_GLOBAL_CACHE = PromptOutputCache()
+_current_cache = contextvars.ContextVar("cpack_output_cache", default=_GLOBAL_CACHE)
+
+# Caches of the prompts being validated right now, only used for the gauge
+_active_caches: dict[int, PromptOutputCache] = {}
 _lock = Lock()
 
 
+@contextlib.contextmanager
+def _prompt_scope():
+    cache = PromptOutputCache()
+    token = _current_cache.set(cache)
+    with _lock:
+        _active_caches[id(cache)] = cache
+    try:
+        yield cache
+    finally:
+        _current_cache.reset(token)
+        with _lock:
+            _active_caches.pop(id(cache), None)
+        cache.outputs.clear()
+
+
+def scope_bentoml_outputs(func):
+    """Give every prompt validation its own output cache, dropped when it ends"""
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapped(*args, **kwargs):
+            with _prompt_scope():
+                return await func(*args, **kwargs)
+
+        return async_wrapped
+
+    @functools.wraps(func)
+    def wrapped(*args, **kwargs):
+        with _prompt_scope():
+            return func(*args, **kwargs)
+
+    return wrapped
+
+
 def store_bentoml_value(func):
     def wrapped(
         inputs, class_def, unique_id, outputs=None, dynprompt=None, extra_data={}
     ):
-        global CPACK_LAST_ID
+        cache = _current_cache.get()
         if getattr(class_def, "CPACK_NODE", False):
-            with _lock:
-                CPACK_LAST_ID = unique_id
+            cache.last_id = unique_id
         if outputs is None:
-            outputs = CPACK_OUTPUT_CACHE
+            outputs = cache.outputs
         return func(inputs, class_def, unique_id, outputs, dynprompt, extra_data)
 
     return wrapped
 
 
+execution.validate_prompt = scope_bentoml_outputs(execution.validate_prompt)
 execution.get_input_data = store_bentoml_value(execution.get_input_data)
+patch_folder_paths(folder_paths)
 
 
 def set_bentoml_output(output):
+    cache = _current_cache.get()
+    cache.outputs[cache.last_id] = output
+
+
+def output_cache_stats() -> dict:
+    """Gauge of the memory held by the comfy-pack output caches"""
     with _lock:
-        CPACK_OUTPUT_CACHE[CPACK_LAST_ID] = output
+        caches = [_GLOBAL_CACHE, *_active_caches.values()]
+    return {
+        "prompts": len(caches) - 1,
+        "entries": sum(len(c.outputs) for c in caches),
+        "bytes": sum(c.nbytes() for c in caches),
+    }
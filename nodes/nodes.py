@@ -1,10 +1,14 @@
+import collections
 import glob
 import hashlib
 import json
 import os
 import shutil
 import sys
+import tempfile
+import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 import folder_paths
@@ -16,7 +20,7 @@ from comfy_extras.nodes_video import SaveVideo
 from PIL import Image, ImageOps, ImageSequence, PngImagePlugin
 from PIL.PngImagePlugin import PngInfo
 from comfy.comfy_types import IO
-from tempfile import NamedTemporaryFile
+from comfy_pack.utils import staged_digest
 
 from .monkeypatch import set_bentoml_output
 
@@ -30,13 +34,42 @@ class AnyType(str):
 
 anytype = AnyType("*")  # when a != b is called, it will always return False
 
+# Videos encoded at once, the encoders are multithreaded already
+VIDEO_ENCODE_WORKERS = int(os.environ.get("CPACK_VIDEO_ENCODE_WORKERS", "2"))
+# Encoded videos are kept in memory up to this size, larger ones spill to disk
+VIDEO_SPOOL_SIZE = 64 * 1024 * 1024
+
+
+def _process_bounded(item_processor, items, max_workers):
+    """
+    Yield `item_processor(item, index)` in order, running at most
+    `max_workers` at once and holding at most that many results.
+    """
+    if max_workers <= 1 or len(items) <= 1:
+        yield from map(item_processor, items, range(len(items)))
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        pending = collections.deque()
+        try:
+            for idx, item in enumerate(items):
+                if len(pending) >= max_workers:
+                    yield pending.popleft().result()
+                pending.append(pool.submit(item_processor, item, idx))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
 
 def create_zip_with_text(
     zip_path,
     items,
     text,
     item_processor,
-    filename_pattern
+    filename_pattern,
+    item_compress_type=None,
+    max_workers=1,
 ):
     """
     Generic function to create a zip file with items and text files.
@@ -46,23 +79,33 @@ def create_zip_with_text(
         items: List of items to process (images, videos, etc.)
         text: Text content to include with each item
         item_processor: Function that takes (item, index) and returns
-                       (filename, bytes or file path)
+                       (filename, bytes or a binary file object). File
+                       objects are streamed into the zip and closed.
         filename_pattern: Pattern for text files (e.g., "text_{:05}.txt")
+        item_compress_type: Compression used for the item entries, defaults
+                       to the zip file's compression (deflate)
+        max_workers: Number of items processed concurrently, and kept
+                       waiting to be written. Entries are still written in
+                       the order of ``items``.
     """
+    compress_type = item_compress_type or zipfile.ZIP_DEFLATED
     with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for idx, item in enumerate(items):
-            # Process the item (image, video, etc.)
-            item_filename, item_data = item_processor(item, idx)
-
+        processed = _process_bounded(item_processor, items, max_workers)
+        for idx, (item_filename, item_data) in enumerate(processed):
             if isinstance(item_data, bytes):
                 # Write bytes directly
-                zipf.writestr(item_filename, item_data)
+                zipf.writestr(item_filename, item_data, compress_type=compress_type)
             else:
-                # Add file from path
-                zipf.write(item_data, item_filename)
-                # Clean up temp file if needed
-                if os.path.exists(item_data):
-                    os.unlink(item_data)
+                with item_data:
+                    size = item_data.seek(0, os.SEEK_END)
+                    item_data.seek(0)
+                    info = zipfile.ZipInfo(
+                        item_filename, date_time=time.localtime()[:6]
+                    )
+                    info.compress_type = compress_type
+                    info.file_size = size
+                    with zipf.open(info, "w") as entry:
+                        shutil.copyfileobj(item_data, entry, 1024 * 1024)
 
             # Write text file
             text_filename = filename_pattern.format(idx)
@@ -379,9 +422,14 @@ class ImageInput:
     @classmethod
     def IS_CHANGED(s, image):
         image_path = folder_paths.get_annotated_filepath(image)
+        # staged inputs are named after their content
+        digest = staged_digest(image_path, folder_paths.get_input_directory())
+        if digest is not None:
+            return digest
         m = hashlib.sha256()
         with open(image_path, "rb") as f:
-            m.update(f.read())
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                m.update(chunk)
         return m.digest().hex()
 
     @classmethod
@@ -641,40 +689,40 @@ class OutputVideoWithStringTxt:
         zip_filename = f"{filename}_video_batch_{base_counter:05}.zip"
         zip_path = os.path.join(full_output_folder, zip_filename)
 
-        def process_video(video, idx):
-            # Save video to temporary file
-            temp_file = NamedTemporaryFile(
-                suffix=".mp4",
-                delete=False,
-                dir=full_output_folder
-            )
-            temp_file.close()
+        # Save metadata if provided
+        metadata = {}
+        if prompt is not None:
+            metadata["prompt"] = prompt
+        if extra_pnginfo is not None:
+            metadata.update(extra_pnginfo)
 
-            # Save metadata if provided
-            metadata = {}
-            if prompt is not None:
-                metadata["prompt"] = prompt
-            if extra_pnginfo is not None:
-                metadata.update(extra_pnginfo)
-
-            # Save video to temp file
-            video.save_to(
-                temp_file.name,
-                format="auto",
-                codec="auto",
-                metadata=metadata if metadata else None
-            )
-
-            video_filename = f"video_{idx:05}.mp4"
-            return video_filename, temp_file.name
+        def process_video(video, idx):
+            # The muxer needs a seekable stream, which a zip entry is not:
+            # encode into memory, spilling only very large videos to disk,
+            # and stream the result into the zip
+            video_file = tempfile.SpooledTemporaryFile(max_size=VIDEO_SPOOL_SIZE)
+            try:
+                video.save_to(
+                    video_file,
+                    format="mp4",
+                    codec="auto",
+                    metadata=metadata if metadata else None
+                )
+            except BaseException:
+                video_file.close()
+                raise
+            return f"video_{idx:05}.mp4", video_file
 
-        # Create ZIP using helper function
+        # Videos are already compressed, store them as-is, and encode a
+        # few of them at once
         create_zip_with_text(
             zip_path,
             videos,
             text,
             process_video,
-            "text_{:05}.txt"
+            "text_{:05}.txt",
+            item_compress_type=zipfile.ZIP_STORED,
+            max_workers=VIDEO_ENCODE_WORKERS,
         )
 
         # return zip as output
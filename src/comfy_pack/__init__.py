@@ -1,4 +1,4 @@
-from .run import ComfyUIServer, run_workflow
+from .run import ComfyUIServer, run_workflow, submit_workflow, wait_for_prompts
 from .utils import (
     generate_input_model,
     parse_workflow,
@@ -9,6 +9,8 @@ from .utils import (
 __all__ = [
     "ComfyUIServer",
     "run_workflow",
+    "submit_workflow",
+    "wait_for_prompts",
     "parse_workflow",
     "generate_input_model",
     "populate_workflow",
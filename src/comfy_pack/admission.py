@@ -0,0 +1,182 @@
+"""
+Admission control for the comfy-pack service.
+
+ComfyUI runs one prompt at a time, so the wait of a new request is about
+the number of requests ahead of it times their execution time. The
+controller keeps a moving average of the execution time per endpoint and
+turns requests away once the expected wait exceeds the latency objective,
+telling the client when to retry, instead of letting them pile up until
+they time out.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import threading
+import time
+from typing import Any
+
+
+# set to "hit" on the responses served from a cache without executing
+CACHE_HEADER = b"x-cpack-cache"
+
+
+class Overloaded(Exception):
+    def __init__(self, status: int, retry_after: float, reason: str) -> None:
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Args:
+        slo: Maximum expected wait, in seconds, for a request to be admitted.
+        max_queue: Maximum number of requests in flight, 0 for no limit.
+        alpha: Weight of the latest sample in the moving averages.
+    """
+
+    def __init__(self, slo: float, max_queue: int = 0, alpha: float = 0.2) -> None:
+        self.slo = slo
+        self.max_queue = max_queue
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, int] = {}
+        self._service_time: dict[str, float] = {}
+        self._last_done = 0.0
+        self.rejected = 0
+
+    def _expected_wait(self) -> float:
+        return sum(
+            count * self._service_time.get(key, 0.0)
+            for key, count in self._in_flight.items()
+        )
+
+    def admit(self, key: str) -> float:
+        """Admit a request or raise Overloaded. Returns the admission time."""
+        with self._lock:
+            in_flight = sum(self._in_flight.values())
+            wait = self._expected_wait()
+            if self.max_queue and in_flight >= self.max_queue:
+                self.rejected += 1
+                per_request = wait / in_flight if in_flight else 1.0
+                raise Overloaded(429, per_request, "Too many requests in flight")
+            expected = wait + self._service_time.get(key, 0.0)
+            if expected > self.slo:
+                self.rejected += 1
+                raise Overloaded(
+                    503,
+                    expected - self.slo,
+                    "Expected wait exceeds the latency objective",
+                )
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+            return time.monotonic()
+
+    def release(
+        self, key: str, admitted_at: float, ok: bool = True, executed: bool = True
+    ) -> None:
+        """
+        Release an admitted request. Only the requests that ran
+        successfully are timed, and one answered without running, e.g. from
+        a cache, did not keep the next request waiting either.
+        """
+        with self._lock:
+            self._in_flight[key] -= 1
+            if not executed:
+                return
+            now = time.monotonic()
+            if ok:
+                # requests run one after another, so a request's execution
+                # started when it was admitted or when the previous one ended
+                sample = now - max(admitted_at, self._last_done)
+                previous = self._service_time.get(key)
+                self._service_time[key] = (
+                    sample
+                    if previous is None
+                    else self.alpha * sample + (1 - self.alpha) * previous
+                )
+            self._last_done = now
+
+    def load(self) -> dict[str, Any]:
+        """The state of the queue, for load balancers and dashboards"""
+        with self._lock:
+            wait = self._expected_wait()
+            return {
+                "in_flight": sum(self._in_flight.values()),
+                "expected_wait": round(wait, 3),
+                "service_time": {k: round(v, 3) for k, v in self._service_time.items()},
+                "slo": self.slo,
+                "max_queue": self.max_queue,
+                "rejected": self.rejected,
+                "accepting": wait <= self.slo
+                and not (
+                    self.max_queue and sum(self._in_flight.values()) >= self.max_queue
+                ),
+            }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an `AdmissionController` to some paths"""
+
+    def __init__(self, app, controller: AdmissionController, paths: list[str]) -> None:
+        self.app = app
+        self.controller = controller
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        key = scope["path"]
+        try:
+            admitted_at = self.controller.admit(key)
+        except Overloaded as e:
+            await self._reject(send, e)
+            return
+
+        released = False
+        status = 500
+        executed = True
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self.controller.release(
+                    key, admitted_at, ok=status < 400, executed=executed
+                )
+
+        async def send_wrapper(message) -> None:
+            nonlocal status, executed
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = dict(message.get("headers", []))
+                executed = headers.get(CACHE_HEADER) != b"hit"
+            await send(message)
+            # a streamed response is done with its last body chunk
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                release()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            release()
+
+    @staticmethod
+    async def _reject(send, e: Overloaded) -> None:
+        body = json.dumps({"error": e.reason, "retry_after": round(e.retry_after, 1)})
+        await send(
+            {
+                "type": "http.response.start",
+                "status": e.status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", str(max(1, math.ceil(e.retry_after))).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body.encode()})
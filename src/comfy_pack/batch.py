@@ -0,0 +1,109 @@
+"""
+Batch runs of a workflow over a JSON Lines or CSV file of inputs.
+
+Results are appended to a JSON Lines manifest as they complete, one
+``{"index": ..., "ok": ..., "outputs"/"error": ...}`` object per row, so
+that an interrupted batch can be resumed by skipping the rows that
+already succeeded.
+"""
+
+from __future__ import annotations
+
+import csv
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+
+
+def read_batch_inputs(path: str | Path) -> Iterator[dict]:
+    """Yield the rows of a .jsonl/.json lines or .csv input file"""
+    path = Path(path)
+    with path.open(newline="") as f:
+        if path.suffix.lower() == ".csv":
+            yield from csv.DictReader(f)
+            return
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError(f"{path}:{lineno}: expected a JSON object")
+            yield row
+
+
+def load_completed(manifest: Path) -> set[int]:
+    """The indices of the rows that already succeeded according to the manifest"""
+    done = set()
+    if not manifest.exists():
+        return done
+    with manifest.open() as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line of a crashed run may be truncated
+                continue
+            if entry.get("ok"):
+                done.add(entry["index"])
+    return done
+
+
+def run_batch(
+    rows: Iterable[tuple[int, dict]],
+    run_one: Callable[[int, dict], Any],
+    manifest: Path,
+    depth: int = 2,
+    on_result: Callable[[dict], None] | None = None,
+) -> tuple[int, int]:
+    """
+    Call `run_one(index, inputs)` for every row, keeping at most `depth`
+    of them in flight, and append each outcome to the manifest.
+
+    Returns the number of succeeded and failed rows.
+    """
+    lock = threading.Lock()
+    succeeded = failed = 0
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+
+    def _run(index: int, inputs: dict) -> dict:
+        start = time.monotonic()
+        try:
+            entry = {"index": index, "ok": True, "outputs": run_one(index, inputs)}
+        except Exception as e:
+            entry = {"index": index, "ok": False, "error": f"{type(e).__name__}: {e}"}
+        entry["elapsed"] = round(time.monotonic() - start, 3)
+        return entry
+
+    with manifest.open("a+") as out, ThreadPoolExecutor(max_workers=depth) as pool:
+        if out.tell() > 0:
+            out.seek(out.tell() - 1)
+            if out.read(1) != "\n":
+                # terminate the line a crashed run left truncated
+                out.write("\n")
+
+        def _record(future: Future) -> None:
+            nonlocal succeeded, failed
+            entry = future.result()
+            with lock:
+                out.write(json.dumps(entry, default=str) + "\n")
+                out.flush()
+                if entry["ok"]:
+                    succeeded += 1
+                else:
+                    failed += 1
+            if on_result is not None:
+                on_result(entry)
+
+        pending: set[Future] = set()
+        for index, inputs in rows:
+            if len(pending) >= depth:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _record(future)
+            pending.add(pool.submit(_run, index, inputs))
+        for future in wait(pending).done:
+            _record(future)
+    return succeeded, failed
@@ -0,0 +1,342 @@
+"""
+Micro-batching of workflow runs into one ComfyUI prompt.
+
+Requests running the same workflow usually differ only in a few inputs,
+such as the seed or the prompt text. `merge_workflows` fans them out inside
+a single graph: every node that is identical across the requests, including
+everything upstream of it, is kept once, and only the nodes that differ are
+duplicated. Model loaders and other shared work then run once per batch
+instead of once per request, and the whole batch costs one prompt.
+
+Output nodes keep their per-request filename prefix, so the outputs of
+each request are collected with `retrieve_workflow_outputs` as usual.
+
+Requests that differ only in their seed can go further with
+`fold_latent_batches`: they are run as one workflow whose latent batch
+holds the images of all of them, so that a single sampler run serves the
+whole batch, and `distribute_folded_outputs` hands each request its images.
+ComfyUI draws the noise of a whole batch from one seed, so a folded request
+gets the images at its offset in the batch of the first request's seed,
+not those of its own seed, which is why folding is opt-in.
+
+Nothing here talks to ComfyUI, the merging and the batching window can be
+exercised without a GPU.
+"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Hashable
+
+# Inputs taking the seed of the noise
+SEED_INPUTS = {"seed", "noise_seed"}
+# Nodes creating the latent batch, with a batch_size input
+LATENT_BATCH_NODES = {"EmptyLatentImage", "EmptySD3LatentImage"}
+# Output nodes writing one file per image of the batch, in batch order
+SPLITTABLE_OUTPUTS = {"CPackOutputImage"}
+
+
+def _is_link(value: Any) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+    )
+
+
+def merge_workflows(workflows: list[dict]) -> tuple[dict, list[dict[str, str]]]:
+    """
+    Merge populated API-format workflows into one.
+
+    Returns the merged workflow and, for each input workflow, the mapping
+    from its node ids to the node ids of the merged workflow.
+    """
+    merged: dict[str, dict] = {}
+    by_signature: dict[str, str] = {}
+    id_maps: list[dict[str, str]] = []
+
+    for workflow in workflows:
+        id_map: dict[str, str] = {}
+        signatures: dict[str, str] = {}
+        visiting: set[str] = set()
+
+        def visit(node_id: str) -> str:
+            if node_id in signatures:
+                return signatures[node_id]
+            if node_id in visiting:
+                raise ValueError(f"Cycle in the workflow at node {node_id}")
+            visiting.add(node_id)
+            node = workflow[node_id]
+            inputs = {}
+            for name, value in node.get("inputs", {}).items():
+                if _is_link(value):
+                    inputs[name] = {"link": visit(value[0]), "output": value[1]}
+                else:
+                    inputs[name] = value
+            signature = hashlib.sha256(
+                json.dumps(
+                    {"class_type": node["class_type"], "inputs": inputs},
+                    sort_keys=True,
+                    default=str,
+                ).encode()
+            ).hexdigest()
+            signatures[node_id] = signature
+
+            if signature not in by_signature:
+                new_id = str(len(merged) + 1)
+                by_signature[signature] = new_id
+                new_node = dict(node)
+                new_node["inputs"] = {
+                    name: [id_map[value[0]], value[1]] if _is_link(value) else value
+                    for name, value in node.get("inputs", {}).items()
+                }
+                merged[new_id] = new_node
+            id_map[node_id] = by_signature[signature]
+            visiting.discard(node_id)
+            return signature
+
+        for node_id in workflow:
+            visit(node_id)
+        id_maps.append(id_map)
+    return merged, id_maps
+
+
+def _seed_nodes(workflow: dict) -> set[str]:
+    """The nodes whose outputs only end up in seed inputs"""
+    consumers: dict[str, list[tuple[str, str]]] = {}
+    for node_id, node in workflow.items():
+        for name, value in node.get("inputs", {}).items():
+            if _is_link(value):
+                consumers.setdefault(value[0], []).append((node_id, name))
+    seed_nodes: set[str] = set()
+    changed = True
+    while changed:
+        changed = False
+        for node_id, uses in consumers.items():
+            if node_id in seed_nodes or node_id not in workflow:
+                continue
+            if all(name in SEED_INPUTS or user in seed_nodes for user, name in uses):
+                seed_nodes.add(node_id)
+                changed = True
+    return seed_nodes
+
+
+def latent_batch_size(workflow: dict) -> int:
+    for node in workflow.values():
+        if node["class_type"] in LATENT_BATCH_NODES:
+            return node["inputs"]["batch_size"]
+    return 1
+
+
+def _fold_key(workflow: dict) -> str | None:
+    """
+    What the workflows sharing a latent batch have in common, None if the
+    workflow cannot share one: it needs a single latent batch and outputs
+    that can be split per image.
+    """
+    latents = [n for n in workflow.values() if n["class_type"] in LATENT_BATCH_NODES]
+    if len(latents) != 1 or not isinstance(latents[0]["inputs"].get("batch_size"), int):
+        return None
+    outputs = [n for n in workflow.values() if n["class_type"].startswith("CPackOutput")]
+    if not outputs or any(n["class_type"] not in SPLITTABLE_OUTPUTS for n in outputs):
+        return None
+    seed_nodes = _seed_nodes(workflow)
+    shape = {}
+    for node_id, node in workflow.items():
+        inputs = {}
+        for name, value in node.get("inputs", {}).items():
+            if _is_link(value):
+                inputs[name] = value
+            elif (
+                node_id in seed_nodes
+                or name in SEED_INPUTS
+                or (node["class_type"] in LATENT_BATCH_NODES and name == "batch_size")
+                or (node["class_type"] in SPLITTABLE_OUTPUTS and name == "filename_prefix")
+            ):
+                inputs[name] = None
+            else:
+                inputs[name] = value
+        shape[node_id] = {"class_type": node["class_type"], "inputs": inputs}
+    return hashlib.sha256(
+        json.dumps(shape, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def fold_latent_batches(workflows: list[dict]) -> list[tuple[dict, list[int]]]:
+    """
+    Fold the populated workflows that differ only in their seeds into one
+    workflow, whose latent batch holds the images of all of them.
+
+    Returns the workflows to run, each with the indices of the input
+    workflows it runs, in batch order. A folded workflow is the one of its
+    first member, with its seed and its output filename prefixes.
+    """
+    folds: list[list[int]] = []
+    by_key: dict[str, list[int]] = {}
+    for index, workflow in enumerate(workflows):
+        key = _fold_key(workflow)
+        if key is None:
+            folds.append([index])
+        elif key in by_key:
+            by_key[key].append(index)
+        else:
+            by_key[key] = [index]
+            folds.append(by_key[key])
+
+    result = []
+    for members in folds:
+        folded = workflows[members[0]]
+        if len(members) > 1:
+            folded = copy.deepcopy(folded)
+            for node in folded.values():
+                if node["class_type"] in LATENT_BATCH_NODES:
+                    node["inputs"]["batch_size"] = sum(
+                        latent_batch_size(workflows[i]) for i in members
+                    )
+        result.append((folded, members))
+    return result
+
+
+def split_folded_outputs(files: list[Path], sizes: list[int]) -> list[list[Path]]:
+    """
+    Split the files an output node wrote for a folded batch back per member,
+    the member `i` owning `sizes[i]` images. The files are numbered in
+    batch order.
+    """
+    if len(files) != sum(sizes):
+        raise ValueError(
+            f"Got {len(files)} outputs for a folded batch of {sum(sizes)} images"
+        )
+    files = sorted(files, key=lambda p: p.name)
+    chunks, start = [], 0
+    for size in sizes:
+        chunks.append(files[start : start + size])
+        start += size
+    return chunks
+
+
+def distribute_folded_outputs(
+    folded: dict, members: list[tuple[str, Path]], sizes: list[int]
+) -> None:
+    """
+    Move the outputs of a folded workflow, written under the session id of
+    its first member, to the output directory of each `(session_id,
+    output_dir)` member, named as if it had run on its own.
+    """
+    base_session, base_dir = members[0]
+    for node_id, node in folded.items():
+        if node["class_type"] not in SPLITTABLE_OUTPUTS:
+            continue
+        prefix = f"{base_session}{node_id}_"
+        files = list(base_dir.glob(f"{prefix}*"))
+        for (session_id, output_dir), chunk in zip(
+            members[1:], split_folded_outputs(files, sizes)[1:]
+        ):
+            for path in chunk:
+                name = f"{session_id}{node_id}_" + path.name[len(prefix) :]
+                shutil.move(str(path), str(output_dir / name))
+
+
+class MicroBatcher:
+    """
+    Collects items submitted within `window` seconds of each other and hands
+    them to `run_batch` together, at most `max_batch` at a time.
+
+    `run_batch` receives the list of items and returns one result per item,
+    an exception in place of a result fails only that item. Only items
+    submitted with the same `key` are batched together.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[list[Any]], list[Any]],
+        window: float = 0.05,
+        max_batch: int = 8,
+    ) -> None:
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: dict[Hashable, list[tuple[Any, Future]]] = {}
+        self._deadlines: dict[Hashable, float] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any, key: Hashable = None) -> Future:
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The batcher is closed")
+            queue = self._pending.setdefault(key, [])
+            if not queue:
+                self._deadlines[key] = time.monotonic() + self.window
+            queue.append((item, future))
+            self._cond.notify_all()
+        return future
+
+    def _take_ready(self) -> list[list[tuple[Any, Future]]]:
+        now = time.monotonic()
+        ready = []
+        for key in list(self._pending):
+            queue = self._pending[key]
+            if len(queue) >= self.max_batch or now >= self._deadlines[key] or (
+                self._closed
+            ):
+                ready.append(queue[: self.max_batch])
+                del queue[: self.max_batch]
+                if queue:
+                    self._deadlines[key] = now + self.window
+                else:
+                    del self._pending[key], self._deadlines[key]
+        return ready
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    ready = self._take_ready()
+                    if ready or (self._closed and not self._pending):
+                        break
+                    timeout = None
+                    if self._deadlines:
+                        timeout = max(
+                            0.0, min(self._deadlines.values()) - time.monotonic()
+                        )
+                    self._cond.wait(timeout)
+            if not ready:
+                return
+            for batch in ready:
+                # run outside of the lock so that new items keep coming in
+                threading.Thread(target=self._run, args=(batch,), daemon=True).start()
+
+    def _run(self, batch: list[tuple[Any, Future]]) -> None:
+        items = [item for item, _ in batch]
+        try:
+            results = list(self.run_batch(items))
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"Got {len(results)} results for a batch of {len(batch)} items"
+                )
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def close(self) -> None:
+        """Flush the pending items and stop the batching thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
@@ -0,0 +1,823 @@
+"""
+Benchmarks of comfy-pack's own overhead.
+
+Workflows run against `FakeComfyUI`, which speaks enough of ComfyUI's API
+for comfy-pack and comfy-cli: it executes prompts one at a time, sleeping
+a configurable time per node and writing synthetic files for the comfy-pack
+output nodes. What is measured is then the cost of comfy-pack around
+ComfyUI, on any machine, GPU or not. Results can be saved and compared
+with a baseline to catch regressions.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import copy
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+from .const import BENCHMARKS
+from .run import run_workflow, submit_workflow, wait_for_prompts
+from .utils import (
+    CPACK_PATH_INPUT_NODES,
+    _get_node_value,
+    _parse_workflow,
+    populate_workflow,
+    retrieve_workflow_outputs,
+)
+
+# Differences in p95 below this many seconds are noise, not regressions
+NOISE_FLOOR = 0.001
+
+SYNTHETIC_WORKFLOW: dict[str, Any] = {
+    "1": {
+        "class_type": "CPackInputString",
+        "inputs": {"value": "rocks in a bottle"},
+        "_meta": {"title": "prompt"},
+    },
+    "2": {
+        "class_type": "CPackInputInt",
+        "inputs": {"value": 512, "min": 64, "max": 2048},
+        "_meta": {"title": "width"},
+    },
+    "3": {
+        "class_type": "CPackInputInt",
+        "inputs": {"value": 1, "min": 0, "max": 2**32},
+        "_meta": {"title": "seed"},
+    },
+    "4": {
+        "class_type": "CheckpointLoaderSimple",
+        "inputs": {"ckpt_name": "model.safetensors"},
+    },
+    "5": {
+        "class_type": "CLIPTextEncode",
+        "inputs": {"text": ["1", 0], "clip": ["4", 1]},
+    },
+    "6": {
+        "class_type": "EmptyLatentImage",
+        "inputs": {"width": ["2", 0], "height": ["2", 0], "batch_size": 1},
+    },
+    "7": {
+        "class_type": "KSampler",
+        "inputs": {
+            "model": ["4", 0],
+            "positive": ["5", 0],
+            "negative": ["5", 0],
+            "latent_image": ["6", 0],
+            "seed": ["3", 0],
+            "steps": 20,
+        },
+    },
+    "8": {
+        "class_type": "VAEDecode",
+        "inputs": {"samples": ["7", 0], "vae": ["4", 2]},
+    },
+    "9": {
+        "class_type": "CPackOutputImage",
+        "inputs": {"images": ["8", 0], "filename_prefix": "cpack_output_"},
+        "_meta": {"title": "image"},
+    },
+}
+
+# two outputs and the zip switch, so that the outputs are zipped
+SYNTHETIC_ZIP_WORKFLOW: dict[str, Any] = {
+    **SYNTHETIC_WORKFLOW,
+    "10": {
+        "class_type": "CPackOutputFile",
+        "inputs": {"filename": ["1", 0], "filename_prefix": "cpack_output_"},
+        "_meta": {"title": "caption"},
+    },
+    "11": {"class_type": "CPackOutputZipSwitch", "inputs": {}},
+}
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """The nearest-rank percentile, `q` between 0 and 100"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+@dataclass
+class BenchResult:
+    name: str
+    samples: list[float] = field(default_factory=list)
+    wall: float = 0.0
+    errors: int = 0
+    skipped: str | None = None
+
+    def summary(self) -> dict[str, Any]:
+        if self.skipped is not None:
+            return {"skipped": self.skipped}
+        count = len(self.samples)
+        return {
+            "count": count,
+            "errors": self.errors,
+            "throughput": round(count / self.wall, 2) if self.wall else 0.0,
+            "mean_ms": round(sum(self.samples) / count * 1000, 3) if count else 0.0,
+            "p50_ms": round(percentile(self.samples, 50) * 1000, 3),
+            "p95_ms": round(percentile(self.samples, 95) * 1000, 3),
+            "p99_ms": round(percentile(self.samples, 99) * 1000, 3),
+        }
+
+
+def write_outputs(prompt: dict, data: bytes) -> list[Path]:
+    """
+    Write a synthetic file where each comfy-pack output node of a populated
+    prompt would, one per image of its latent batch
+    """
+    from .batching import latent_batch_size
+
+    images = latent_batch_size(prompt)
+    written = []
+    for node in prompt.values():
+        prefix = node.get("inputs", {}).get("filename_prefix")
+        if node.get("class_type", "").startswith("CPackOutput") and prefix:
+            for i in range(images):
+                path = Path(f"{prefix}{i + 1:05}_.png")
+                if path.parent.is_dir():
+                    path.write_bytes(data)
+                    written.append(path)
+    return written
+
+
+class FakeComfyUI:
+    """
+    A stand-in for a ComfyUI server, serving /prompt, /history, /queue,
+    /interrupt and the /ws events in a background thread.
+
+    Args:
+        node_latency: Seconds each node of a prompt takes to execute.
+        output_size: Size in bytes of the files written for output nodes.
+    """
+
+    def __init__(
+        self,
+        node_latency: float = 0.0,
+        output_size: int = 64 * 1024,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.node_latency = node_latency
+        self.output = os.urandom(output_size)
+        self.host = host
+        self.port = port
+        self.history: dict[str, dict] = {}
+        self._pending: list[list] = []
+        self._running: list | None = None
+        self._interrupted = False
+        self._sockets: dict[str, Any] = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(ready,), daemon=True)
+        self._thread.start()
+        if not ready.wait(30):
+            raise RuntimeError("The fake ComfyUI server did not start")
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result(30)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self) -> FakeComfyUI:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _serve(self, ready: threading.Event) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._start())
+        ready.set()
+        self._loop.run_forever()
+
+    async def _start(self) -> None:
+        from aiohttp import web
+
+        app = web.Application(client_max_size=1024**3)
+        for prefix in ("", "/api"):
+            app.router.add_post(f"{prefix}/prompt", self._post_prompt)
+            app.router.add_get(f"{prefix}/history", self._get_histories)
+            app.router.add_get(f"{prefix}/history/{{prompt_id}}", self._get_history)
+            app.router.add_get(f"{prefix}/queue", self._get_queue)
+            app.router.add_post(f"{prefix}/queue", self._post_queue)
+            app.router.add_post(f"{prefix}/interrupt", self._post_interrupt)
+            app.router.add_get(f"{prefix}/object_info", self._empty)
+            app.router.add_get(f"{prefix}/customnode/getmappings", self._empty)
+        app.router.add_get("/ws", self._ws)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker = asyncio.ensure_future(self._execute())
+
+    async def _stop(self) -> None:
+        self._worker.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._worker
+        await self._runner.cleanup()
+
+    async def _empty(self, request):
+        from aiohttp import web
+
+        return web.json_response({})
+
+    async def _post_prompt(self, request):
+        from aiohttp import web
+
+        body = await request.json()
+        prompt_id = uuid.uuid4().hex
+        item = [
+            len(self.history) + len(self._pending),
+            prompt_id,
+            body["prompt"],
+            {"client_id": body.get("client_id", "")},
+            [],
+        ]
+        self._pending.append(item)
+        self._queue.put_nowait(item)
+        return web.json_response(
+            {"prompt_id": prompt_id, "number": item[0], "node_errors": {}}
+        )
+
+    async def _get_history(self, request):
+        from aiohttp import web
+
+        prompt_id = request.match_info["prompt_id"]
+        if prompt_id not in self.history:
+            return web.json_response({})
+        return web.json_response({prompt_id: self.history[prompt_id]})
+
+    async def _get_histories(self, request):
+        from aiohttp import web
+
+        items = list(self.history.items())
+        max_items = int(request.query.get("max_items", len(items)))
+        return web.json_response(dict(items[len(items) - max_items :]))
+
+    async def _get_queue(self, request):
+        from aiohttp import web
+
+        return web.json_response(
+            {
+                "queue_running": [self._running] if self._running else [],
+                "queue_pending": self._pending,
+            }
+        )
+
+    async def _post_queue(self, request):
+        from aiohttp import web
+
+        body = await request.json()
+        if body.get("clear"):
+            self._pending.clear()
+        deleted = set(body.get("delete", []))
+        self._pending[:] = [item for item in self._pending if item[1] not in deleted]
+        return web.json_response({})
+
+    async def _post_interrupt(self, request):
+        from aiohttp import web
+
+        if self._running is not None:
+            self._interrupted = True
+        return web.json_response({})
+
+    async def _ws(self, request):
+        from aiohttp import web
+
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client_id = request.query.get("clientId") or uuid.uuid4().hex
+        self._sockets[client_id] = ws
+        await ws.send_json(
+            {"type": "status", "data": {"status": {"exec_info": {}}, "sid": client_id}}
+        )
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            if self._sockets.get(client_id) is ws:
+                del self._sockets[client_id]
+        return ws
+
+    async def _send(self, client_id: str, event: str, data: dict) -> None:
+        ws = self._sockets.get(client_id)
+        if ws is not None and not ws.closed:
+            with contextlib.suppress(ConnectionError):
+                await ws.send_json({"type": event, "data": data})
+
+    async def _execute(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item not in self._pending:
+                # deleted from the queue
+                continue
+            self._pending.remove(item)
+            self._running = item
+            _, prompt_id, prompt, extra, _ = item
+            client_id = extra["client_id"]
+            await self._send(client_id, "execution_start", {"prompt_id": prompt_id})
+            messages: list = []
+            for node_id in prompt:
+                if self._interrupted:
+                    messages.append(["execution_interrupted", {"prompt_id": prompt_id}])
+                    await self._send(client_id, *messages[-1])
+                    break
+                await self._send(
+                    client_id, "executing", {"node": node_id, "prompt_id": prompt_id}
+                )
+                if self.node_latency:
+                    await asyncio.sleep(self.node_latency)
+            else:
+                await asyncio.to_thread(write_outputs, prompt, self.output)
+                await self._send(
+                    client_id, "executing", {"node": None, "prompt_id": prompt_id}
+                )
+                await self._send(client_id, "execution_success", {"prompt_id": prompt_id})
+            self.history[prompt_id] = {
+                "prompt": item,
+                "outputs": {},
+                "status": {
+                    "status_str": "error" if messages else "success",
+                    "completed": not messages,
+                    "messages": messages,
+                },
+            }
+            self._running = None
+            self._interrupted = False
+
+
+def sample_inputs(workflow: dict, work_dir: Path) -> dict[str, Any]:
+    """Inputs for a workflow: the template values, and a small file for file inputs"""
+    inputs, _ = _parse_workflow(copy.deepcopy(workflow))
+    values = {}
+    for name, node in inputs.items():
+        if node["class_type"] in CPACK_PATH_INPUT_NODES:
+            path = work_dir / f"input-{name}.png"
+            path.write_bytes(os.urandom(1024))
+            values[name] = path
+        else:
+            values[name] = _get_node_value(node)
+    return values
+
+
+def _measure(
+    name: str,
+    fn: Callable[[Any], Any],
+    iterations: int,
+    setup: Callable[[int], Any] = lambda i: i,
+) -> BenchResult:
+    """Time `fn(setup(i))` sequentially, the setup being left out of the samples"""
+    result = BenchResult(name)
+    for i in range(iterations):
+        arg = setup(i)
+        start = time.perf_counter()
+        fn(arg)
+        result.samples.append(time.perf_counter() - start)
+    result.wall = sum(result.samples)
+    return result
+
+
+def _load(
+    name: str, fn: Callable[[int], Any], requests: int, concurrency: int
+) -> BenchResult:
+    """Time `requests` calls of `fn` made by `concurrency` threads"""
+    result = BenchResult(name)
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        start = time.perf_counter()
+        try:
+            fn(i)
+        except Exception:
+            with lock:
+                result.errors += 1
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            result.samples.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    result.wall = time.perf_counter() - start
+    return result
+
+
+def bench_populate(
+    workflow: dict, inputs: dict, iterations: int, work_dir: Path
+) -> BenchResult:
+    return _measure(
+        "populate",
+        lambda wf: populate_workflow(wf, work_dir, session_id="bench", **inputs),
+        iterations,
+        setup=lambda i: copy.deepcopy(workflow),
+    )
+
+
+def bench_retrieve(
+    name: str, workflow: dict, iterations: int, work_dir: Path, output_size: int
+) -> BenchResult:
+    out = work_dir / name
+    out.mkdir()
+    populated = populate_workflow(copy.deepcopy(workflow), out, session_id="bench")
+    write_outputs(populated, os.urandom(output_size))
+
+    def setup(i: int) -> None:
+        # the zip is written anew by every call
+        (out / "bench_output.zip").unlink(missing_ok=True)
+
+    return _measure(
+        name,
+        lambda _: retrieve_workflow_outputs(populated, out, session_id="bench"),
+        iterations,
+        setup=setup,
+    )
+
+
+def bench_submit(
+    server: FakeComfyUI,
+    workflow: dict,
+    inputs: dict,
+    requests: int,
+    concurrency: int,
+    work_dir: Path,
+) -> BenchResult:
+    """Submit, wait for and retrieve prompts through the ComfyUI API"""
+
+    def one(i: int) -> None:
+        out = work_dir / f"submit-{i}"
+        out.mkdir()
+        prompt_id, populated, session_id = submit_workflow(
+            server.host, server.port, workflow, out, **inputs
+        )
+        for _, error in wait_for_prompts(
+            server.host, server.port, [prompt_id], poll_interval=0.01
+        ):
+            if error is not None:
+                raise RuntimeError(error)
+        retrieve_workflow_outputs(populated, out, session_id=session_id)
+
+    return _load("submit", one, requests, concurrency)
+
+
+def bench_run_workflow(
+    server: FakeComfyUI,
+    workflow: dict,
+    inputs: dict,
+    requests: int,
+    concurrency: int,
+    work_dir: Path,
+) -> BenchResult:
+    """`run_workflow`, which goes through a `comfy run` process per call"""
+    if shutil.which("comfy") is None:
+        return BenchResult("run_workflow", skipped="comfy-cli is not installed")
+
+    def one(i: int) -> None:
+        out = work_dir / f"run-{i}"
+        out.mkdir()
+        run_workflow(
+            server.host, server.port, workflow, out, workspace=str(work_dir), **inputs
+        )
+
+    return _load("run_workflow", one, requests, concurrency)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_service(
+    server: FakeComfyUI,
+    workflow: dict,
+    inputs: dict,
+    requests: int,
+    concurrency: int,
+    work_dir: Path,
+    verbose: int = 0,
+) -> BenchResult:
+    """POST /generate to the BentoML service attached to the fake server"""
+    from urllib import error, request
+
+    if any(isinstance(v, Path) for v in inputs.values()):
+        return BenchResult("service", skipped="file inputs are not supported")
+    source = work_dir / "service"
+    source.mkdir()
+    shutil.copy2(Path(__file__).with_name("service.py"), source / "service.py")
+    (source / "workflow_api.json").write_text(json.dumps(workflow))
+    (source / "snapshot.json").write_text(json.dumps({"models": []}))
+    port = _free_port()
+    env = {**os.environ, "COMFYUI_SERVER": f"{server.host}:{server.port}"}
+    stdout = None if verbose > 0 else subprocess.DEVNULL
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "bentoml", "serve", "service:ComfyService"]
+        + ["--port", str(port)],
+        cwd=source,
+        env=env,
+        stdout=stdout,
+        stderr=stdout,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 120
+        while True:
+            if proc.poll() is not None:
+                return BenchResult("service", skipped="the service failed to start")
+            try:
+                request.urlopen(f"{url}/readyz", timeout=5)
+                break
+            except (error.URLError, ConnectionError):
+                if time.monotonic() > deadline:
+                    return BenchResult("service", skipped="the service did not start")
+                time.sleep(0.5)
+
+        payload = json.dumps(inputs).encode()
+
+        def one(i: int) -> None:
+            req = request.Request(
+                f"{url}/generate",
+                data=payload,
+                headers={"Content-Type": "application/json"},
+            )
+            with request.urlopen(req, timeout=300) as resp:
+                resp.read()
+
+        return _load("service", one, requests, concurrency)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def run_benchmarks(
+    workflow: dict | None = None,
+    benchmarks: tuple[str, ...] = BENCHMARKS,
+    iterations: int = 200,
+    requests: int = 50,
+    concurrency: int = 4,
+    node_latency: float = 0.0,
+    output_size: int = 64 * 1024,
+    verbose: int = 0,
+) -> dict[str, Any]:
+    """
+    Run the benchmarks and return the configuration and the summary of each.
+    `workflow` defaults to a synthetic one of a few nodes.
+    """
+    workflow = workflow or SYNTHETIC_WORKFLOW
+    report: dict[str, Any] = {
+        "config": {
+            "iterations": iterations,
+            "requests": requests,
+            "concurrency": concurrency,
+            "node_latency": node_latency,
+            "output_size": output_size,
+            "nodes": len(workflow),
+        },
+        "results": {},
+    }
+    # the library prints its progress, which is not what is measured here
+    quiet = open(os.devnull, "w") if verbose == 0 else None
+    with tempfile.TemporaryDirectory(prefix="cpack-bench-") as temp_dir:
+        work_dir = Path(temp_dir)
+        inputs = sample_inputs(workflow, work_dir)
+        with FakeComfyUI(node_latency, output_size) as server:
+            for name in benchmarks:
+                print(f"Running {name}...", file=sys.stderr)
+                with contextlib.redirect_stdout(quiet or sys.stdout):
+                    if name == "populate":
+                        result = bench_populate(workflow, inputs, iterations, work_dir)
+                    elif name == "retrieve":
+                        result = bench_retrieve(
+                            name, workflow, iterations, work_dir, output_size
+                        )
+                    elif name == "zip":
+                        result = bench_retrieve(
+                            name, SYNTHETIC_ZIP_WORKFLOW, iterations, work_dir, output_size
+                        )
+                    elif name == "submit":
+                        result = bench_submit(
+                            server, workflow, inputs, requests, concurrency, work_dir
+                        )
+                    elif name == "run_workflow":
+                        result = bench_run_workflow(
+                            server, workflow, inputs, requests, concurrency, work_dir
+                        )
+                    elif name == "service":
+                        result = bench_service(
+                            server,
+                            workflow,
+                            inputs,
+                            requests,
+                            concurrency,
+                            work_dir,
+                            verbose,
+                        )
+                    else:
+                        raise ValueError(f"Unknown benchmark {name!r}")
+                report["results"][name] = result.summary()
+    if quiet is not None:
+        quiet.close()
+    return report
+
+
+def compare(
+    report: dict[str, Any], baseline: dict[str, Any], max_regression: float
+) -> list[str]:
+    """The benchmarks whose p95 got worse than the baseline by more than `max_regression`"""
+    regressions = []
+    for name, summary in report["results"].items():
+        before = baseline.get("results", {}).get(name, {})
+        if "p95_ms" not in summary or "p95_ms" not in before:
+            continue
+        now, then = summary["p95_ms"], before["p95_ms"]
+        if now > then * (1 + max_regression) and now - then > NOISE_FLOOR * 1000:
+            regressions.append(f"{name}: p95 {then}ms -> {now}ms")
+    return regressions
+
+
+def _snapshot_repos(snapshot: dict) -> list[str]:
+    from .const import COMFYUI_REPO
+
+    urls = [COMFYUI_REPO, *snapshot.get("git_custom_nodes", {})]
+    urls += [m["url"] for m in snapshot.get("custom_nodes", []) if m.get("url")]
+    return list(dict.fromkeys(url.strip() for url in urls if url.strip()))
+
+
+def _mirror_path(mirror_dir: Path, url: str) -> Path:
+    import hashlib
+
+    name = url.rstrip("/").rsplit("/", 1)[-1].removesuffix(".git")
+    digest = hashlib.sha1(url.removesuffix(".git").encode()).hexdigest()[:12]
+    return mirror_dir / "git" / f"{name}-{digest}.git"
+
+
+def mirror_env(snapshot: dict, mirror_dir: Path, cache_dir: Path) -> dict[str, str]:
+    """
+    Environment variables making git clone from the mirrors, and uv and pip
+    install from the mirrored packages with an empty cache.
+    """
+    env = {}
+    rewrites = []
+    for url in _snapshot_repos(snapshot):
+        mirror = _mirror_path(mirror_dir, url)
+        if mirror.exists():
+            base = url.removesuffix(".git")
+            rewrites += [(mirror.as_uri(), base), (mirror.as_uri(), f"{base}.git")]
+    # git picks the longest matching prefix, so every url maps to its mirror
+    env["GIT_CONFIG_COUNT"] = str(len(rewrites))
+    for i, (mirror, url) in enumerate(rewrites):
+        env[f"GIT_CONFIG_KEY_{i}"] = f"url.{mirror}.insteadOf"
+        env[f"GIT_CONFIG_VALUE_{i}"] = url
+    wheels = mirror_dir / "wheels"
+    if wheels.is_dir():
+        env.update(
+            UV_FIND_LINKS=str(wheels),
+            UV_OFFLINE="1",
+            PIP_FIND_LINKS=str(wheels),
+            PIP_NO_INDEX="1",
+        )
+    env["UV_CACHE_DIR"] = str(cache_dir)
+    return env
+
+
+@contextlib.contextmanager
+def _patched_environ(env: dict[str, str]):
+    saved = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+def prepare_mirrors(cpack: Path, mirror_dir: Path, verbose: int = 0) -> None:
+    """
+    Mirror the git repositories of a package, and download the packages it
+    installs and its models, by unpacking it once.
+    """
+    from .package import install, read_cpack_manifest
+
+    snapshot = read_cpack_manifest(cpack).snapshot
+    stdout = None if verbose > 0 else subprocess.DEVNULL
+    for url in _snapshot_repos(snapshot):
+        mirror = _mirror_path(mirror_dir, url)
+        if mirror.exists():
+            print(f"Updating the mirror of {url}")
+            subprocess.check_call(
+                ["git", "--git-dir", str(mirror), "remote", "update", "--prune"],
+                stdout=stdout,
+            )
+            continue
+        print(f"Mirroring {url}")
+        mirror.parent.mkdir(parents=True, exist_ok=True)
+        subprocess.check_call(["git", "clone", "--mirror", url, str(mirror)], stdout=stdout)
+        # comfy-pack fetches commits by hash with a blob filter
+        for key in ("uploadpack.allowFilter", "uploadpack.allowAnySHA1InWant"):
+            subprocess.check_call(["git", "--git-dir", str(mirror), "config", key, "true"])
+
+    with tempfile.TemporaryDirectory(prefix="cpack-mirror-") as temp_dir:
+        workspace = Path(temp_dir) / "workspace"
+        env = mirror_env(snapshot, mirror_dir, Path(temp_dir) / "uv-cache")
+        for key in ("UV_FIND_LINKS", "UV_OFFLINE", "PIP_FIND_LINKS", "PIP_NO_INDEX"):
+            env.pop(key, None)
+        with _patched_environ(env):
+            # the models end up in the model store, where later unpacks link them
+            install(cpack, workspace, verbose=verbose)
+        python = workspace / ".venv" / "bin" / "python"
+        frozen = subprocess.check_output(
+            [str(python), "-m", "pip", "freeze", "--all", "--exclude-editable"], text=True
+        )
+        requirements = Path(temp_dir) / "requirements.txt"
+        # packages installed from git or local paths have no wheel to mirror
+        requirements.write_text(
+            "\n".join(line for line in frozen.splitlines() if " @ " not in line)
+        )
+        print("Downloading the packages")
+        subprocess.check_call(
+            [str(python), "-m", "pip", "download", "--no-deps"]
+            + ["-d", str(mirror_dir / "wheels"), "-r", str(requirements)],
+            stdout=stdout,
+        )
+
+
+def bench_install(
+    cpack: Path, mirror_dir: Path, runs: int = 3, verbose: int = 0
+) -> dict[str, Any]:
+    """
+    Unpack the package `runs` times into fresh workspaces against the
+    mirrors, and aggregate the timing reports of the runs.
+    """
+    import statistics
+
+    from .package import install, read_cpack_manifest
+
+    snapshot = read_cpack_manifest(cpack).snapshot
+    reports = []
+    for i in range(runs):
+        print(f"Unpack {i + 1}/{runs}", file=sys.stderr)
+        with tempfile.TemporaryDirectory(prefix="cpack-bench-") as temp_dir:
+            temp = Path(temp_dir)
+            env = mirror_env(snapshot, mirror_dir, temp / "uv-cache")
+            quiet = open(os.devnull, "w") if verbose == 0 else None
+            with _patched_environ(env), contextlib.redirect_stdout(
+                quiet or sys.stdout
+            ):
+                install(
+                    cpack,
+                    temp / "workspace",
+                    verbose=verbose,
+                    timing_report=temp / "timing.json",
+                )
+            if quiet is not None:
+                quiet.close()
+            reports.append(json.loads((temp / "timing.json").read_text()))
+
+    categories = sorted({c for r in reports for c in r["categories"]})
+    return {
+        "cpack": str(cpack.absolute()),
+        "runs": runs,
+        "elapsed": {
+            "median": round(statistics.median(r["elapsed"] for r in reports), 3),
+            "max": round(max(r["elapsed"] for r in reports), 3),
+        },
+        "categories": {
+            c: {
+                "median": round(
+                    statistics.median(r["categories"].get(c, 0.0) for r in reports), 3
+                ),
+                "max": round(max(r["categories"].get(c, 0.0) for r in reports), 3),
+            }
+            for c in categories
+        },
+        "reports": reports,
+    }
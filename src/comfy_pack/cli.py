@@ -5,13 +5,17 @@ import shutil
 import subprocess
 import sys
 import tempfile
-import zipfile
 from pathlib import Path
 
 import click
 
-from .const import COMFY_PACK_REPO, COMFYUI_MANAGER_REPO, COMFYUI_REPO, WORKSPACE_DIR
-from .hash import get_sha256
+from .const import (
+    BENCHMARKS,
+    COMFY_PACK_REPO,
+    COMFYUI_MANAGER_REPO,
+    COMFYUI_REPO,
+    WORKSPACE_DIR,
+)
 from .utils import get_self_git_commit
 
 
@@ -280,6 +284,42 @@ def init(dir: str, verbose: int):
     help="Preheat the workspace after unpacking",
     default=False,
 )
+@click.option(
+    "--interactive",
+    is_flag=True,
+    help="Ask for the models that could not be downloaded",
+    default=False,
+)
+@click.option(
+    "--download-workers",
+    default=4,
+    type=click.IntRange(min=1),
+    help="Number of models downloaded at the same time",
+)
+@click.option(
+    "--download-budget",
+    default=None,
+    help="Maximum total size of the models downloaded at the same time, e.g. 20G",
+)
+@click.option(
+    "--models-report",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Where to write the JSON report of the model retrieval "
+    "(default: cpack_models.json in the workspace)",
+)
+@click.option(
+    "--lazy-models",
+    is_flag=True,
+    help="Download models the first time ComfyUI loads them instead of now",
+    default=False,
+)
+@click.option(
+    "--timing-report",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Write the time spent in each phase of the unpack to this JSON file",
+)
 def unpack_cmd(
     cpack: str,
     dir: str,
@@ -288,11 +328,23 @@ def unpack_cmd(
     no_venv: bool,
     verbose: int,
     preheat: bool,
+    interactive: bool,
+    download_workers: int,
+    download_budget: str | None,
+    models_report: str | None,
+    lazy_models: bool,
+    timing_report: str | None,
 ):
     import rich
 
+    from .model_store import parse_size
     from .package import install
 
+    try:
+        budget = parse_size(download_budget) if download_budget else None
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--download-budget")
+
     install(
         cpack,
         dir,
@@ -301,6 +353,12 @@ def unpack_cmd(
         prepare_models=not no_models,
         no_venv=no_venv,
         preheat=preheat,
+        interactive=interactive,
+        download_workers=download_workers,
+        download_budget=budget,
+        models_report=models_report,
+        lazy_models=lazy_models,
+        timing_report=timing_report,
     )
     rich.print("\n[green]✓ ComfyUI Workspace is restored![/green]")
     rich.print(f"{dir}")
@@ -350,8 +408,10 @@ def _print_schema(schema, verbose: int = 0):
 
 @functools.lru_cache
 def _get_cache_workspace(cpack: str):
-    sha = get_sha256(cpack)
-    return WORKSPACE_DIR / sha[0:8]
+    from .package import read_cpack_manifest
+
+    key = read_cpack_manifest(cpack).key
+    return WORKSPACE_DIR / key[0:16]
 
 
 @main.command(
@@ -371,19 +431,48 @@ def _get_cache_workspace(cpack: str):
     count=True,
     help="Increase verbosity level (use multiple times for more verbosity)",
 )
+@click.option(
+    "--batch",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Run once per row of a .jsonl or .csv file of inputs",
+)
+@click.option(
+    "--batch-depth",
+    default=2,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Number of batch rows submitted to ComfyUI at the same time",
+)
+@click.option(
+    "--batch-manifest",
+    type=click.Path(dir_okay=False),
+    help="Where to record the batch results, existing successes are skipped "
+    "(default: batch_manifest.jsonl in the output directory)",
+)
 @click.pass_context
-def run(ctx, cpack: str, output_dir: str, help: bool, verbose: int):
+def run(
+    ctx,
+    cpack: str,
+    output_dir: str,
+    help: bool,
+    verbose: int,
+    batch: str | None,
+    batch_depth: int,
+    batch_manifest: str | None,
+):
     import rich
     from pydantic import ValidationError
 
+    from .package import read_cpack_manifest
     from .utils import generate_input_model
 
     inputs = dict(
         zip([k.lstrip("-").replace("-", "_") for k in ctx.args[::2]], ctx.args[1::2])
     )
 
-    with zipfile.ZipFile(cpack) as z:
-        workflow = json.loads(z.read("workflow_api.json"))
+    workflow = read_cpack_manifest(cpack).workflow
+    if workflow is None:
+        raise click.ClickException(f"{cpack} has no workflow_api.json")
 
     input_model = generate_input_model(workflow)
 
@@ -396,6 +485,20 @@ def run(ctx, cpack: str, output_dir: str, help: bool, verbose: int):
         _print_schema(input_model.model_json_schema(), verbose)
         return 0
 
+    if batch:
+        if ctx.args:
+            raise click.UsageError("Inputs can't be given together with --batch")
+        return _run_batch(
+            cpack,
+            workflow,
+            input_model,
+            batch,
+            Path(output_dir).absolute(),
+            batch_depth,
+            Path(batch_manifest) if batch_manifest else None,
+            verbose,
+        )
+
     try:
         validated_data = input_model(**inputs)
         rich.print("[green]✓ Input is valid![/green]")
@@ -410,6 +513,152 @@ def run(ctx, cpack: str, output_dir: str, help: bool, verbose: int):
         _print_schema(input_model.model_json_schema(), verbose)
         return 1
 
+    from .daemon import is_alive, request, socket_path
+
+    workspace = _prepare_cache_workspace(cpack, verbose=verbose)
+    sock_file = socket_path(workspace)
+    if is_alive(sock_file):
+        rich.print("\n[green]✓ Running on the local comfy-pack daemon[/green]")
+        inputs = {
+            # the daemon doesn't share our working directory
+            k: v.absolute().as_posix() if isinstance(v, Path) else v
+            for k, v in validated_data.model_dump().items()
+        }
+        results = request(
+            sock_file,
+            {
+                "op": "run",
+                "workflow": workflow,
+                "output_dir": str(Path(output_dir).absolute()),
+                "verbose": verbose,
+                "inputs": inputs,
+            },
+        )
+        _print_results(results)
+        return
+
+    from .run import ComfyUIServer, run_workflow
+
+    with ComfyUIServer(str(workspace.absolute()), verbose=verbose) as server:
+        rich.print("\n[green]✓ ComfyUI is launched in the background![/green]")
+        results = run_workflow(
+            server.host,
+            server.port,
+            workflow,
+            Path(output_dir).absolute(),
+            verbose=verbose,
+            workspace=server.workspace,
+            **validated_data.model_dump(),
+        )
+        _print_results(results)
+
+
+def _run_batch(
+    cpack: str,
+    workflow: dict,
+    input_model,
+    batch: str,
+    output_dir: Path,
+    depth: int,
+    manifest: Path | None,
+    verbose: int,
+):
+    import contextlib
+
+    import rich
+    from pydantic import ValidationError
+
+    from .batch import load_completed, read_batch_inputs, run_batch
+    from .daemon import is_alive, request, socket_path
+
+    rows = []
+    errors = []
+    for index, row in enumerate(read_batch_inputs(batch)):
+        try:
+            data = input_model(**row).model_dump()
+        except ValidationError as e:
+            errors.append((index, e))
+            continue
+        # the daemon doesn't share our working directory
+        rows.append(
+            (
+                index,
+                {
+                    k: v.absolute().as_posix() if isinstance(v, Path) else v
+                    for k, v in data.items()
+                },
+            )
+        )
+    if errors:
+        rich.print(f"[red]✗ {len(errors)} rows are invalid![/red]")
+        for index, e in errors[:20]:
+            for error in e.errors():
+                rich.print(f"- row {index}, {error['loc'][0]}: {error['msg']}")
+        raise click.ClickException("Validation failed, nothing was run")
+
+    manifest = manifest or output_dir / "batch_manifest.jsonl"
+    completed = load_completed(manifest)
+    todo = [(index, data) for index, data in rows if index not in completed]
+    rich.print(
+        f"[green]✓ {len(rows)} rows are valid, {len(rows) - len(todo)} already done[/green]"
+    )
+    if not todo:
+        return
+
+    workspace = _prepare_cache_workspace(cpack, verbose=verbose)
+    sock_file = socket_path(workspace)
+    with contextlib.ExitStack() as stack:
+        if is_alive(sock_file):
+            rich.print("\n[green]✓ Running on the local comfy-pack daemon[/green]")
+
+            def run_one(index: int, inputs: dict):
+                return request(
+                    sock_file,
+                    {
+                        "op": "run",
+                        "workflow": workflow,
+                        "output_dir": str(output_dir / f"{index:06d}"),
+                        "verbose": verbose,
+                        "inputs": inputs,
+                    },
+                )
+
+        else:
+            from .run import ComfyUIServer, run_workflow
+
+            server = stack.enter_context(
+                ComfyUIServer(str(workspace.absolute()), verbose=verbose)
+            )
+            rich.print("\n[green]✓ ComfyUI is launched in the background![/green]")
+
+            def run_one(index: int, inputs: dict):
+                row_dir = output_dir / f"{index:06d}"
+                row_dir.mkdir(parents=True, exist_ok=True)
+                return run_workflow(
+                    server.host,
+                    server.port,
+                    workflow,
+                    row_dir,
+                    verbose=verbose,
+                    workspace=server.workspace,
+                    **inputs,
+                )
+
+        def on_result(entry: dict) -> None:
+            status = "[green]✓[/green]" if entry["ok"] else "[red]✗[/red]"
+            rich.print(f"{status} row {entry['index']} ({entry['elapsed']}s)")
+
+        succeeded, failed = run_batch(todo, run_one, manifest, depth, on_result)
+
+    rich.print(f"\n[green]✓ {succeeded} rows succeeded[/green], results in {manifest}")
+    if failed:
+        rich.print(f"[red]✗ {failed} rows failed, run again to retry them[/red]")
+        sys.exit(1)
+
+
+def _prepare_cache_workspace(cpack: str, verbose: int = 0) -> Path:
+    import rich
+
     from .package import install
 
     workspace = _get_cache_workspace(cpack)
@@ -422,31 +671,252 @@ def run(ctx, cpack: str, output_dir: str, help: bool, verbose: int):
             f.write("DONE")
     rich.print("\n[green]✓ ComfyUI Workspace is restored![/green]")
     rich.print(f"{workspace}")
+    return workspace
 
-    from .run import ComfyUIServer, run_workflow
 
-    with ComfyUIServer(str(workspace.absolute()), verbose=verbose) as server:
-        rich.print("\n[green]✓ ComfyUI is launched in the background![/green]")
-        results = run_workflow(
-            server.host,
-            server.port,
-            workflow,
-            Path(output_dir).absolute(),
+def _print_results(results) -> None:
+    import rich
+
+    rich.print("\n[green]✓ Workflow is executed successfully![/green]")
+    if results:
+        rich.print("\n[green]✓ Retrieved outputs:[/green]")
+    if isinstance(results, dict):
+        for field, value in results.items():
+            rich.print(f"{field}: {value}")
+    elif isinstance(results, list):
+        for i, value in enumerate(results):
+            rich.print(f"{i}: {value}")
+    else:
+        rich.print(results)
+
+
+@main.command(
+    name="serve-local",
+    help="Keep ComfyUI running for a package so that `comfy-pack run` reuses it",
+)
+@click.argument("cpack", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--idle-timeout",
+    default=600,
+    type=float,
+    show_default=True,
+    help="Stop after this many seconds without runs, 0 to never stop",
+)
+@click.option("--stop", is_flag=True, help="Stop the running daemon of the package")
+@click.option(
+    "--verbose",
+    "-v",
+    count=True,
+    help="Increase verbosity level (use multiple times for more verbosity)",
+)
+def serve_local_cmd(cpack: str, idle_timeout: float, stop: bool, verbose: int):
+    import rich
+
+    from .daemon import is_alive, request, serve_local, socket_path
+
+    if stop:
+        sock_file = socket_path(_get_cache_workspace(cpack))
+        if not is_alive(sock_file):
+            rich.print("[yellow]No daemon is running for this package[/yellow]")
+            return
+        request(sock_file, {"op": "stop"})
+        rich.print("[green]✓ Daemon is stopped[/green]")
+        return
+
+    workspace = _prepare_cache_workspace(cpack, verbose=verbose)
+    try:
+        serve_local(
+            workspace,
+            idle_timeout=idle_timeout,
             verbose=verbose,
-            workspace=server.workspace,
-            **validated_data.model_dump(),
+            on_ready=lambda sock_file: rich.print(
+                f"\n[green]✓ Serving {cpack} on {sock_file}[/green]"
+            ),
         )
-        rich.print("\n[green]✓ Workflow is executed successfully![/green]")
-        if results:
-            rich.print("\n[green]✓ Retrieved outputs:[/green]")
-        if isinstance(results, dict):
-            for field, value in results.items():
-                rich.print(f"{field}: {value}")
-        elif isinstance(results, list):
-            for i, value in enumerate(results):
-                rich.print(f"{i}: {value}")
-        else:
-            rich.print(results)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+
+@main.command(
+    name="bench",
+    help="Measure the overhead of comfy-pack against a fake ComfyUI server",
+)
+@click.argument("workflow", required=False, type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--only",
+    multiple=True,
+    type=click.Choice(BENCHMARKS),
+    help="Run only these benchmarks, can be repeated",
+)
+@click.option("--iterations", "-n", default=200, show_default=True)
+@click.option(
+    "--requests",
+    default=50,
+    show_default=True,
+    help="Number of requests of the end to end benchmarks",
+)
+@click.option("--concurrency", "-c", default=4, show_default=True)
+@click.option(
+    "--node-latency",
+    default=0.0,
+    type=float,
+    show_default=True,
+    help="Seconds each node takes in the fake ComfyUI",
+)
+@click.option("--output-size", default="64K", show_default=True)
+@click.option(
+    "--output", "-o", type=click.Path(dir_okay=False), help="Save the results as JSON"
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Results to compare with, failing on regressions",
+)
+@click.option(
+    "--max-regression",
+    default=0.25,
+    show_default=True,
+    help="Tolerated p95 increase over the baseline, as a fraction",
+)
+@click.option(
+    "--verbose",
+    "-v",
+    count=True,
+    help="Increase verbosity level (use multiple times for more verbosity)",
+)
+def bench_cmd(
+    workflow: str | None,
+    only: tuple[str, ...],
+    iterations: int,
+    requests: int,
+    concurrency: int,
+    node_latency: float,
+    output_size: str,
+    output: str | None,
+    baseline: str | None,
+    max_regression: float,
+    verbose: int,
+):
+    """WORKFLOW is an API format workflow or a .cpack.zip, a synthetic one by default"""
+    import rich
+    from rich.table import Table
+
+    from .bench import compare, run_benchmarks
+    from .model_store import parse_size
+
+    try:
+        size = parse_size(output_size)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--output-size")
+    template = None
+    if workflow and workflow.endswith(".zip"):
+        from .package import read_cpack_manifest
+
+        template = read_cpack_manifest(workflow).workflow
+        if template is None:
+            raise click.ClickException(f"{workflow} has no workflow_api.json")
+    elif workflow:
+        template = json.loads(Path(workflow).read_text())
+
+    report = run_benchmarks(
+        template,
+        benchmarks=only or BENCHMARKS,
+        iterations=iterations,
+        requests=requests,
+        concurrency=concurrency,
+        node_latency=node_latency,
+        output_size=size,
+        verbose=verbose,
+    )
+
+    table = Table("benchmark", "count", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms")
+    for name, summary in report["results"].items():
+        if "skipped" in summary:
+            table.add_row(name, f"[yellow]skipped: {summary['skipped']}[/yellow]")
+            continue
+        table.add_row(
+            name,
+            *(
+                str(summary[k])
+                for k in ("count", "errors", "throughput", "p50_ms", "p95_ms", "p99_ms")
+            ),
+        )
+    rich.print(table)
+    if output:
+        Path(output).write_text(json.dumps(report, indent=2))
+        rich.print(f"[green]✓ Results saved to {output}[/green]")
+    if baseline:
+        regressions = compare(
+            report, json.loads(Path(baseline).read_text()), max_regression
+        )
+        if regressions:
+            for line in regressions:
+                rich.print(f"[red]✗ {line}[/red]")
+            raise SystemExit(1)
+        rich.print("[green]✓ No regression over the baseline[/green]")
+
+
+@main.command(
+    name="bench-install",
+    help="Time the phases of unpacking a package against local mirrors",
+)
+@click.argument("cpack", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--mirror-dir",
+    default=".cpack-mirror",
+    type=click.Path(file_okay=False),
+    show_default=True,
+    help="Directory of the git and package mirrors",
+)
+@click.option(
+    "--prepare",
+    is_flag=True,
+    help="Create or update the mirrors by unpacking the package once",
+)
+@click.option("--runs", "-n", default=3, show_default=True)
+@click.option(
+    "--output", "-o", type=click.Path(dir_okay=False), help="Save the results as JSON"
+)
+@click.option(
+    "--verbose",
+    "-v",
+    count=True,
+    help="Increase verbosity level (use multiple times for more verbosity)",
+)
+def bench_install_cmd(
+    cpack: str,
+    mirror_dir: str,
+    prepare: bool,
+    runs: int,
+    output: str | None,
+    verbose: int,
+):
+    import rich
+    from rich.table import Table
+
+    from .bench import bench_install, prepare_mirrors
+
+    mirrors = Path(mirror_dir)
+    if prepare:
+        prepare_mirrors(Path(cpack), mirrors, verbose=verbose)
+    elif not mirrors.is_dir():
+        raise click.ClickException(
+            f"No mirrors in {mirror_dir}, create them with --prepare"
+        )
+    report = bench_install(Path(cpack), mirrors, runs=runs, verbose=verbose)
+
+    table = Table("category", "median s", "max s")
+    for category, times in report["categories"].items():
+        table.add_row(category, str(times["median"]), str(times["max"]))
+    table.add_row(
+        "[bold]total[/bold]",
+        str(report["elapsed"]["median"]),
+        str(report["elapsed"]["max"]),
+    )
+    rich.print(table)
+    if output:
+        Path(output).write_text(json.dumps(report, indent=2))
+        rich.print(f"[green]✓ Results saved to {output}[/green]")
 
 
 @main.command(name="build-bento")
@@ -546,3 +1016,105 @@ def unpack_bento(bento: str, workspace: Path, verbose: int):
         f"You can start ComfyUI by running `cd {workspace} && .venv/{exe} main.py`",
         color="green",
     )
+
+
+@main.group(name="source-index")
+def source_index_cmd():
+    """Manage the local index of model sources used before any network lookup."""
+    pass
+
+
+@source_index_cmd.command(name="import")
+@click.argument("dump", type=click.Path(exists=True, dir_okay=False))
+def source_index_import(dump: str):
+    """Replace the model source index with the content of DUMP."""
+    import rich
+
+    from .source_index import import_dump
+
+    meta = import_dump(dump)
+    rich.print(
+        f"[green]✓ Imported {meta['count']} model sources "
+        f"(version {meta['version']})[/green]"
+    )
+
+
+@source_index_cmd.command(name="export")
+@click.argument("dump", type=click.Path(dir_okay=False))
+@click.option("--version", help="Version recorded in the dump header")
+def source_index_export(dump: str, version: str | None):
+    """Write the resolved model sources of this host to DUMP."""
+    import rich
+
+    from .source_cache import SourceCache
+    from .source_index import SourceIndex, export_dump
+
+    with SourceCache() as cache, SourceIndex() as index:
+        entries = dict(index.search("", limit=-1))
+        entries.update(cache.iter_found())
+    count = export_dump(sorted(entries.items()), dump, version=version)
+    rich.print(f"[green]✓ Exported {count} model sources to {dump}[/green]")
+
+
+@source_index_cmd.command(name="search")
+@click.argument("prefix")
+@click.option("--limit", default=20, help="Maximum number of results")
+def source_index_search(prefix: str, limit: int):
+    """Look up model sources by SHA-256 prefix."""
+    import rich
+
+    from .source_index import SourceIndex
+
+    with SourceIndex() as index:
+        if not index.meta:
+            rich.print("[yellow]No model source index, run `import` first[/yellow]")
+            return
+        for sha, source in index.search(prefix, limit=limit):
+            rich.print(f"{sha}: {json.dumps(source)}")
+
+
+@main.command(name="gc")
+@click.option(
+    "--max-size",
+    help="Keep unreferenced models as a cache up to this total store size, e.g. 200G",
+)
+@click.option(
+    "--verify",
+    "verify_sample",
+    default=0,
+    help="Re-hash this many models and drop the corrupted ones",
+)
+@click.option(
+    "--include-legacy",
+    is_flag=True,
+    default=False,
+    help="Also collect models stored before references were tracked",
+)
+@click.option("--dry-run", is_flag=True, default=False, help="Only report")
+def gc_cmd(
+    max_size: str | None, verify_sample: int, include_legacy: bool, dry_run: bool
+):
+    """Remove the stored models that no workspace references anymore."""
+    import rich
+
+    from .model_store import ModelStore, parse_size
+
+    with ModelStore() as store:
+        report = store.gc(
+            max_size=parse_size(max_size) if max_size else None,
+            include_legacy=include_legacy,
+            verify_sample=verify_sample,
+            dry_run=dry_run,
+        )
+    if report.stale_refs:
+        rich.print(f"Dropped {report.stale_refs} stale workspace references")
+    if report.verified:
+        rich.print(f"Verified {report.verified} models")
+    for sha in report.corrupted:
+        rich.print(f"[red]✗ Model {sha} is corrupted[/red]")
+    action = "Would remove" if dry_run else "Removed"
+    rich.print(
+        f"[green]✓ {action} {len(report.removed)} models, "
+        f"{report.freed / 1024**3:.2f} GiB freed, "
+        f"{report.total_size / 1024**3:.2f} GiB in use[/green]"
+    )
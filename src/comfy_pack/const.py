@@ -11,12 +11,27 @@ if not CPACK_HOME.exists():
     CPACK_HOME.mkdir()
 
 MODEL_DIR = CPACK_HOME / "models"
+MODEL_STORE_DB_FILE = CPACK_HOME / "model_store.db"
 WORKSPACE_DIR = CPACK_HOME / "workspace"
+DAEMON_DIR = CPACK_HOME / "run"
+RESULT_CACHE_DIR = CPACK_HOME / "results"
 SHA_CACHE_FILE = CPACK_HOME / "sha_cache.json"
 MODEL_SOURCE_CACHE_FILE = CPACK_HOME / "model_source_cache.json"
+MODEL_SOURCE_DB_FILE = CPACK_HOME / "model_sources.db"
+MODEL_SOURCE_INDEX_FILE = CPACK_HOME / "model_source_index.db"
+MODEL_INVENTORY_FILE = CPACK_HOME / "model_inventory.json"
 
 COMFYUI_REPO = "https://github.com/comfyanonymous/ComfyUI.git"
 COMFY_PACK_REPO = "https://github.com/bentoml/comfy-pack.git"
 COMFYUI_MANAGER_REPO = "https://github.com/ltdrdata/ComfyUI-Manager.git"
 
 STRICT_MODE = os.environ.get("CPACK_STRICT_MODE", "0") in ["1", "true", "True"]
+
+# Seconds before a model source lookup is retried, 0 means never
+SOURCE_CACHE_TTL = float(os.environ.get("CPACK_SOURCE_TTL", "0"))
+SOURCE_CACHE_NEGATIVE_TTL = float(
+    os.environ.get("CPACK_SOURCE_NEGATIVE_TTL", str(7 * 24 * 3600))
+)
+
+# Benchmarks of `comfy-pack bench`, see comfy_pack.bench
+BENCHMARKS = ("populate", "retrieve", "zip", "submit", "run_workflow", "service")
@@ -0,0 +1,181 @@
+"""
+A local daemon that keeps one ComfyUI server warm for a workspace.
+
+`comfy-pack serve-local` starts ComfyUI once and accepts workflow runs on
+a Unix socket, so that consecutive `comfy-pack run` invocations don't pay
+for the ComfyUI startup and model loading again. The daemon stops after
+it has been idle for a while.
+
+The protocol is one JSON request and one JSON response per connection,
+each on a single line.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from .const import DAEMON_DIR
+
+DEFAULT_IDLE_TIMEOUT = 600
+
+logger = logging.getLogger(__name__)
+
+
+def socket_path(workspace: str | Path) -> Path:
+    """The socket of the daemon serving `workspace`"""
+    # keep the path short, Unix socket paths are limited to ~100 bytes
+    digest = hashlib.sha256(str(Path(workspace).absolute()).encode()).hexdigest()
+    return DAEMON_DIR / f"{digest[:16]}.sock"
+
+
+def request(sock_file: Path, payload: dict, timeout: float | None = None) -> Any:
+    """Send one request to the daemon, raising RuntimeError if it failed"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(str(sock_file))
+        s.sendall(json.dumps(payload).encode() + b"\n")
+        with s.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise RuntimeError("The comfy-pack daemon closed the connection")
+    response = json.loads(line)
+    if not response.get("ok"):
+        raise RuntimeError(response.get("error") or "Unknown daemon error")
+    return response.get("result")
+
+
+def is_alive(sock_file: Path) -> bool:
+    try:
+        request(sock_file, {"op": "ping"}, timeout=5)
+    except (OSError, RuntimeError, ValueError):
+        return False
+    return True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: DaemonServer
+
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        if not line:
+            return
+        with self.server.activity():
+            try:
+                result = self.server.dispatch(json.loads(line))
+                response = {"ok": True, "result": result}
+            except Exception as e:
+                logger.exception("Request failed")
+                response = {"ok": False, "error": f"{e.__class__.__name__}: {e}"}
+        self.wfile.write(json.dumps(response, default=str).encode() + b"\n")
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        sock_file: Path,
+        comfy_server,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        verbose: int = 0,
+    ) -> None:
+        self.sock_file = sock_file
+        self.comfy_server = comfy_server
+        self.idle_timeout = idle_timeout
+        self.verbose = verbose
+        self._active = 0
+        self._last_active = time.monotonic()
+        self._lock = threading.Lock()
+        super().__init__(str(sock_file), _Handler)
+        # the daemon runs workflows on behalf of whoever can connect
+        os.chmod(sock_file, 0o600)
+
+    @contextlib.contextmanager
+    def activity(self):
+        """Keep the daemon alive while a request is being handled"""
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._last_active = time.monotonic()
+
+    def dispatch(self, payload: dict) -> Any:
+        from .run import run_workflow
+
+        op = payload.get("op")
+        if op == "ping":
+            return {"workspace": self.comfy_server.workspace, "pid": os.getpid()}
+        if op == "stop":
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return None
+        if op == "run":
+            output_dir = Path(payload["output_dir"])
+            output_dir.mkdir(parents=True, exist_ok=True)
+            return run_workflow(
+                self.comfy_server.host,
+                self.comfy_server.port,
+                payload["workflow"],
+                output_dir,
+                verbose=payload.get("verbose", self.verbose),
+                workspace=self.comfy_server.workspace,
+                **payload.get("inputs", {}),
+            )
+        raise ValueError(f"Unknown operation: {op}")
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(1)
+            if not self.comfy_server.is_running():
+                logger.warning("ComfyUI exited, stopping the daemon")
+                break
+            with self._lock:
+                idle = self._active == 0 and (
+                    time.monotonic() - self._last_active > self.idle_timeout
+                )
+            if self.idle_timeout > 0 and idle:
+                logger.info("Idle for %ss, stopping the daemon", self.idle_timeout)
+                break
+        self.shutdown()
+
+    def serve(self) -> None:
+        threading.Thread(target=self._watch, daemon=True).start()
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            self.sock_file.unlink(missing_ok=True)
+
+
+def serve_local(
+    workspace: str | Path,
+    idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+    verbose: int = 0,
+    on_ready=None,
+) -> None:
+    """Run ComfyUI for `workspace` and serve runs until idle for `idle_timeout` seconds"""
+    from .run import ComfyUIServer
+
+    sock_file = socket_path(workspace)
+    if is_alive(sock_file):
+        raise RuntimeError(f"A comfy-pack daemon is already serving {workspace}")
+    sock_file.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    sock_file.unlink(missing_ok=True)
+
+    with ComfyUIServer(str(Path(workspace).absolute()), verbose=verbose) as server:
+        daemon = DaemonServer(sock_file, server, idle_timeout, verbose=verbose)
+        if on_ready is not None:
+            on_ready(sock_file)
+        daemon.serve()
@@ -6,7 +6,7 @@ import sys
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import partial
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 from .const import SHA_CACHE_FILE
 
@@ -52,7 +52,16 @@ def batch_get_sha256(filepaths: List[str], cache_only: bool = False) -> Dict[str
 async def async_batch_get_sha256(
     filepaths: List[str],
     cache_only: bool = False,
+    known_stats: Optional[Dict[str, Tuple[int, float]]] = None,
 ) -> Dict[str, str]:
+    """
+    Get the SHA-256 of the files, using the cache when size and ctime match.
+
+    `known_stats` maps a file path to its already known `(size, ctime)`,
+    e.g. from an inventory that may be out of date. A file whose known
+    stats don't match its cache entry isn't stat-ed again, one whose stats
+    match is, before its cached hash is trusted.
+    """
     # Load cache
     cache = {}
     if SHA_CACHE_FILE.exists():
@@ -73,17 +82,26 @@ async def async_batch_get_sha256(
             loop = asyncio.get_event_loop()
 
             for filepath in filepaths:
-                if not os.path.exists(filepath):
-                    results[filepath] = None
-                    continue
-
+                cache_entry = cache.get(filepath)
                 # Get file info
-                stat = os.stat(filepath)
-                current_size = stat.st_size
-                current_time = stat.st_ctime
+                known = known_stats.get(filepath) if known_stats else None
+                if known is not None and not (
+                    cache_entry
+                    and (cache_entry["size"], cache_entry["birthtime"]) == known
+                ):
+                    current_size, current_time = known
+                else:
+                    # a match of the known stats may be out of date, e.g. a
+                    # file replaced in place
+                    try:
+                        stat = os.stat(filepath)
+                    except OSError:
+                        results[filepath] = None
+                        continue
+                    current_size = stat.st_size
+                    current_time = stat.st_ctime
 
                 # Check cache
-                cache_entry = cache.get(filepath)
                 if cache_entry:
                     if (
                         cache_entry["size"] == current_size
@@ -110,6 +128,8 @@ async def async_batch_get_sha256(
                 results[filepath] = sha256
 
     # Save cache
+    if not new_cache:
+        return results
     try:
         with SHA_CACHE_FILE.open("r") as f:
             cache = json.load(f)
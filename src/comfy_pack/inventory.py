@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from .const import MODEL_INVENTORY_FILE
+
+INVENTORY_VERSION = 1
+
+
+@dataclass(frozen=True)
+class ModelFile:
+    path: str
+    size: int
+    atime: float
+    ctime: float
+
+
+def _git_tracked_files(root: Path) -> set[str]:
+    """Files tracked by the ComfyUI repo, e.g. the `put_*_here` placeholders."""
+    try:
+        result = subprocess.run(
+            ["git", "ls-files", "-z", "."],
+            cwd=root,
+            capture_output=True,
+            check=True,
+        )
+    except (subprocess.SubprocessError, FileNotFoundError):
+        return set()
+    return {
+        os.path.normpath(os.path.join(root, name))
+        for name in result.stdout.decode().split("\0")
+        if name
+    }
+
+
+class ModelInventory:
+    """
+    A persistent listing of the files under a models directory.
+
+    Each directory is only re-listed when its mtime changes, so a refresh
+    costs one ``stat`` per directory instead of one per file. The listing
+    is saved to ``MODEL_INVENTORY_FILE`` and reused across restarts.
+    """
+
+    def __init__(
+        self,
+        root: str | Path,
+        cache_file: Path = MODEL_INVENTORY_FILE,
+        min_interval: float = 2.0,
+    ) -> None:
+        self.root = Path(root).absolute()
+        self.cache_file = cache_file
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._dirs: dict[str, dict] = self._load()
+        self._tracked: set[str] | None = None
+        self._files: list[ModelFile] | None = None
+        self._last_refresh = 0.0
+
+    def _load(self) -> dict[str, dict]:
+        try:
+            data = json.loads(self.cache_file.read_text())
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != INVENTORY_VERSION:
+            return {}
+        return data.get("roots", {}).get(str(self.root), {})
+
+    def _save(self) -> None:
+        try:
+            data = json.loads(self.cache_file.read_text())
+            if data.get("version") != INVENTORY_VERSION:
+                raise ValueError
+        except (OSError, ValueError):
+            data = {"version": INVENTORY_VERSION, "roots": {}}
+        data["roots"][str(self.root)] = self._dirs
+        tmp = self.cache_file.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, self.cache_file)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+
+    def _list_dir(self, path: str, mtime: int) -> dict:
+        files = {}
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name != ".git":
+                            subdirs.append(entry.name)
+                        continue
+                    if entry.name.startswith("."):
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                files[entry.name] = [st.st_size, st.st_atime, st.st_ctime]
+        return {"mtime": mtime, "files": files, "subdirs": sorted(subdirs)}
+
+    def _scan(self) -> tuple[dict[str, dict], bool]:
+        dirs = {}
+        changed = False
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            path = os.path.join(self.root, rel) if rel else str(self.root)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                changed = True
+                continue
+            entry = self._dirs.get(rel)
+            if entry is None or entry["mtime"] != mtime:
+                try:
+                    entry = self._list_dir(path, mtime)
+                except OSError:
+                    changed = True
+                    continue
+                changed = True
+            dirs[rel] = entry
+            stack.extend(os.path.join(rel, sub) for sub in entry["subdirs"])
+        if set(dirs) != set(self._dirs):
+            changed = True
+        return dirs, changed
+
+    def refresh(self, force: bool = False) -> list[ModelFile]:
+        """Bring the inventory up to date and return the model files."""
+        with self._lock:
+            now = time.monotonic()
+            if (
+                not force
+                and self._files is not None
+                and now - self._last_refresh < self.min_interval
+            ):
+                return self._files
+            if self._tracked is None:
+                self._tracked = _git_tracked_files(self.root)
+
+            dirs, changed = self._scan()
+            self._dirs = dirs
+            if changed:
+                self._save()
+            if changed or self._files is None:
+                self._files = [
+                    ModelFile(path, *stat)
+                    for rel, entry in sorted(dirs.items())
+                    for name, stat in sorted(entry["files"].items())
+                    if (path := os.path.join(self.root, rel, name))
+                    not in self._tracked
+                ]
+            self._last_refresh = time.monotonic()
+            return self._files
+
+    def invalidate(self, path: str | Path | None = None) -> None:
+        """Force the directory containing `path` (or everything) to be re-listed."""
+        with self._lock:
+            self._last_refresh = 0.0
+            if path is None:
+                self._dirs = {}
+                return
+            rel = os.path.relpath(Path(path).absolute().parent, self.root)
+            self._dirs.pop("" if rel == "." else rel, None)
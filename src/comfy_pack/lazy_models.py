@@ -0,0 +1,123 @@
+"""
+Lazy model materialization for ComfyUI workspaces.
+
+Instead of downloading every model before ComfyUI starts, a deferred model
+is left as a placeholder: a symlink to its not yet existing blob in the
+model store. ComfyUI lists the placeholder like any other model, and the
+comfy-pack custom node fetches the blob the first time ComfyUI resolves
+the model path. The sources of the deferred models are recorded in a
+manifest at the root of the workspace.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+from .const import MODEL_DIR
+from .model_store import SHA256_PATTERN, ModelStore
+
+LAZY_MANIFEST_FILE = ".cpack_lazy_models.json"
+
+logger = logging.getLogger(__name__)
+
+_manifest_lock = threading.Lock()
+_fetch_locks: dict[str, threading.Lock] = {}
+
+
+def _read_manifest(workspace: Path) -> dict[str, dict]:
+    try:
+        return json.loads((workspace / LAZY_MANIFEST_FILE).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(workspace: Path, manifest: dict[str, dict]) -> None:
+    manifest_file = workspace / LAZY_MANIFEST_FILE
+    tmp = manifest_file.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, manifest_file)
+
+
+def defer_models(models: list[dict], workspace: Path) -> None:
+    """Create placeholders for `models` and record where to fetch them from"""
+    with _manifest_lock, ModelStore() as store:
+        manifest = _read_manifest(workspace)
+        for model in models:
+            sha = model["sha256"]
+            target = workspace / model["filename"]
+            if target.is_symlink():
+                target.unlink()
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.symlink(MODEL_DIR / sha, target)
+            # keeps `gc` off the blob once fetched, or already in the store
+            store.add_ref(sha, target)
+            manifest[sha] = {
+                "filename": model["filename"],
+                "size": model.get("size"),
+                "download_url": model["source"]["download_url"],
+            }
+        _write_manifest(workspace, manifest)
+
+
+def is_placeholder(path: str | Path) -> bool:
+    """Whether `path` is a symlink to a blob missing from the model store"""
+    path = Path(path)
+    if not path.is_symlink() or path.exists():
+        return False
+    target = Path(os.readlink(path))
+    return target.parent == MODEL_DIR and bool(SHA256_PATTERN.match(target.name))
+
+
+def materialize(path: str | Path, workspace: Path) -> bool:
+    """
+    Fetch the blob behind a placeholder. Returns False if `path` is not a
+    placeholder of the workspace, raises if the model can't be fetched.
+    """
+    from .package import fetch_model_blob
+
+    path = Path(path)
+    if not is_placeholder(path):
+        return False
+    sha = Path(os.readlink(path)).name
+    entry = _read_manifest(workspace).get(sha)
+    if entry is None:
+        return False
+
+    with _manifest_lock:
+        lock = _fetch_locks.setdefault(sha, threading.Lock())
+    with lock:
+        # another thread may have fetched it while we were waiting
+        if not (MODEL_DIR / sha).exists():
+            logger.info("Fetching model %s on first use", entry["filename"])
+            fetch_model_blob(sha, entry["download_url"], quiet=True)
+    with ModelStore() as store:
+        store.add_ref(sha, path)
+    with _manifest_lock:
+        manifest = _read_manifest(workspace)
+        if manifest.pop(sha, None) is not None:
+            _write_manifest(workspace, manifest)
+    return True
+
+
+def patch_folder_paths(folder_paths) -> None:
+    """Make ComfyUI's model path lookup materialize placeholders"""
+    workspace = Path(folder_paths.base_path)
+    get_full_path = folder_paths.get_full_path
+
+    @functools.wraps(get_full_path)
+    def wrapped(folder_name, filename):
+        try:
+            folders = folder_paths.get_folder_paths(folder_name)
+        except KeyError:
+            folders = []
+        # a placeholder is a broken symlink, which ComfyUI would skip
+        for folder in folders:
+            materialize(os.path.join(folder, filename), workspace)
+        return get_full_path(folder_name, filename)
+
+    folder_paths.get_full_path = wrapped
@@ -1,8 +1,15 @@
+from __future__ import annotations
+
 import asyncio
 import json
 import re
+from typing import TYPE_CHECKING, Any
+
+from .source_cache import SourceCache
+from .source_index import SourceIndex
 
-from .const import MODEL_SOURCE_CACHE_FILE
+if TYPE_CHECKING:
+    import aiohttp
 
 # MODEL_NAME = r"[a-zA-Z0-9-._]+"
 # COMMIT = r"[a-f0-9]+"
@@ -13,155 +20,266 @@ PATH_PATTERN = re.compile(
     r'data-target="CopyButton" data-props="{&quot;value&quot;:&quot;([^&]+)&quot;'
 )
 
+CIVITAI_SEARCH_URL = "https://meilisearch-v1-9.civitai.com/multi-search"
+CIVITAI_URL = "https://civitai.com"
 
-async def _lookup_huggingface_model(model_sha: str) -> dict:
-    import aiohttp
+# Concurrent lookups in a batch, the web searches are throttled separately
+LOOKUP_CONCURRENCY = 8
+SEARCH_CONCURRENCY = 2
+MAX_RETRIES = 4
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+async def _request(
+    session: aiohttp.ClientSession,
+    method: str,
+    url: str,
+    **kwargs: Any,
+) -> tuple[int, bytes]:
+    """Send a request, backing off when rate limited. Returns (status, body)."""
+    delay = 1.0
+    for attempt in range(MAX_RETRIES + 1):
+        async with session.request(method, url, **kwargs) as resp:
+            if resp.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                return resp.status, await resp.read()
+            retry_after = resp.headers.get("Retry-After", "")
+        try:
+            wait = min(float(retry_after), 60.0)
+        except ValueError:
+            wait = delay
+        await asyncio.sleep(wait)
+        delay *= 2
+    raise AssertionError("unreachable")
+
+
+def _search_huggingface_blobs(model_sha: str) -> list[str]:
     from duckduckgo_search import DDGS
+
     query = f"site:huggingface.co blob {model_sha}"
+    with DDGS() as ddgs:
+        return [r["href"] for r in ddgs.text(query, max_results=5)]
 
-    try:
-        with DDGS() as ddgs:
-            search_results = ddgs.text(query, max_results=5)
-
-            async with aiohttp.ClientSession(trust_env=True) as session:
-                for result in search_results:
-                    url = result['href']
-                    if "blob" not in url:
-                        continue
-
-                    try:
-                        async with session.get(url) as resp:
-                            if resp.status != 200:
-                                continue
-                            text = await resp.text()
-                            if commit_match := COMMIT_PATTERN.search(text):
-                                repo, commit = commit_match.groups()
-                                if path_match := PATH_PATTERN.search(text):
-                                    path = path_match.group(1)
-                                    info = {
-                                        "download_url": path,
-                                        "url": path,
-                                        "repo": repo,
-                                        "commit": commit,
-                                        "path": path,
-                                        "source": "huggingface",
-                                    }
-                                    return info
-                    except aiohttp.ClientError:
-                        continue
-    except Exception:
-        pass
+
+async def _lookup_huggingface_model(
+    model_sha: str,
+    session: aiohttp.ClientSession,
+    search_limit: asyncio.Semaphore | None = None,
+) -> dict:
+    import aiohttp
+
+    if search_limit is None:
+        urls = await asyncio.to_thread(_search_huggingface_blobs, model_sha)
+    else:
+        async with search_limit:
+            urls = await asyncio.to_thread(_search_huggingface_blobs, model_sha)
+
+    for url in urls:
+        if "blob" not in url:
+            continue
+
+        try:
+            status, body = await _request(session, "GET", url)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            continue
+        if status != 200:
+            continue
+        text = body.decode("utf-8", errors="replace")
+        if commit_match := COMMIT_PATTERN.search(text):
+            repo, commit = commit_match.groups()
+            if path_match := PATH_PATTERN.search(text):
+                path = path_match.group(1)
+                info = {
+                    "download_url": path,
+                    "url": path,
+                    "repo": repo,
+                    "commit": commit,
+                    "path": path,
+                    "source": "huggingface",
+                }
+                return info
 
     return {}
 
 
-async def _loopup_civitai_model(model_sha: str) -> dict:
-    import aiohttp
+async def _loopup_civitai_model(
+    model_sha: str,
+    session: aiohttp.ClientSession,
+) -> dict:
+    status, body = await _request(
+        session,
+        "POST",
+        CIVITAI_SEARCH_URL,
+        headers={
+            "accept": "*/*",
+            "accept-language": "en,zh;q=0.9,zh-CN;q=0.8",
+            "cache-control": "no-cache",
+            "content-type": "application/json",
+            "origin": "https://civitai.com",
+            "pragma": "no-cache",
+            "priority": "u=1, i",
+            "referer": "https://civitai.com/",
+            "sec-ch-ua": '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
+            "sec-ch-ua-mobile": "?0",
+            "sec-ch-ua-platform": '"macOS"',
+            "sec-fetch-dest": "empty",
+            "sec-fetch-mode": "cors",
+            "sec-fetch-site": "same-site",
+            "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
+            "x-meilisearch-client": "Meilisearch instant-meilisearch (v0.13.5) ; Meilisearch JavaScript (v0.34.0)",
+        },
+        json={
+            "queries": [
+                {
+                    "q": model_sha,
+                    "indexUid": "models_v9",
+                    "facets": [
+                        "category.name",
+                        "checkpointType",
+                        "fileFormats",
+                        "lastVersionAtUnix",
+                        "tags.name",
+                        "type",
+                        "user.username",
+                        "version.baseModel",
+                    ],
+                    "attributesToHighlight": [],
+                    "highlightPreTag": "__ais-highlight__",
+                    "highlightPostTag": "__/ais-highlight__",
+                    "limit": 51,
+                    "offset": 0,
+                    "filter": ["nsfwLevel=1"],
+                }
+            ]
+        },
+    )
+    if status != 200:
+        return {}
+    data = json.loads(body)
+
+    if len(data.get("results", [])) == 0:
+        return {}
 
-    async with aiohttp.ClientSession(trust_env=True) as session:
-        async with session.post(
-            "https://meilisearch-v1-9.civitai.com/multi-search",
-            headers={
-                "accept": "*/*",
-                "accept-language": "en,zh;q=0.9,zh-CN;q=0.8",
-                "cache-control": "no-cache",
-                "content-type": "application/json",
-                "origin": "https://civitai.com",
-                "pragma": "no-cache",
-                "priority": "u=1, i",
-                "referer": "https://civitai.com/",
-                "sec-ch-ua": '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
-                "sec-ch-ua-mobile": "?0",
-                "sec-ch-ua-platform": '"macOS"',
-                "sec-fetch-dest": "empty",
-                "sec-fetch-mode": "cors",
-                "sec-fetch-site": "same-site",
-                "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
-                "x-meilisearch-client": "Meilisearch instant-meilisearch (v0.13.5) ; Meilisearch JavaScript (v0.34.0)",
-            },
-            json={
-                "queries": [
-                    {
-                        "q": model_sha,
-                        "indexUid": "models_v9",
-                        "facets": [
-                            "category.name",
-                            "checkpointType",
-                            "fileFormats",
-                            "lastVersionAtUnix",
-                            "tags.name",
-                            "type",
-                            "user.username",
-                            "version.baseModel",
-                        ],
-                        "attributesToHighlight": [],
-                        "highlightPreTag": "__ais-highlight__",
-                        "highlightPostTag": "__/ais-highlight__",
-                        "limit": 51,
-                        "offset": 0,
-                        "filter": ["nsfwLevel=1"],
-                    }
-                ]
-            },
-        ) as resp:
-            if resp.status != 200:
-                return {}
-            data = await resp.json()
-
-            if len(data.get("results", [])) == 0:
-                return {}
-
-            if len(data["results"][0]["hits"]) == 0:
-                return {}
-
-            hit = data["results"][0]["hits"][0]
-            repo_id = hit["id"]
-            repo_name = hit["name"]
-            versions = hit["versions"]
-
-            for version in versions:
-                if model_sha.upper() in version["hashes"]:
-                    break
-            else:
-                return {}
-            version_id = version["id"]
-            version_name = version["name"]
-            return {
-                "download_url": f"https://civitai.com/api/download/models/{version_id}",
-                "url": f"https://civitai.com/models/{repo_id}?modelVersionId={version_id}",
-                "repo": repo_id,
-                "commit": version_id,
-                "source": "civitai",
-                "repo_name": repo_name,
-                "version_name": version_name,
-            }
+    if len(data["results"][0]["hits"]) == 0:
+        return {}
 
+    hit = data["results"][0]["hits"][0]
+    repo_id = hit["id"]
+    repo_name = hit["name"]
+    versions = hit["versions"]
 
-async def alookup_model_source(model_sha: str, cache_only=False) -> dict:
-    if not model_sha:
+    for version in versions:
+        if model_sha.upper() in version["hashes"]:
+            break
+    else:
         return {}
-    try:
-        model_source_cache = json.loads(MODEL_SOURCE_CACHE_FILE.read_text())
-    except Exception:
-        with open(MODEL_SOURCE_CACHE_FILE, "w") as f:
-            f.write("{}")
-        model_source_cache = {}
-    if model_source_cache.get(model_sha):
-        return model_source_cache[model_sha]
+    version_id = version["id"]
+    version_name = version["name"]
+    return {
+        "download_url": f"{CIVITAI_URL}/api/download/models/{version_id}",
+        "url": f"{CIVITAI_URL}/models/{repo_id}?modelVersionId={version_id}",
+        "repo": repo_id,
+        "commit": version_id,
+        "source": "civitai",
+        "repo_name": repo_name,
+        "version_name": version_name,
+    }
+
+
+async def _lookup_model(
+    model_sha: str,
+    session: aiohttp.ClientSession,
+    limit: asyncio.Semaphore,
+    search_limit: asyncio.Semaphore,
+) -> tuple[dict, bool]:
+    """The source of a model, and whether the lookup errored out"""
+    failed = False
+    async with limit:
+        try:
+            info = await _lookup_huggingface_model(model_sha, session, search_limit)
+        except Exception:
+            failed, info = True, {}
+        if not info:
+            try:
+                info = await _loopup_civitai_model(model_sha, session)
+            except Exception:
+                failed, info = True, {}
+    return info, failed
+
+
+def _read_sources(model_shas: list[str]) -> dict[str, dict]:
+    """The sources of the models known to the source index or cache"""
+    with SourceIndex() as index:
+        results = index.get_many(model_shas)
+    with SourceCache() as cache:
+        results.update(
+            cache.get_many([sha for sha in model_shas if sha not in results])
+        )
+    return results
+
+
+def _write_sources(infos: dict[str, dict]) -> None:
+    with SourceCache() as cache:
+        for model_sha, info in infos.items():
+            cache.put(model_sha, info)
+
+
+async def abatch_lookup_model_sources(
+    model_shas: list[str],
+    cache_only: bool = False,
+    concurrency: int = LOOKUP_CONCURRENCY,
+) -> dict[str, dict]:
+    """
+    Resolve the sources of many models at once.
+
+    The local source index is consulted first. Models that are neither in
+    the index nor in the source cache, including misses whose negative
+    entry has expired, are looked up concurrently over one HTTP session.
+    The results are written to the cache in one transaction at the end.
+    """
+    import aiohttp
+
+    model_shas = [sha for sha in dict.fromkeys(model_shas) if sha]
+    # SQLite may wait on the lock of another process, which must not block
+    # the event loop, e.g. ComfyUI's
+    results = await asyncio.to_thread(_read_sources, model_shas)
+    missing = [sha for sha in model_shas if sha not in results]
     if cache_only:
-        return {}
+        results.update((sha, {}) for sha in missing)
+        return results
+    if not missing:
+        return results
 
-    info = await _lookup_huggingface_model(model_sha)
-    if not info:
-        info = await _loopup_civitai_model(model_sha)
+    limit = asyncio.Semaphore(concurrency)
+    search_limit = asyncio.Semaphore(SEARCH_CONCURRENCY)
+    async with aiohttp.ClientSession(
+        trust_env=True,
+        connector=aiohttp.TCPConnector(limit=concurrency),
+    ) as session:
+        lookups = await asyncio.gather(
+            *(
+                _lookup_model(model_sha, session, limit, search_limit)
+                for model_sha in missing
+            )
+        )
+    # a lookup that errored out says nothing about the model, don't
+    # remember it as a miss
+    await asyncio.to_thread(
+        _write_sources,
+        {
+            sha: info
+            for sha, (info, failed) in zip(missing, lookups)
+            if info or not failed
+        },
+    )
+    results.update((sha, info) for sha, (info, _) in zip(missing, lookups))
+    return results
 
-    # elemental read and write
-    model_source_cache = json.loads(MODEL_SOURCE_CACHE_FILE.read_text())
-    model_source_cache[model_sha] = info
-    with open(MODEL_SOURCE_CACHE_FILE, "w") as f:
-        json.dump(model_source_cache, f)
 
-    return info
+async def alookup_model_source(model_sha: str, cache_only=False) -> dict:
+    if not model_sha:
+        return {}
+    results = await abatch_lookup_model_sources([model_sha], cache_only=cache_only)
+    return results[model_sha]
 
 
 def lookup_model_source(model_sha: str, cache_only=False) -> dict:
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import os
+import random
+import re
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .const import MODEL_DIR, MODEL_STORE_DB_FILE
+from .hash import calculate_sha256_worker
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    verified_at REAL,
+    legacy INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS refs (
+    sha256 TEXT NOT NULL,
+    path TEXT PRIMARY KEY
+);
+CREATE INDEX IF NOT EXISTS refs_sha256 ON refs (sha256);
+"""
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size: str) -> int:
+    """Parse a human readable size like `500M` or `1.5T` into bytes"""
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([KMGT]?)i?B?\s*", size.upper())
+    if not match:
+        raise ValueError(f"Invalid size: {size}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+@dataclass
+class GCReport:
+    stale_refs: int = 0
+    removed: list[str] = field(default_factory=list)
+    freed: int = 0
+    corrupted: list[str] = field(default_factory=list)
+    verified: int = 0
+    total_size: int = 0
+
+
+class ModelStore:
+    """
+    The content-addressed model store shared by all workspaces on the host.
+
+    Each model is stored once as ``MODEL_DIR / sha256`` and symlinked into
+    the workspaces. The store keeps an index of the workspace paths that
+    reference each blob, so that blobs no longer referenced by any
+    workspace can be garbage collected.
+
+    Blobs found in the store directory that were never linked through the
+    index are considered legacy. They are left alone by `gc` unless asked
+    for, since the workspaces using them are unknown.
+    """
+
+    def __init__(self, root: Path = MODEL_DIR, db_file: Path = MODEL_STORE_DB_FILE):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_file), timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def blob_path(self, sha: str) -> Path:
+        return self.root / sha
+
+    def has(self, sha: str) -> bool:
+        return self.blob_path(sha).exists()
+
+    def add_ref(self, sha: str, path: Path) -> None:
+        """
+        Record that `path` is a symlink to the blob. The blob may not be
+        fetched yet, as for lazy placeholders, and is then protected from
+        `gc` as soon as it lands in the store.
+        """
+        with self._conn:
+            if self.has(sha):
+                self._conn.execute(
+                    "INSERT INTO blobs (sha256, size, last_used) VALUES (?, ?, ?) "
+                    "ON CONFLICT (sha256) DO UPDATE SET "
+                    "last_used = excluded.last_used, legacy = 0",
+                    (sha, self.blob_path(sha).stat().st_size, time.time()),
+                )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO refs VALUES (?, ?)",
+                (sha, str(Path(path).absolute())),
+            )
+
+    def is_blob(self, sha: str, path: Path) -> bool | None:
+        """
+        Whether `path` has the content of the blob, from their stats alone:
+        True for the blob itself or a hard link to it, False when their
+        sizes differ, None when only hashing `path` can tell.
+        """
+        try:
+            st, blob = os.stat(path), self.blob_path(sha).stat()
+        except OSError:
+            return None
+        if st.st_size != blob.st_size:
+            return False
+        if (st.st_dev, st.st_ino, st.st_mtime_ns) == (
+            blob.st_dev,
+            blob.st_ino,
+            blob.st_mtime_ns,
+        ):
+            return True
+        return None
+
+    def link(self, sha: str, target: Path) -> None:
+        """Symlink the blob to `target` and record the reference"""
+        source = self.blob_path(sha)
+        if target.is_symlink() or target.exists():
+            if target.is_symlink():
+                target.unlink()
+            else:
+                raise RuntimeError(f"File {target} already exists and is not a symlink")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.symlink(source, target)
+        self.add_ref(sha, target)
+
+    def _discover(self) -> None:
+        """Register the blobs in the store directory that the index doesn't know"""
+        known = {row[0] for row in self._conn.execute("SELECT sha256 FROM blobs")}
+        new = []
+        for entry in os.scandir(self.root):
+            if entry.name in known or not SHA256_PATTERN.match(entry.name):
+                continue
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            st = entry.stat()
+            new.append((entry.name, st.st_size, max(st.st_atime, st.st_mtime), 1))
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO blobs (sha256, size, last_used, legacy) "
+                "VALUES (?, ?, ?, ?)",
+                new,
+            )
+            # blobs removed behind our back
+            gone = [sha for sha in known if not self.has(sha)]
+            self._conn.executemany(
+                "DELETE FROM blobs WHERE sha256 = ?", [(sha,) for sha in gone]
+            )
+
+    def _prune_refs(self) -> int:
+        """Drop the references whose symlink is gone or points elsewhere"""
+        stale = []
+        for sha, path in self._conn.execute("SELECT sha256, path FROM refs"):
+            target = Path(path)
+            try:
+                if target.is_symlink() and os.readlink(target) == str(
+                    self.blob_path(sha)
+                ):
+                    continue
+            except OSError:
+                pass
+            stale.append((path,))
+        with self._conn:
+            self._conn.executemany("DELETE FROM refs WHERE path = ?", stale)
+        return len(stale)
+
+    def _remove(self, sha: str, report: GCReport, size: int, dry_run: bool) -> None:
+        report.removed.append(sha)
+        report.freed += size
+        if dry_run:
+            return
+        self.blob_path(sha).unlink(missing_ok=True)
+        with self._conn:
+            self._conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha,))
+            self._conn.execute("DELETE FROM refs WHERE sha256 = ?", (sha,))
+
+    def verify(self, sample: int, report: GCReport, dry_run: bool = False) -> None:
+        """Re-hash up to `sample` blobs, preferring the least recently verified"""
+        rows = self._conn.execute(
+            "SELECT sha256, size FROM blobs ORDER BY verified_at IS NOT NULL, "
+            "verified_at LIMIT ?",
+            (sample * 4,),
+        ).fetchall()
+        for sha, size in random.sample(rows, min(sample, len(rows))):
+            report.verified += 1
+            if calculate_sha256_worker(str(self.blob_path(sha))) == sha:
+                with self._conn:
+                    self._conn.execute(
+                        "UPDATE blobs SET verified_at = ? WHERE sha256 = ?",
+                        (time.time(), sha),
+                    )
+                continue
+            report.corrupted.append(sha)
+            self._remove(sha, report, size, dry_run)
+
+    def gc(
+        self,
+        max_size: int | None = None,
+        include_legacy: bool = False,
+        verify_sample: int = 0,
+        dry_run: bool = False,
+    ) -> GCReport:
+        """
+        Reclaim the space of the blobs no workspace references.
+
+        Without `max_size` every unreferenced blob is removed. Otherwise
+        unreferenced blobs are kept as a cache and evicted least recently
+        used first until the store fits in `max_size` bytes. Referenced
+        blobs are never evicted.
+        """
+        report = GCReport()
+        self._discover()
+        report.stale_refs = self._prune_refs()
+        if verify_sample:
+            self.verify(verify_sample, report, dry_run=dry_run)
+
+        total = sum(
+            size
+            for sha, size in self._conn.execute("SELECT sha256, size FROM blobs")
+            if sha not in report.removed
+        )
+        candidates = self._conn.execute(
+            "SELECT sha256, size FROM blobs "
+            "WHERE sha256 NOT IN (SELECT sha256 FROM refs) "
+            + ("" if include_legacy else "AND legacy = 0 ")
+            + "ORDER BY last_used"
+        ).fetchall()
+        for sha, size in candidates:
+            if sha in report.removed:
+                continue
+            if max_size is not None and total <= max_size:
+                break
+            self._remove(sha, report, size, dry_run)
+            total -= size
+        report.total_size = total
+        return report
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> ModelStore:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
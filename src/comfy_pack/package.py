@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import contextlib
+import functools
+import hashlib
 import json
 import os
 import shutil
@@ -8,22 +10,35 @@ import subprocess
 import sys
 import tempfile
 import threading
+import time
 import urllib.parse
 import urllib.request
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterable
 
 from .const import COMFYUI_REPO, MODEL_DIR, STRICT_MODE
-from .hash import get_sha256
+from .hash import calculate_sha256_worker, get_sha256
+from .model_store import ModelStore
+from .timing import phase, propagate, record_uv_output, recording
 from .utils import get_self_git_commit
 
 if TYPE_CHECKING:
     import bentoml
 
 COMFY_PACK_DIR = Path(__file__).parent
+MODELS_REPORT_FILE = "cpack_models.json"
+DOWNLOAD_WORKERS = 4
 
 
 def _clone_commit(url: str, commit: str, dir: Path, verbose: int = 0):
+    with phase(f"git {url}", "git", commit=commit):
+        _git_checkout(url, commit, dir, verbose=verbose)
+
+
+def _git_checkout(url: str, commit: str, dir: Path, verbose: int = 0):
     stdout = None if verbose > 0 else subprocess.DEVNULL
     stderr = None if verbose > 1 else subprocess.DEVNULL
     env = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
@@ -125,11 +140,12 @@ def install_custom_modules(snapshot, workspace: Path, verbose: int = 0):
             if verbose > 0:
                 print(f"Installing {directory} custom node")
                 print(f"$ {python.absolute()} install.py")
-            subprocess.check_call(
-                [str(python.absolute()), "install.py"],
-                cwd=module_dir,
-                stdout=subprocess.DEVNULL if verbose == 0 else None,
-            )
+            with phase(f"{directory} install.py", "custom nodes"):
+                subprocess.check_call(
+                    [str(python.absolute()), "install.py"],
+                    cwd=module_dir,
+                    stdout=subprocess.DEVNULL if verbose == 0 else None,
+                )
 
         with open(module_dir / ".DONE", "w") as f:
             f.write(commit_hash)
@@ -158,29 +174,19 @@ def install_dependencies(
         )
         if (venv / "DONE").exists():
             return venv_py
-        subprocess.check_call(
-            [
-                "uv",
-                "venv",
-                "--python",
-                python_version,
-                venv,
-            ],
-            stdout=stdout,
-            stderr=stderr,
-        )
-    subprocess.check_call(
-        [
-            "uv",
-            "pip",
-            "install",
-            "-p",
-            str(venv_py),
-            "pip",
-        ],
-        stdout=stdout,
-        stderr=stderr,
-    )
+        with phase("uv venv", "venv", python=python_version):
+            subprocess.check_call(
+                [
+                    "uv",
+                    "venv",
+                    "--python",
+                    python_version,
+                    venv,
+                ],
+                stdout=stdout,
+                stderr=stderr,
+            )
+    _run_uv(["uv", "pip", "install", "-p", str(venv_py), "pip"], verbose=verbose)
     if verbose > 0:
         print(f"Installing dependencies from {req_files}")
     install_cmd = [
@@ -196,17 +202,38 @@ def install_dependencies(
         install_cmd.extend(["--index-strategy", "unsafe-best-match"])
     if no_deps:
         install_cmd.append("--no-deps")
-    subprocess.check_call(
-        install_cmd,
-        stdout=stdout,
-        stderr=stderr,
-    )
+    _run_uv(install_cmd, verbose=verbose)
     if not no_venv:
         with open(venv / "DONE", "w") as f:
             f.write("DONE")
     return venv_py
 
 
+def _run_uv(cmd: list[str], verbose: int = 0) -> None:
+    """
+    Run a uv command, attributing its time to resolution, download and
+    installation from the summary uv prints.
+    """
+    with phase(" ".join(cmd[:3]), "pip install"):
+        proc = subprocess.Popen(
+            cmd,
+            stdout=None if verbose > 0 else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        output = []
+        for line in proc.stderr:
+            output.append(line)
+            if verbose > 1:
+                sys.stderr.write(line)
+        returncode = proc.wait()
+        record_uv_output("".join(output))
+    if returncode != 0:
+        if verbose <= 1:
+            sys.stderr.write("".join(output))
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+
 def get_search_url(sha: str) -> str:
     """Generate custom search URLs for model on HuggingFace and CivitAI"""
     base_url = "https://duckduckgo.com"
@@ -216,7 +243,9 @@ def get_search_url(sha: str) -> str:
     return f"{base_url}?q={hf_query}"
 
 
-def download_file(url: str, dest_path: Path, progress_callback=None):
+def download_file(
+    url: str, dest_path: Path, progress_callback=None, quiet: bool = False
+):
     """Download file with progress tracking"""
 
     # prepare auth token from huggingface if possible
@@ -232,8 +261,18 @@ def download_file(url: str, dest_path: Path, progress_callback=None):
 
     try:
         if shutil.which("curl"):
+            quiet_args = ["--silent", "--show-error"] if quiet else []
             subprocess.check_call(
-                ["curl", "-L", url, *curl_auth, "--fail", "-o", str(dest_path)],
+                [
+                    "curl",
+                    "-L",
+                    url,
+                    *curl_auth,
+                    *quiet_args,
+                    "--fail",
+                    "-o",
+                    str(dest_path),
+                ],
             )
             return True
         with urllib.request.urlopen(urllib_request) as response:
@@ -272,142 +311,389 @@ def show_progress(filename: str):
 
 def create_model_symlink(global_path: Path, sha: str, target_path: Path, filename: str):
     """Create symlink from global storage to workspace"""
-    source = global_path / sha
-    target = target_path / filename
+    with phase(f"link {filename}", "model linking"), ModelStore(global_path) as store:
+        store.link(sha, target_path / filename)
 
-    if target.exists():
-        if target.is_symlink():
-            target.unlink()
-        else:
-            raise RuntimeError(f"File {target} already exists and is not a symlink")
 
-    target.parent.mkdir(parents=True, exist_ok=True)
-    os.symlink(source, target)
+@dataclass
+class ModelPlan:
+    """What `retrieve_models` is going to do for one model of the snapshot"""
 
+    model: dict
+    # cached: present in the workspace, linkable: in MODEL_DIR,
+    # downloadable: has a known source, unresolved: no known source,
+    # skipped: disabled model
+    action: str
+    # linked, downloaded, lazy, failed, unresolved, skipped or deferred
+    result: str = ""
+    error: str | None = None
 
-def retrieve_models(
+    @property
+    def sha(self) -> str:
+        return self.model["sha256"]
+
+    @property
+    def filename(self) -> str:
+        return self.model["filename"]
+
+
+def plan_models(
     snapshot: dict,
     workspace: Path,
-    download: bool = True,
     all_models: bool = False,
-    verbose: int = 0,
-):
-    """Retrieve models from user downloads"""
-    print("Retrieving models")
-    models = snapshot.get("models", [])
-    if not models:
-        return
+) -> list[ModelPlan]:
+    """Classify every model of the snapshot without touching anything"""
+    plans = []
+    for model in snapshot.get("models", []):
+        target = workspace / model["filename"]
+        if target.exists():
+            action = "cached"
+        elif (MODEL_DIR / model["sha256"]).exists():
+            action = "linkable"
+        elif model.get("disabled", False) and not all_models:
+            action = "skipped"
+        elif (model.get("source") or {}).get("download_url"):
+            action = "downloadable"
+        else:
+            action = "unresolved"
+        plans.append(ModelPlan(model, action))
+    return plans
+
+
+class _ByteBudget:
+    """Limits the total size of the downloads running at the same time"""
+
+    def __init__(self, limit: int | None) -> None:
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, size: int):
+        if not self.limit:
+            yield
+            return
+        # a model larger than the budget runs alone
+        size = min(size, self.limit)
+        with self._cond:
+            self._cond.wait_for(lambda: self.used + size <= self.limit)
+            self.used += size
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.used -= size
+                self._cond.notify_all()
+
+
+def _adopt_workspace_model(plan: ModelPlan, workspace: Path) -> None:
+    sha, filename = plan.sha, plan.filename
+    target = workspace / filename
+    if target.is_symlink():
+        if target.resolve() == (MODEL_DIR / sha).resolve():
+            create_model_symlink(MODEL_DIR, sha, workspace, filename)
+    elif not (MODEL_DIR / sha).exists():
+        shutil.move(target, MODEL_DIR / sha)
+        create_model_symlink(MODEL_DIR, sha, workspace, filename)
+    else:
+        with ModelStore() as store:
+            same = store.is_blob(sha, target)
+        if same is None:
+            same = _hash_file(target, cached=True) == sha
+        if same:
+            # the store has the same content, keep a single copy
+            target.unlink()
+            create_model_symlink(MODEL_DIR, sha, workspace, filename)
+    plan.result = "linked"
 
-    MODEL_DIR.mkdir(parents=True, exist_ok=True)
 
-    for model in models:
-        sha = model["sha256"]
-        filename = model["filename"]
-        disabled = model.get("disabled", False)
-        if (workspace / filename).exists():
-            if not (MODEL_DIR / sha).exists() and (workspace / filename).is_file():
-                shutil.move(workspace / filename, MODEL_DIR / sha)
-                create_model_symlink(MODEL_DIR, sha, workspace, filename)
-            continue
+def _hash_file(path: Path, cached: bool = False) -> str:
+    with phase(f"sha256 {path.name}", "hashing", size=path.stat().st_size):
+        if cached:
+            return get_sha256(str(path))
+        return calculate_sha256_worker(str(path))
 
-        if (MODEL_DIR / sha).exists():
-            print(f"Model {filename} already exists in cache")
-            create_model_symlink(MODEL_DIR, sha, workspace, filename)
-            continue
 
-        if disabled and not all_models:
-            continue
+def fetch_model_blob(sha: str, url: str, quiet: bool = False) -> None:
+    """Download a model into MODEL_DIR, verifying its SHA256"""
+    part_path = MODEL_DIR / f"{sha}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        with phase(f"download {url}", "model download"):
+            downloaded = download_file(url, part_path, quiet=quiet)
+        if not downloaded or not part_path.exists():
+            raise RuntimeError(f"Download from {url} failed")
+        if _hash_file(part_path) != sha:
+            raise RuntimeError(
+                f"SHA256 verification failed for the download from {url}"
+            )
+        os.replace(part_path, MODEL_DIR / sha)
+    finally:
+        part_path.unlink(missing_ok=True)
+
+
+def _download_model(
+    plan: ModelPlan, workspace: Path, budget: _ByteBudget, verbose: int = 0
+) -> None:
+    sha, filename = plan.sha, plan.filename
+    url = plan.model["source"]["download_url"]
+    with budget.reserve(plan.model.get("size") or 0):
+        print(f"Downloading {filename}")
+        try:
+            fetch_model_blob(sha, url, quiet=verbose == 0)
+        except RuntimeError as e:
+            plan.result, plan.error = "failed", str(e)
+            return
+    create_model_symlink(MODEL_DIR, sha, workspace, filename)
+    print(f"Model {filename} installed successfully")
+    plan.result = "downloaded"
+
+
+def _prompt_for_model(plan: ModelPlan, workspace: Path) -> None:
+    sha, filename = plan.sha, plan.filename
+    search_url = get_search_url(sha)
+    print(f"\nModel {filename} could not be retrieved")
+    print(f"Search URL: {search_url}")
+    print(f"Path: {workspace / filename}")
+
+    while True:
+        path = input("Enter path to downloaded file (or 'skip' to skip): ")
+        if path.lower() == "skip":
+            break
+
+        try:
+            # Check if input is a URL
+            if path.startswith(("http://", "https://")):
+                url = path
+                target_path = MODEL_DIR / sha
+
+                # Start download in a separate thread
+                download_thread = threading.Thread(
+                    target=download_file,
+                    args=(url, target_path, show_progress(filename)),
+                )
+                download_thread.start()
+                download_thread.join()
 
-        if not download:
-            continue
+                if not target_path.exists():
+                    print("\nDownload failed!")
+                    continue
 
-        print(f"\nModel {filename} is never downloaded before")
-        if source := model.get("source"):
-            url = source["download_url"]
-            target_path = MODEL_DIR / sha
-            download_thread = threading.Thread(
-                target=download_file,
-                args=(url, target_path, show_progress(filename)),
-            )
-            download_thread.start()
-            download_thread.join()
-
-            if not target_path.exists():
-                print("\nDownload failed!")
-                continue
-
-            print("\nDownload completed! Verifying SHA256...")
-            terget_sha = get_sha256(str(target_path))
-            if terget_sha != sha:
-                print("SHA256 verification failed! File may be corrupted or incorrect.")
-                target_path.unlink()
+                print("\nDownload completed! Verifying SHA256...")
+                terget_sha = get_sha256(str(target_path))
+                if terget_sha != sha:
+                    print(
+                        "SHA256 verification failed! File may be corrupted or incorrect."
+                    )
+                    target_path.unlink()
+                    continue
+
+                print("SHA256 verification successful!")
             else:
-                continue
+                # Handle local file
+                downloaded_path = Path(path)
+                if not downloaded_path.exists():
+                    print("File does not exist!")
+                    continue
 
-        search_url = get_search_url(sha)
-        print(f"Search URL: {search_url}")
-        print(f"Path: {workspace / filename}")
+                # Verify SHA256 before copying
+                print("Verifying SHA256...")
+                target_sha = get_sha256(str(downloaded_path))
+                if target_sha != sha:
+                    print(
+                        f"Downloaded file SHA256 does not match expected SHA256: {target_sha} != {sha}"
+                    )
+                    continue
 
-        while True:
-            path = input("Enter path to downloaded file (or 'skip' to skip): ")
-            if path.lower() == "skip":
-                break
+                print("SHA256 verification successful!")
+                # Copy to global storage
+                shutil.copy2(downloaded_path, MODEL_DIR / sha)
 
-            try:
-                # Check if input is a URL
-                if path.startswith(("http://", "https://")):
-                    url = path
-                    target_path = MODEL_DIR / sha
-
-                    # Start download in a separate thread
-                    download_thread = threading.Thread(
-                        target=download_file,
-                        args=(url, target_path, show_progress(filename)),
-                    )
-                    download_thread.start()
-                    download_thread.join()
-
-                    if not target_path.exists():
-                        print("\nDownload failed!")
-                        continue
-
-                    print("\nDownload completed! Verifying SHA256...")
-                    terget_sha = get_sha256(str(target_path))
-                    if terget_sha != sha:
-                        print(
-                            "SHA256 verification failed! File may be corrupted or incorrect."
-                        )
-                        target_path.unlink()
-                        continue
+            # Create symlink
+            create_model_symlink(MODEL_DIR, sha, workspace, filename)
+            print(f"Model {filename} installed successfully")
+            plan.result, plan.error = "downloaded", None
+            break
+        except Exception as e:
+            print(f"Error processing file: {e}")
+            continue
 
-                    print("SHA256 verification successful!")
-                else:
-                    # Handle local file
-                    downloaded_path = Path(path)
-                    if not downloaded_path.exists():
-                        print("File does not exist!")
-                        continue
-
-                    # Verify SHA256 before copying
-                    print("Verifying SHA256...")
-                    target_sha = get_sha256(str(downloaded_path))
-                    if target_sha != sha:
-                        print(
-                            f"Downloaded file SHA256 does not match expected SHA256: {target_sha} != {sha}"
-                        )
-                        continue
 
-                    print("SHA256 verification successful!")
-                    # Copy to global storage
-                    shutil.copy2(downloaded_path, MODEL_DIR / sha)
+def _write_models_report(
+    plans: list[ModelPlan], workspace: Path, report_path: Path, elapsed: float
+) -> None:
+    summary: dict[str, int] = {}
+    for plan in plans:
+        summary[plan.result] = summary.get(plan.result, 0) + 1
+    report = {
+        "workspace": str(workspace.absolute()),
+        "elapsed": round(elapsed, 3),
+        "summary": summary,
+        "models": [
+            {
+                "filename": plan.filename,
+                "sha256": plan.sha,
+                "size": plan.model.get("size"),
+                "action": plan.action,
+                "result": plan.result,
+                "error": plan.error,
+                "source": (plan.model.get("source") or {}).get("download_url"),
+                "search_url": get_search_url(plan.sha)
+                if plan.result in ("unresolved", "failed")
+                else None,
+            }
+            for plan in plans
+        ],
+    }
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    report_path.write_text(json.dumps(report, indent=2))
+
+
+def retrieve_models(
+    snapshot: dict,
+    workspace: Path,
+    download: bool = True,
+    all_models: bool = False,
+    verbose: int = 0,
+    interactive: bool = False,
+    max_workers: int = DOWNLOAD_WORKERS,
+    byte_budget: int | None = None,
+    report_path: Path | None = None,
+    lazy: bool = False,
+) -> list[ModelPlan]:
+    """
+    Retrieve the models of the snapshot into the workspace.
+
+    Every model is classified up front, then the links and downloads run
+    concurrently, with at most `max_workers` downloads and at most
+    `byte_budget` bytes being downloaded at the same time. The outcome is
+    written to `report_path` as JSON. Models that could not be retrieved
+    are only asked for when `interactive` is set.
+
+    With `lazy`, downloadable models are left as placeholders that are
+    fetched the first time ComfyUI loads them, see `lazy_models`.
+    """
+    print("Retrieving models")
+    if not snapshot.get("models", []):
+        return []
 
-                # Create symlink
-                create_model_symlink(MODEL_DIR, sha, workspace, filename)
-                print(f"Model {filename} installed successfully")
-                break
+    started = time.monotonic()
+    MODEL_DIR.mkdir(parents=True, exist_ok=True)
+    plans = plan_models(snapshot, workspace, all_models=all_models)
+    if verbose > 0:
+        for plan in plans:
+            print(f"{plan.filename}: {plan.action}")
+
+    budget = _ByteBudget(byte_budget)
+    # the downloads are timed as part of the current phase
+    run_download = propagate(_download_model)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {}
+        for plan in plans:
+            if plan.action == "cached":
+                _adopt_workspace_model(plan, workspace)
+            elif plan.action == "linkable":
+                print(f"Model {plan.filename} already exists in cache")
+                create_model_symlink(MODEL_DIR, plan.sha, workspace, plan.filename)
+                plan.result = "linked"
+            elif plan.action == "skipped":
+                plan.result = "skipped"
+            elif not download:
+                plan.result = "deferred"
+            elif plan.action == "downloadable" and lazy:
+                plan.result = "lazy"
+            elif plan.action == "downloadable":
+                futures[
+                    pool.submit(run_download, plan, workspace, budget, verbose)
+                ] = plan
+            else:
+                plan.result = "unresolved"
+        for future in as_completed(futures):
+            plan = futures[future]
+            try:
+                future.result()
             except Exception as e:
-                print(f"Error processing file: {e}")
-                continue
+                plan.result, plan.error = "failed", f"{e.__class__.__name__}: {e}"
+    if lazy:
+        from .lazy_models import defer_models
+
+        defer_models([p.model for p in plans if p.result == "lazy"], workspace)
+
+    for plan in plans:
+        if plan.result in ("failed", "unresolved"):
+            print(f"Model {plan.filename} is not retrieved: {plan.error or plan.result}")
+            if interactive:
+                _prompt_for_model(plan, workspace)
+
+    if report_path is None:
+        report_path = workspace / MODELS_REPORT_FILE
+    _write_models_report(plans, workspace, report_path, time.monotonic() - started)
+    return plans
+
+
+@dataclass(frozen=True)
+class CpackManifest:
+    snapshot: dict
+    workflow: dict | None
+    # archive members under input/
+    inputs: tuple[str, ...]
+    # identifies what a workspace restored from the package depends on
+    key: str
+
+
+@functools.lru_cache(maxsize=8)
+def _read_cpack_manifest(path: str, mtime_ns: int, size: int) -> CpackManifest:
+    with zipfile.ZipFile(path) as z:
+        names = z.namelist()
+        if "snapshot.json" not in names:
+            raise FileNotFoundError(
+                "Not a valid comfy-pack package: missing `snapshot.json`"
+            )
+        snapshot_data = z.read("snapshot.json")
+        workflow = None
+        if "workflow_api.json" in names:
+            workflow = json.loads(z.read("workflow_api.json"))
+        inputs = tuple(
+            name
+            for name in names
+            if name.startswith("input/") and not name.endswith("/")
+        )
+        # the inputs are identified by the CRCs of the central directory,
+        # so that large inputs are not read
+        key = hashlib.sha256(snapshot_data.strip())
+        for name in sorted(inputs):
+            info = z.getinfo(name)
+            key.update(f"\0{name}\0{info.CRC:08x}\0{info.file_size}".encode())
+    return CpackManifest(json.loads(snapshot_data), workflow, inputs, key.hexdigest())
+
+
+def read_cpack_manifest(cpack: str | Path) -> CpackManifest:
+    """
+    Read the snapshot, the workflow and the input list of a .cpack.zip
+    without extracting it. The result is cached until the file changes.
+    """
+    path = Path(cpack).resolve()
+    st = path.stat()
+    return _read_cpack_manifest(str(path), st.st_mtime_ns, st.st_size)
+
+
+def _extract_inputs(archive: zipfile.ZipFile, names: Iterable[str], input_dir: Path):
+    """Stream the input files of the archive straight into the workspace"""
+    root = input_dir.resolve()
+    for name in names:
+        target = (input_dir / name[len("input/") :]).resolve()
+        if root not in target.parents:
+            raise ValueError(f"Invalid input path in the package: {name}")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with archive.open(name) as src, target.open("wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def _has_comfy_pack_node(snapshot: dict) -> bool:
+    """Lazy models are fetched by the comfy-pack custom node"""
+    return any(
+        "comfy-pack" in module.get("url", "").lower()
+        for module in snapshot.get("custom_nodes", [])
+    )
 
 
 def install(
@@ -418,67 +704,159 @@ def install(
     all_models: bool = False,
     no_venv: bool = False,
     verbose: int = 0,
+    interactive: bool = False,
+    download_workers: int = DOWNLOAD_WORKERS,
+    download_budget: int | None = None,
+    models_report: str | Path | None = None,
+    lazy_models: bool = False,
+    timing_report: str | Path | None = None,
 ):
+    """
+    Install a package into the workspace. With `timing_report`, the time
+    of each phase is written there as JSON, see `comfy_pack.timing`, even
+    if the install fails.
+    """
     workspace = Path(workspace)
     cpack = Path(cpack)
     print(f"Installing package {cpack} to {workspace} (verbose={verbose})")
+    with recording() as timer:
+        try:
+            _install(
+                cpack,
+                workspace,
+                preheat=preheat,
+                prepare_models=prepare_models,
+                all_models=all_models,
+                no_venv=no_venv,
+                verbose=verbose,
+                interactive=interactive,
+                download_workers=download_workers,
+                download_budget=download_budget,
+                models_report=models_report,
+                lazy_models=lazy_models,
+            )
+        finally:
+            if timing_report is not None:
+                timer.write(
+                    Path(timing_report),
+                    cpack=str(cpack.absolute()),
+                    workspace=str(workspace.absolute()),
+                )
+                print("Time spent per category:")
+                for category, seconds in timer.categories().items():
+                    print(f"  {category}: {seconds:.1f}s")
+
+
+def _install(
+    cpack: Path,
+    workspace: Path,
+    preheat: bool,
+    prepare_models: bool,
+    all_models: bool,
+    no_venv: bool,
+    verbose: int,
+    interactive: bool,
+    download_workers: int,
+    download_budget: int | None,
+    models_report: str | Path | None,
+    lazy_models: bool,
+):
     with contextlib.ExitStack() as stack:
         if cpack.is_file():
-            temp_dir = stack.enter_context(tempfile.TemporaryDirectory())
-            pack_dir = Path(temp_dir) / ".cpack"
-            shutil.unpack_archive(cpack, pack_dir)
+            manifest = read_cpack_manifest(cpack)
+            archive = stack.enter_context(zipfile.ZipFile(cpack))
+            snapshot = manifest.snapshot
         else:
-            pack_dir = cpack
-        snapshot = json.loads((pack_dir / "snapshot.json").read_text())
+            manifest = archive = None
+            snapshot = json.loads((cpack / "snapshot.json").read_text())
         if "pips" not in snapshot:
             raise RuntimeError(
                 "This cpack is generated by an old version of comfy-pack, "
                 "please use comfy-pack<0.4.0 to unpack it."
             )
 
-        install_comfyui(snapshot, workspace, verbose=verbose)
-        py = install_dependencies(
-            snapshot["python"],
-            [
-                str(workspace / "requirements.txt"),
-                str(
-                    workspace / "custom_nodes" / "ComfyUI-Manager" / "requirements.txt"
-                ),
-            ],
-            workspace,
-            no_venv=no_venv,
-            verbose=verbose,
-        )
-        cm_cli = workspace / "custom_nodes" / "ComfyUI-Manager" / "cm-cli.py"
-        subprocess.check_call(
-            [str(py), str(cm_cli), "restore-snapshot", str(pack_dir / "snapshot.json")],
-            cwd=workspace,
-        )
-
-        for f in (pack_dir / "input").glob("*"):
-            if f.is_file():
-                shutil.copy(f, workspace / "input" / f.name)
-            elif f.is_dir():
-                shutil.copytree(f, workspace / "input" / f.name, dirs_exist_ok=True)
-        if prepare_models:
-            retrieve_models(
-                snapshot,
+        with phase("install ComfyUI"):
+            install_comfyui(snapshot, workspace, verbose=verbose)
+        with phase("install Python dependencies"):
+            py = install_dependencies(
+                snapshot["python"],
+                [
+                    str(workspace / "requirements.txt"),
+                    str(
+                        workspace
+                        / "custom_nodes"
+                        / "ComfyUI-Manager"
+                        / "requirements.txt"
+                    ),
+                ],
                 workspace,
+                no_venv=no_venv,
                 verbose=verbose,
-                download=False,
+            )
+        if archive is not None:
+            # cm-cli reads the snapshot from a file
+            temp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            snapshot_file = Path(temp_dir) / "snapshot.json"
+            snapshot_file.write_bytes(archive.read("snapshot.json"))
+        else:
+            snapshot_file = cpack / "snapshot.json"
+        cm_cli = workspace / "custom_nodes" / "ComfyUI-Manager" / "cm-cli.py"
+        # clones the custom nodes and installs their packages, which cm-cli
+        # doesn't report separately
+        with phase("cm-cli restore-snapshot", "custom nodes"):
+            subprocess.check_call(
+                [str(py), str(cm_cli), "restore-snapshot", str(snapshot_file)],
+                cwd=workspace,
             )
 
+        with phase("copy inputs", "inputs"):
+            if archive is not None:
+                _extract_inputs(archive, manifest.inputs, workspace / "input")
+            else:
+                for f in (cpack / "input").glob("*"):
+                    if f.is_file():
+                        shutil.copy(f, workspace / "input" / f.name)
+                    elif f.is_dir():
+                        shutil.copytree(
+                            f, workspace / "input" / f.name, dirs_exist_ok=True
+                        )
+        if lazy_models and not _has_comfy_pack_node(snapshot):
+            print(
+                "The package doesn't include the comfy-pack custom node, "
+                "models will be downloaded now"
+            )
+            lazy_models = False
+        if prepare_models:
+            with phase("link cached models"):
+                retrieve_models(
+                    snapshot,
+                    workspace,
+                    verbose=verbose,
+                    download=False,
+                )
+
         if preheat:
             from .run import ComfyUIServer
 
-            with ComfyUIServer(
+            with phase("preheat ComfyUI", "preheat"), ComfyUIServer(
                 str(workspace),
                 verbose=verbose,
                 venv=str(workspace / ".venv") if not no_venv else None,
             ) as _:
                 pass
         if prepare_models:
-            retrieve_models(snapshot, workspace, verbose=verbose, all_models=all_models)
+            with phase("retrieve models"):
+                retrieve_models(
+                    snapshot,
+                    workspace,
+                    verbose=verbose,
+                    all_models=all_models,
+                    interactive=interactive,
+                    max_workers=download_workers,
+                    byte_budget=download_budget,
+                    report_path=Path(models_report) if models_report else None,
+                    lazy=lazy_models,
+                )
 
 
 required_files = ["snapshot.json"]
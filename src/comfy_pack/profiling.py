@@ -0,0 +1,291 @@
+"""
+Profiles of single requests of the service.
+
+A request is profiled when it asks for it with the X-Cpack-Profile header,
+or is drawn at the sampling rate of the service. Its profile has:
+
+- the Python stacks of the service, sampled every few milliseconds while
+  the request runs. The work of a request hops between the event loop and
+  worker threads, so every thread is sampled and the stacks of requests
+  running at the same time show up too. Threads waiting for work are left
+  out;
+- the wall time of the stages of the request in the service;
+- the execution time of each ComfyUI node of its prompts, from the events
+  ComfyUI sends to the client id of the prompt.
+
+Stacks are counted in the collapsed format read by flamegraph.pl and
+speedscope, one `thread;outer;...;inner` line per distinct stack.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator
+
+from .progress import follow_prompt
+
+logger = logging.getLogger(__name__)
+
+# innermost frames of threads waiting for work
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+
+
+def _thread_kind(name: str) -> str:
+    """asyncio_3 and asyncio_7 are the same kind of thread"""
+    return re.sub(r"[_-]?\d+$", "", name) or name
+
+
+class StackSampler:
+    """Count the stacks of all threads but its own, every `interval` seconds"""
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64) -> None:
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.idle = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="cpack-profiler", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    self.idle += 1
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} "
+                        f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                thread = _thread_kind(names.get(ident, str(ident)))
+                self.stacks[";".join([thread, *reversed(stack)])] += 1
+            self.samples += 1
+
+
+class NodeTimes:
+    """Execution time of the nodes of a prompt, from ComfyUI's events"""
+
+    def __init__(self, workflow: dict) -> None:
+        self.workflow = workflow
+        self.nodes: dict[str, dict[str, Any]] = {}
+        self._current: str | None = None
+        self._since = 0.0
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.status: str | None = None
+
+    def _close(self, now: float) -> None:
+        if self._current is not None:
+            self.nodes[self._current]["elapsed"] += now - self._since
+            self._current = None
+
+    def _node(self, node_id: str, cached: bool = False) -> dict[str, Any]:
+        return self.nodes.setdefault(
+            node_id,
+            {
+                "node": node_id,
+                "class_type": self.workflow.get(node_id, {}).get("class_type"),
+                "elapsed": 0.0,
+                "cached": cached,
+            },
+        )
+
+    def feed(self, event: dict[str, Any], now: float) -> None:
+        kind, data = event.get("type"), event.get("data") or {}
+        if kind == "execution_start":
+            self.started = now
+        elif kind == "execution_cached":
+            for node_id in data.get("nodes", []):
+                self._node(str(node_id), cached=True)
+        elif kind == "executing":
+            self._close(now)
+            if data.get("node") is None:
+                # the end of the prompt, before or instead of execution_success
+                self.finished = now
+                self.status = self.status or "finished"
+            else:
+                self._current = str(data["node"])
+                self._node(self._current)
+                self._since = now
+        elif kind in ("execution_success", "execution_error", "execution_interrupted"):
+            self._close(now)
+            self.finished = now
+            self.status = kind.removeprefix("execution_")
+
+    def report(self) -> dict[str, Any]:
+        nodes = sorted(self.nodes.values(), key=lambda n: -n["elapsed"])
+        return {
+            "status": self.status,
+            "elapsed": (
+                round(self.finished - self.started, 3)
+                if self.started is not None and self.finished is not None
+                else None
+            ),
+            "nodes": [{**n, "elapsed": round(n["elapsed"], 3)} for n in nodes],
+        }
+
+
+class RequestProfile:
+    def __init__(self, request_id: str, workflow: dict, interval: float = 0.005):
+        self.request_id = request_id
+        self.workflow = workflow
+        self.sampler = StackSampler(interval)
+        self.stages: list[dict[str, Any]] = []
+        self.prompts: dict[str, NodeTimes] = {}
+        self.started = time.time()
+        self._origin = time.monotonic()
+        self.elapsed = 0.0
+
+    def start(self) -> None:
+        self.sampler.start()
+
+    def stop(self) -> None:
+        self.sampler.stop()
+        self.elapsed = time.monotonic() - self._origin
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stages.append(
+                {
+                    "name": name,
+                    "start": round(start - self._origin, 3),
+                    "elapsed": round(time.monotonic() - start, 3),
+                }
+            )
+
+    @contextlib.asynccontextmanager
+    async def nodes(self, host: str, port: int, client_id: str) -> AsyncIterator[None]:
+        """Record the node times of the prompt submitted in this block"""
+        times = self.prompts[client_id] = NodeTimes(self.workflow)
+        connected = asyncio.Event()
+
+        async def listen():
+            async for event in follow_prompt(host, port, client_id, connected=connected):
+                times.feed(event, time.monotonic())
+
+        task = asyncio.ensure_future(listen())
+        waiter = asyncio.ensure_future(connected.wait())
+        # events sent before the connection would be missed
+        await asyncio.wait({task, waiter}, timeout=5, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        try:
+            yield
+        finally:
+            # ComfyUI sends the last events right before it records the prompt as done
+            await asyncio.wait({task}, timeout=1)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            if not task.cancelled() and task.exception() is not None:
+                logger.warning(
+                    "No node times for %s: %s", client_id, task.exception()
+                )
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "started": time.strftime(
+                "%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)
+            ),
+            "elapsed": round(self.elapsed, 3),
+            "stages": sorted(self.stages, key=lambda s: s["start"]),
+            "prompts": {k: v.report() for k, v in self.prompts.items()},
+            "sampling": {
+                "interval": self.sampler.interval,
+                "samples": self.sampler.samples,
+                "idle": self.sampler.idle,
+            },
+            "stacks": dict(self.sampler.stacks.most_common()),
+        }
+
+
+def stage(profile: RequestProfile | None, name: str):
+    """`profile.stage(name)`, or nothing when the request is not profiled"""
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.stage(name)
+
+
+@contextlib.asynccontextmanager
+async def _nothing() -> AsyncIterator[None]:
+    yield
+
+
+def node_times(profile: RequestProfile | None, host: str, port: int, client_id: str):
+    """`profile.nodes(...)`, or nothing when the request is not profiled"""
+    if profile is None:
+        return _nothing()
+    return profile.nodes(host, port, client_id)
+
+
+class ProfileStore:
+    """The latest `keep` profiles, as JSON files named by request id"""
+
+    def __init__(self, directory: Path, keep: int = 100) -> None:
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def path(self, request_id: str) -> Path:
+        return self.directory / f"{request_id}.json"
+
+    def save(self, profile: RequestProfile) -> Path:
+        path = self.path(profile.request_id)
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(profile.report(), indent=2))
+            os.replace(tmp, path)
+            profiles = sorted(
+                self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime
+            )
+            for old in profiles[: max(0, len(profiles) - self.keep)]:
+                old.unlink(missing_ok=True)
+        return path
+
+    def load(self, request_id: str) -> dict[str, Any] | None:
+        try:
+            return json.loads(self.path(request_id).read_text())
+        except FileNotFoundError:
+            return None
+
+
+def collapsed(report: dict[str, Any]) -> str:
+    """The stacks of a profile in the collapsed format, for flame graphs"""
+    return "".join(f"{stack} {count}\n" for stack, count in report["stacks"].items())
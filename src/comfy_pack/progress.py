@@ -0,0 +1,259 @@
+"""
+Relay of the progress of a prompt from ComfyUI's websocket.
+
+ComfyUI sends the events of a prompt, and its preview frames, to the
+websocket of the client id the prompt was submitted with. The service
+submits each request with the request id as client id, so that listening
+on that client id follows the request from the moment it starts running
+until it finishes. The service follows a request both to relay its
+progress and to profile it, over one websocket.
+
+A prompt that finished before it was followed, or that ComfyUI never got,
+sends nothing on the websocket. Its follower looks it up in ComfyUI's queue
+and history when it subscribes and whenever the websocket stays idle, and
+ends with the final event of the prompt, or a `not_found` event.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import contextlib
+import json
+import struct
+import time
+from typing import Any, AsyncIterator, Callable
+
+import aiohttp
+
+# ComfyUI's binary event types for preview frames
+PREVIEW_IMAGE = 1
+PREVIEW_IMAGE_WITH_METADATA = 4
+IMAGE_FORMATS = {1: "jpeg", 2: "png"}
+
+RELAYED_EVENTS = {
+    "execution_start",
+    "execution_cached",
+    "executing",
+    "progress",
+    "executed",
+    "execution_success",
+    "execution_error",
+    "execution_interrupted",
+}
+FINAL_EVENTS = {"execution_success", "execution_error", "execution_interrupted"}
+# the latest prompts of ComfyUI's history searched for a client id
+HISTORY_ITEMS = 64
+
+
+def _decode_preview(data: bytes) -> dict[str, Any] | None:
+    event, = struct.unpack(">I", data[:4])
+    if event == PREVIEW_IMAGE:
+        image_format, = struct.unpack(">I", data[4:8])
+        fmt, image = IMAGE_FORMATS.get(image_format, "jpeg"), data[8:]
+    elif event == PREVIEW_IMAGE_WITH_METADATA:
+        size, = struct.unpack(">I", data[4:8])
+        metadata = json.loads(data[8 : 8 + size])
+        fmt = metadata.get("image_type", "image/jpeg").rpartition("/")[2]
+        image = data[8 + size :]
+    else:
+        return None
+    return {"format": fmt, "image": base64.b64encode(image).decode()}
+
+
+class _Channel:
+    """The websocket of a client id, its messages copied to every subscriber"""
+
+    def __init__(self, host: str, port: int, client_id: str) -> None:
+        self.queues: set[asyncio.Queue] = set()
+        self.connected = asyncio.Event()
+        self.task = asyncio.ensure_future(self._run(host, port, client_id))
+
+    async def _run(self, host: str, port: int, client_id: str) -> None:
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.ws_connect(
+                    f"http://{host}:{port}/ws", params={"clientId": client_id}
+                ) as ws:
+                    self.connected.set()
+                    async for msg in ws:
+                        if msg.type not in (
+                            aiohttp.WSMsgType.TEXT,
+                            aiohttp.WSMsgType.BINARY,
+                        ):
+                            break
+                        for queue in self.queues:
+                            queue.put_nowait((msg.type, msg.data))
+        finally:
+            # closed by ComfyUI
+            for queue in self.queues:
+                queue.put_nowait(None)
+
+
+# ComfyUI keeps one websocket per client id, a second connection would take
+# the events away from the first, so the followers of a client id share one
+_channels: dict[tuple[str, int, str], _Channel] = {}
+
+
+@contextlib.asynccontextmanager
+async def _subscribe(
+    host: str, port: int, client_id: str
+) -> AsyncIterator[tuple[_Channel, asyncio.Queue]]:
+    key = (host, port, client_id)
+    channel = _channels.get(key)
+    if channel is None or channel.task.done():
+        channel = _channels[key] = _Channel(host, port, client_id)
+    queue: asyncio.Queue = asyncio.Queue()
+    channel.queues.add(queue)
+    try:
+        yield channel, queue
+    finally:
+        channel.queues.discard(queue)
+        if not channel.queues and _channels.get(key) is channel:
+            del _channels[key]
+            channel.task.cancel()
+
+
+def _client_id(item: list) -> str | None:
+    """The client id of a queue or history item, `[number, id, prompt, extra, ...]`"""
+    if len(item) > 3 and isinstance(item[3], dict):
+        return item[3].get("client_id")
+    return None
+
+
+async def prompt_status(host: str, port: int, client_id: str) -> dict[str, Any] | None:
+    """
+    The state of the latest prompt of `client_id` in ComfyUI: a `queued`
+    event while it waits or runs, its final event once it is done, None if
+    ComfyUI has no prompt for the client id.
+    """
+    url = f"http://{host}:{port}"
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{url}/queue") as resp:
+            queue = await resp.json()
+        for item in queue.get("queue_running", []) + queue.get("queue_pending", []):
+            if _client_id(item) == client_id:
+                return {"type": "queued", "data": {"prompt_id": item[1]}}
+        async with session.get(
+            f"{url}/history", params={"max_items": str(HISTORY_ITEMS)}
+        ) as resp:
+            history = await resp.json()
+    for prompt_id, entry in reversed(list(history.items())):
+        if _client_id(entry.get("prompt", [])) != client_id:
+            continue
+        status = entry.get("status") or {}
+        final = [e for e, _ in status.get("messages", []) if e in FINAL_EVENTS]
+        if final:
+            kind = final[-1]
+        elif status.get("status_str") == "success":
+            kind = "execution_success"
+        else:
+            kind = "execution_error"
+        return {"type": kind, "data": {"prompt_id": prompt_id}}
+    return None
+
+
+async def follow_prompt(
+    host: str,
+    port: int,
+    client_id: str,
+    previews: bool = False,
+    preview_interval: float = 1.0,
+    heartbeat: float = 15.0,
+    connected: asyncio.Event | None = None,
+    idle_timeout: float | None = None,
+    expected: Callable[[], bool] | None = None,
+) -> AsyncIterator[dict[str, Any]]:
+    """
+    Yield the events ComfyUI sends for `client_id`, as `{"type", "data"}`
+    dicts, until its prompt finishes. A `heartbeat` event is yielded after
+    `heartbeat` seconds of silence. Preview frames, if asked for, are sent
+    as `preview` events at most once every `preview_interval` seconds.
+    `connected` is set once the websocket is open. Several followers of the
+    same client id share its websocket.
+
+    With `idle_timeout`, the prompt is looked up in ComfyUI when following
+    starts and after every `idle_timeout` seconds without events, to end
+    with its final event if it is done, or a `not_found` event if ComfyUI
+    doesn't know it. `expected` tells whether the prompt is yet to be
+    submitted, e.g. waiting for a slot, which keeps the follower waiting.
+    """
+
+    async def finished() -> dict[str, Any] | None:
+        """The event to end with, if any"""
+        if expected is not None and expected():
+            return None
+        status = await prompt_status(host, port, client_id)
+        if status is None:
+            return {"type": "not_found", "data": {"client_id": client_id}}
+        return status if status["type"] in FINAL_EVENTS else None
+
+    last_preview = 0.0
+    async with _subscribe(host, port, client_id) as (channel, queue):
+        opened = asyncio.ensure_future(channel.connected.wait())
+        try:
+            await asyncio.wait(
+                {channel.task, opened}, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            opened.cancel()
+        if not channel.connected.is_set():
+            # raises the connection error
+            await channel.task
+            return
+        if connected is not None:
+            connected.set()
+        if idle_timeout is not None:
+            status = await finished()
+            # not yet submitted is for the idle check to tell
+            if status is not None and status["type"] != "not_found":
+                yield status
+                return
+        # ComfyUI sends its queue status to every client id, which is
+        # neither an event of the prompt nor sent to the follower
+        last_event = last_sent = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if idle_timeout is not None and now - last_event >= idle_timeout:
+                last_event = now
+                status = await finished()
+                if status is not None:
+                    yield status
+                    return
+            timeout = heartbeat - (now - last_sent)
+            if idle_timeout is not None:
+                timeout = min(timeout, idle_timeout - (now - last_event))
+            try:
+                msg = await asyncio.wait_for(queue.get(), timeout=max(0.0, timeout))
+            except asyncio.TimeoutError:
+                if time.monotonic() - last_sent >= heartbeat:
+                    last_sent = time.monotonic()
+                    yield {"type": "heartbeat", "data": {}}
+                continue
+            if msg is None:
+                return
+            msg_type, data = msg
+            if msg_type == aiohttp.WSMsgType.BINARY:
+                last_event = now = time.monotonic()
+                if not previews or now - last_preview < preview_interval:
+                    continue
+                preview = _decode_preview(data)
+                if preview is not None:
+                    last_preview = last_sent = now
+                    yield {"type": "preview", "data": preview}
+                continue
+            event = json.loads(data)
+            if event.get("type") not in RELAYED_EVENTS:
+                continue
+            last_event = last_sent = time.monotonic()
+            yield event
+            data = event.get("data") or {}
+            if event["type"] in FINAL_EVENTS or (
+                event["type"] == "executing" and data.get("node") is None
+            ):
+                return
+
+
+def sse_event(event: dict[str, Any]) -> str:
+    """Format an event for a text/event-stream response"""
+    return f"event: {event['type']}\ndata: {json.dumps(event.get('data'))}\n\n"
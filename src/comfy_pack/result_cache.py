@@ -0,0 +1,255 @@
+"""
+A content-addressed cache of workflow outputs.
+
+Each output node of a workflow is cached on its own, keyed by the nodes it
+depends on and the validated inputs that feed them, with file inputs
+identified by the SHA-256 of their content. A request whose outputs were
+all produced before is answered without running ComfyUI, and one with some
+of them cached only runs the nodes the others need.
+
+A node whose ``_meta`` has ``"nondeterministic": true`` gives different
+results from run to run. The outputs that depend on it are keyed as if by
+a nonce of the request, so they are never looked up nor stored, while the
+other outputs of the workflow are still cached.
+"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from .const import RESULT_CACHE_DIR
+from .utils import _parse_workflow, link_or_copy
+
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    key TEXT PRIMARY KEY,
+    files TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+
+def _is_link(value: Any) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+    )
+
+
+def _upstream(workflow: dict, node_id: str) -> set[str]:
+    """The ids of the node and of all the nodes it depends on"""
+    seen = set()
+    stack = [node_id]
+    while stack:
+        current = stack.pop()
+        if current in seen or current not in workflow:
+            continue
+        seen.add(current)
+        stack.extend(
+            v[0] for v in workflow[current].get("inputs", {}).values() if _is_link(v)
+        )
+    return seen
+
+
+def _is_nondeterministic(node: dict) -> bool:
+    return bool(node.get("_meta", {}).get("nondeterministic"))
+
+
+def is_cacheable(workflow: dict) -> bool:
+    """Whether an output of the workflow depends on no nondeterministic node"""
+    _, outputs = _parse_workflow(copy.deepcopy(workflow))
+    return any(
+        not any(_is_nondeterministic(workflow[n]) for n in _upstream(workflow, o["id"]))
+        for o in outputs.values()
+    )
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _canonical(value: Any) -> Any:
+    if isinstance(value, Path):
+        return {"$file": _file_digest(value)}
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def output_cache_keys(workflow: dict, inputs: dict[str, Any]) -> dict[str, str | None]:
+    """
+    The cache key of each output node of a request, by node id, None for
+    the outputs that depend on a nondeterministic node.
+    """
+    workflow = copy.deepcopy(workflow)
+    input_spec, output_spec = _parse_workflow(workflow)
+    input_nodes = {name: node["id"] for name, node in input_spec.items()}
+    keys: dict[str, str | None] = {}
+    for output in output_spec.values():
+        node_id = output["id"]
+        upstream = _upstream(workflow, node_id)
+        if any(_is_nondeterministic(workflow[n]) for n in upstream):
+            keys[node_id] = None
+            continue
+        nodes = {
+            n: {"class_type": workflow[n]["class_type"], "inputs": workflow[n]["inputs"]}
+            for n in upstream
+        }
+        # where the outputs are written differs from request to request
+        nodes[node_id] = {
+            **nodes[node_id],
+            "inputs": {
+                k: v
+                for k, v in nodes[node_id]["inputs"].items()
+                if k != "filename_prefix"
+            },
+        }
+        payload = {
+            "output": node_id,
+            "nodes": nodes,
+            "inputs": {
+                k: _canonical(v)
+                for k, v in inputs.items()
+                if input_nodes.get(k) in upstream
+            },
+        }
+        keys[node_id] = hashlib.sha256(
+            json.dumps(payload, sort_keys=True, default=str).encode()
+        ).hexdigest()
+    return keys
+
+
+def without_outputs(workflow: dict, node_ids: set[str]) -> dict:
+    """The workflow without some of its output nodes, which ComfyUI then skips"""
+    return {k: v for k, v in workflow.items() if k not in node_ids}
+
+
+class ResultCache:
+    """
+    The files of output nodes stored on disk under `root`, evicted least
+    recently used first once they take more than `max_size` bytes.
+
+    The files of an output are stored by their index, with the part of
+    their names after the output prefix, so that they are restored under
+    the prefix of the request that looks them up.
+    """
+
+    def __init__(self, root: Path = RESULT_CACHE_DIR, max_size: int = 1024**3):
+        self.root = root
+        self.max_size = max_size
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(root / "results.db"), timeout=30, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        with self._conn:
+            if version < SCHEMA_VERSION:
+                self._drop_results()
+                self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.execute(SCHEMA)
+
+    def _drop_results(self) -> None:
+        """Drop the whole results of requests the first version cached"""
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'results'"
+        ).fetchone()
+        if exists is None:
+            return
+        for (key,) in self._conn.execute("SELECT key FROM results").fetchall():
+            shutil.rmtree(self.root / key, ignore_errors=True)
+        self._conn.execute("DROP TABLE results")
+
+    def get(self, key: str, dest: Path, prefix: str) -> bool:
+        """Link the cached files of an output into `dest` under `prefix`"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT files FROM outputs WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return False
+            names = json.loads(row[0])
+            if not all((self.root / key / str(i)).is_file() for i in range(len(names))):
+                # removed behind our back
+                self._delete(key)
+                return False
+            dest.mkdir(parents=True, exist_ok=True)
+            for i, name in enumerate(names):
+                link_or_copy(self.root / key / str(i), dest / f"{prefix}{name}")
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE outputs SET last_used = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+            return True
+
+    def put(self, key: str, files: list[Path], prefix: str) -> None:
+        """Store the files an output wrote, named `prefix` and something"""
+        files = sorted(files, key=lambda f: f.name)
+        size = sum(f.stat().st_size for f in files)
+        if size > self.max_size:
+            return
+        tmp = self.root / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp.mkdir()
+        try:
+            for i, f in enumerate(files):
+                link_or_copy(f, tmp / str(i))
+            names = [f.name.removeprefix(prefix) for f in files]
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT 1 FROM outputs WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    return
+                shutil.rmtree(self.root / key, ignore_errors=True)
+                os.replace(tmp, self.root / key)
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)",
+                        (key, json.dumps(names), size, time.time()),
+                    )
+                self._evict()
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _delete(self, key: str) -> None:
+        shutil.rmtree(self.root / key, ignore_errors=True)
+        with self._conn:
+            self._conn.execute("DELETE FROM outputs WHERE key = ?", (key,))
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM outputs")
+        total = total.fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size FROM outputs ORDER BY last_used"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            self._delete(key)
+            total -= size
+
+    def close(self) -> None:
+        self._conn.close()
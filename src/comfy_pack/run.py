@@ -285,3 +285,133 @@ def run_workflow(
         output_dir,
         session_id=run_id,
     )
+
+
+def _comfy_api(
+    host: str, port: int, path: str, payload: dict | None = None, timeout: float = 30
+) -> Any:
+    from urllib import error, request
+
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = request.Request(
+        f"http://{host}:{port}{path}",
+        data=data,
+        headers={"Content-Type": "application/json"} if data else {},
+    )
+    try:
+        with request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read() or b"null")
+    except error.HTTPError as e:
+        detail = e.read().decode(errors="replace")
+        raise RuntimeError(f"ComfyUI returned {e.code} for {path}: {detail}") from e
+
+
+def submit_workflow(
+    host: str,
+    port: int,
+    workflow: dict,
+    output_dir: Path,
+    client_id: str = "",
+    **kwargs: Any,
+) -> tuple[str, dict, str]:
+    """
+    Queue a workflow on ComfyUI without waiting for it.
+
+    Unlike `run_workflow`, this talks to the ComfyUI API directly instead of
+    going through a `comfy run` process.
+
+    Returns:
+        tuple[str, dict, str]: The prompt id, the populated workflow and the
+        session id, the last two being what `retrieve_workflow_outputs` needs.
+    """
+    session_id = os.urandom(8).hex()
+    workflow_copy = copy.deepcopy(workflow)
+    populate_workflow(workflow_copy, output_dir, session_id=session_id, **kwargs)
+    prompt_id = submit_prompt(host, port, workflow_copy, client_id or session_id)
+    return prompt_id, workflow_copy, session_id
+
+
+def submit_prompt(host: str, port: int, prompt: dict, client_id: str = "") -> str:
+    """Queue an already populated workflow on ComfyUI and return its prompt id"""
+    resp = _comfy_api(
+        host,
+        port,
+        "/prompt",
+        {"prompt": prompt, "client_id": client_id or uuid.uuid4().hex},
+    )
+    return resp["prompt_id"]
+
+
+def poll_prompt(host: str, port: int, prompt_id: str) -> tuple[bool, str | None]:
+    """
+    Check a queued prompt.
+
+    Returns:
+        tuple[bool, str | None]: Whether the prompt finished, and its error
+        message if it failed.
+    """
+    history = _comfy_api(host, port, f"/history/{prompt_id}")
+    entry = (history or {}).get(prompt_id)
+    if not entry:
+        return False, None
+    status = entry.get("status") or {}
+    if status.get("status_str") == "error":
+        error = next(
+            (
+                data.get("exception_message", "")
+                for kind, data in status.get("messages", [])
+                if kind == "execution_error"
+            ),
+            "Execution failed",
+        )
+        return True, error
+    return bool(status.get("completed", True)), None
+
+
+def cancel_prompt(host: str, port: int, prompt_id: str) -> str | None:
+    """
+    Stop a prompt, removing it from the queue if it hasn't started yet or
+    interrupting it if it is running.
+
+    Returns:
+        str | None: "dequeued", "interrupted", or None if the prompt was
+        neither queued nor running.
+    """
+    queue = _comfy_api(host, port, "/queue") or {}
+    if any(item[1] == prompt_id for item in queue.get("queue_pending", [])):
+        _comfy_api(host, port, "/queue", {"delete": [prompt_id]})
+        return "dequeued"
+    if any(item[1] == prompt_id for item in queue.get("queue_running", [])):
+        # older ComfyUI ignores the prompt id and interrupts whatever runs,
+        # which is this prompt as we just checked
+        _comfy_api(host, port, "/interrupt", {"prompt_id": prompt_id})
+        return "interrupted"
+    return None
+
+
+def wait_for_prompts(
+    host: str,
+    port: int,
+    prompt_ids: list[str],
+    timeout: float = 300,
+    poll_interval: float = 0.5,
+):
+    """
+    Yield `(prompt_id, error)` for each prompt as it finishes, in completion
+    order. `error` is None if the prompt succeeded.
+
+    Raises:
+        TimeoutError: If some prompts are still not finished after `timeout` seconds.
+    """
+    pending = list(prompt_ids)
+    deadline = time.monotonic() + timeout
+    while pending:
+        for prompt_id in list(pending):
+            done, error = poll_prompt(host, port, prompt_id)
+            if done:
+                pending.remove(prompt_id)
+                yield prompt_id, error
+        if pending:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{len(pending)} prompts did not finish in time")
+            time.sleep(poll_interval)
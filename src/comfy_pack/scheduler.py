@@ -0,0 +1,135 @@
+"""
+Fair scheduling of prompts across the callers of the service.
+
+ComfyUI executes its queue first in, first out, so a caller submitting
+thousands of jobs delays everybody else. The scheduler keeps only a small
+window of prompts in ComfyUI's queue and decides itself which request gets
+the next slot:
+
+- priority lanes are served strictly in order, interactive before batch;
+- within a lane, callers share the slots by weighted fair queuing, each
+  request gets a virtual finish tag advancing by 1 / weight of its caller,
+  and the smallest tag goes first.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+from dataclasses import dataclass, field
+
+PRIORITIES = ("interactive", "batch")
+
+
+def parse_weights(spec: str) -> dict[str, float]:
+    """Parse `caller=weight` pairs separated by commas, e.g. `a=3,b=1`"""
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+@dataclass(order=True)
+class _Waiter:
+    tag: float
+    seq: int
+    future: asyncio.Future = field(compare=False)
+
+
+class FairScheduler:
+    def __init__(
+        self,
+        window: int = 2,
+        weights: dict[str, float] | None = None,
+        default_weight: float = 1.0,
+    ) -> None:
+        self.window = window
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self._running = 0
+        self._queues: dict[str, list[_Waiter]] = {p: [] for p in PRIORITIES}
+        self._virtual_time = dict.fromkeys(PRIORITIES, 0.0)
+        self._finish: dict[tuple[str, str], float] = {}
+        self._seq = itertools.count()
+
+    def _tag(self, priority: str, caller: str) -> float:
+        start = max(
+            self._virtual_time[priority], self._finish.get((priority, caller), 0.0)
+        )
+        finish = start + 1.0 / self.weights.get(caller, self.default_weight)
+        self._finish[(priority, caller)] = finish
+        return finish
+
+    def _advance(self, priority: str, tag: float) -> None:
+        """
+        Move the virtual time of a lane to the tag of the request granted a
+        slot, forgetting the callers whose finish tag it has caught up
+        with: their next request starts at the virtual time either way.
+        """
+        self._virtual_time[priority] = tag
+        self._finish = {
+            key: finish
+            for key, finish in self._finish.items()
+            if key[0] != priority or finish > tag
+        }
+
+    def _has_waiters(self) -> bool:
+        return any(
+            not w.future.cancelled() for queue in self._queues.values() for w in queue
+        )
+
+    async def acquire(self, caller: str, priority: str = "interactive") -> None:
+        """Wait for a slot, which must be given back with `release`"""
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority {priority!r}, expected {PRIORITIES}")
+        tag = self._tag(priority, caller)
+        if self._running < self.window and not self._has_waiters():
+            self._running += 1
+            self._advance(priority, tag)
+            return
+        waiter = _Waiter(tag, next(self._seq), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queues[priority], waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # the slot was granted just as we gave up
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self._running -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self._running < self.window:
+                waiter = heapq.heappop(queue)
+                if waiter.future.done():
+                    # cancelled while waiting
+                    continue
+                self._running += 1
+                self._advance(priority, waiter.tag)
+                waiter.future.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, caller: str, priority: str = "interactive"):
+        await self.acquire(caller, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "running": self._running,
+            "queued": {
+                priority: sum(1 for w in queue if not w.future.done())
+                for priority, queue in self._queues.items()
+            },
+        }
@@ -1,26 +1,96 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import contextlib
+import copy
 import json
 import logging
 import os
+import random
+import re
 import signal
+import uuid
+import tempfile
 import threading
 import time
+from collections import Counter
 from functools import lru_cache
+from http import HTTPStatus
 from pathlib import Path
-from typing import Any, cast
+from typing import Any, AsyncGenerator, Iterator, cast
 
 import bentoml
 import fastapi
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, create_model, field_validator
+from bentoml.exceptions import BadInput, BentoMLException
 from bentoml.models import HuggingFaceModel
 
 import comfy_pack
 import comfy_pack.run
+from comfy_pack.admission import AdmissionController, AdmissionMiddleware
+from comfy_pack.batching import (
+    MicroBatcher,
+    distribute_folded_outputs,
+    fold_latent_batches,
+    latent_batch_size,
+    merge_workflows,
+)
+from comfy_pack.model_store import parse_size
+from comfy_pack.profiling import (
+    ProfileStore,
+    RequestProfile,
+    collapsed,
+    node_times,
+    stage,
+)
+from comfy_pack.progress import follow_prompt, sse_event
+from comfy_pack.result_cache import (
+    ResultCache,
+    is_cacheable,
+    output_cache_keys,
+    without_outputs,
+)
+from comfy_pack.scheduler import PRIORITIES, FairScheduler, parse_weights
+from comfy_pack.utils import STAGING_SUBDIR, prune_staged_inputs, stage_input_file
 
 REQUEST_TIMEOUT = 3600
+# Seconds between two checks of a running prompt
+POLL_INTERVAL = 0.5
+# Requests are turned away once their expected wait exceeds this many seconds
+LATENCY_SLO = float(os.environ.get("CPACK_LATENCY_SLO", str(REQUEST_TIMEOUT)))
+# Maximum number of requests in flight, 0 for no limit
+MAX_QUEUE = int(os.environ.get("CPACK_MAX_QUEUE", "0"))
+# Prompts handed to ComfyUI at once, the rest wait in the scheduler
+SCHEDULER_WINDOW = int(os.environ.get("CPACK_SCHEDULER_WINDOW", "2"))
+# Shares of the callers, e.g. team-a=3,team-b=1, others weigh 1
+CALLER_WEIGHTS = parse_weights(os.environ.get("CPACK_CALLER_WEIGHTS", ""))
 BASE_DIR = Path(__file__).parent
 COPY_THRESHOLD = 10 * 1024 * 1024
+# Seconds to wait for more requests to merge into one prompt, 0 disables it
+BATCH_WINDOW = float(os.environ.get("CPACK_BATCH_WINDOW", "0"))
+MAX_BATCH_SIZE = int(os.environ.get("CPACK_MAX_BATCH_SIZE", "8"))
+# Merged requests differing only in their seed share one latent batch, their
+# images then all come from the seed of the first one
+BATCH_LATENTS = os.environ.get("CPACK_BATCH_LATENTS", "0") in ("1", "true", "True")
+# Disk space for the results of repeated requests, e.g. 2G, empty disables it
+RESULT_CACHE_SIZE = os.environ.get("CPACK_RESULT_CACHE_SIZE", "")
+# Seconds a progress stream waits without events before checking its prompt
+PROGRESS_IDLE_TIMEOUT = float(os.environ.get("CPACK_PROGRESS_IDLE_TIMEOUT", "60"))
+# Fraction of the requests profiled, besides those asking with X-Cpack-Profile
+PROFILE_RATE = float(os.environ.get("CPACK_PROFILE_RATE", "0"))
+PROFILE_DIR = Path(
+    os.environ.get("CPACK_PROFILE_DIR", Path(tempfile.gettempdir()) / "cpack-profiles")
+)
+# Number of profiles kept for /comfy/profiles/{id}
+PROFILE_KEEP = int(os.environ.get("CPACK_PROFILE_KEEP", "100"))
+# Requests profiled at once, each profile samples the stacks of every thread
+MAX_PROFILES = 2
 INPUT_DIR = BASE_DIR / "input"
+STAGING_DIR = INPUT_DIR / STAGING_SUBDIR
+# Staged inputs unused for this long are removed when the service starts
+STAGED_INPUT_TTL = 7 * 24 * 3600
 logger = logging.getLogger("bentoml.service")
 
 
@@ -30,6 +100,33 @@ with BASE_DIR.joinpath("workflow_api.json").open() as f:
     workflow = json.load(f)
 
 InputModel = comfy_pack.generate_input_model(workflow)
+
+
+def _batch_item_model(model: type[BaseModel]) -> type[BaseModel]:
+    """
+    The items of /generate_batch. Its JSON body can't carry files, and a
+    path in it would name a file of the server, so file inputs are turned
+    away with a validation error, a 400.
+    """
+    files = [
+        name for name, field in model.model_fields.items() if field.annotation is Path
+    ]
+    if not files:
+        return model
+
+    def reject(cls, value):
+        raise ValueError(
+            "file inputs are not supported by /generate_batch, send them to /generate"
+        )
+
+    return create_model(
+        f"{model.__name__}BatchItem",
+        __base__=model,
+        __validators__={"reject_files": field_validator(*files, mode="before")(reject)},
+    )
+
+
+BatchItemModel = _batch_item_model(InputModel)
 app = fastapi.FastAPI()
 
 
@@ -48,11 +145,87 @@ def _get_workspace() -> Path:
     return wp
 
 
+admission = AdmissionController(slo=LATENCY_SLO, max_queue=MAX_QUEUE)
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+profile_store = ProfileStore(PROFILE_DIR, keep=PROFILE_KEEP)
+# ids of the requests the service is working on, which may not have reached
+# ComfyUI yet, e.g. while they wait in the scheduler
+active_requests: Counter[str] = Counter()
+
+
+@contextlib.contextmanager
+def _active(request_ids: list[str]) -> Iterator[None]:
+    active_requests.update(request_ids)
+    try:
+        yield
+    finally:
+        active_requests.subtract(request_ids)
+        for request_id in request_ids:
+            if active_requests[request_id] <= 0:
+                del active_requests[request_id]
+
+
 @app.get("/workflow.json")
 def workflow_json():
     return workflow
 
 
+@app.get("/load")
+def load():
+    return admission.load()
+
+
+@app.get("/progress/{request_id}")
+async def progress(request_id: str, previews: bool = False):
+    """
+    Stream the ComfyUI events of a request as server-sent events, from when
+    it starts running until it finishes, with preview frames if asked for.
+    A client cancels the request by closing its `/generate` connection.
+    The stream of a request that is already done ends with its final event,
+    and that of a request neither the service nor ComfyUI knows ends with a
+    `not_found` event once idle for CPACK_PROGRESS_IDLE_TIMEOUT.
+    """
+    if not REQUEST_ID_PATTERN.fullmatch(request_id):
+        raise fastapi.HTTPException(400, "Invalid request id")
+    address = getattr(app.state, "comfyui_address", None)
+    if address is None:
+        raise fastapi.HTTPException(503, "ComfyUI is not ready")
+
+    async def events():
+        async for event in follow_prompt(
+            *address,
+            request_id,
+            previews=previews,
+            idle_timeout=PROGRESS_IDLE_TIMEOUT,
+            expected=lambda: request_id in active_requests,
+        ):
+            yield sse_event(event)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.get("/profiles/{request_id}")
+def profiles(request_id: str, format: str = "json"):
+    """
+    The profile of a request that was profiled, as JSON, or with
+    `?format=collapsed` its stacks only, for flame graph tools.
+    """
+    if not REQUEST_ID_PATTERN.fullmatch(request_id):
+        raise fastapi.HTTPException(400, "Invalid request id")
+    if format not in ("json", "collapsed"):
+        raise fastapi.HTTPException(400, "format must be json or collapsed")
+    report = profile_store.load(request_id)
+    if report is None:
+        raise fastapi.HTTPException(404, "No profile for this request")
+    if format == "collapsed":
+        return PlainTextResponse(collapsed(report))
+    return report
+
+
 def _watch_server(server: comfy_pack.run.ComfyUIServer):
     while True:
         time.sleep(1)
@@ -73,6 +246,87 @@ else:
     snapshot = {}
 
 
+class DeadlineExceeded(BentoMLException):
+    error_code = HTTPStatus.GATEWAY_TIMEOUT
+
+
+cancelled_prompts = bentoml.metrics.Counter(
+    name="cpack_cancelled_prompts",
+    documentation="Prompts stopped in ComfyUI because nobody waits for them anymore, "
+    "action is dequeued (never ran), interrupted (stopped midway) or finished",
+    labelnames=["reason", "action"],
+)
+
+
+def _request_timeout(ctx: bentoml.Context) -> float:
+    """The request timeout, which clients can lower with the X-Request-Timeout header"""
+    timeout = REQUEST_TIMEOUT
+    if ctx.request is not None:
+        try:
+            timeout = min(timeout, float(ctx.request.headers["x-request-timeout"]))
+        except (KeyError, ValueError):
+            pass
+    return timeout
+
+
+def _request_id(ctx: bentoml.Context) -> str:
+    """
+    The id to follow a request at /comfy/progress/{id}, chosen by the client
+    with the X-Cpack-Request-Id header or generated and sent back in it.
+    """
+    request_id = ""
+    if ctx.request is not None:
+        request_id = ctx.request.headers.get("x-cpack-request-id", "")
+        # leaves room for the index suffix of batch items
+        if request_id and not (
+            REQUEST_ID_PATTERN.fullmatch(request_id) and len(request_id) <= 48
+        ):
+            raise BadInput("X-Cpack-Request-Id must be 1-48 letters, digits, - or _")
+    request_id = request_id or uuid.uuid4().hex
+    ctx.response.headers["X-Cpack-Request-Id"] = request_id
+    return request_id
+
+
+def _caller(ctx: bentoml.Context, priority: str) -> tuple[str, str]:
+    """
+    Who is calling and in which priority lane, from the X-Cpack-Caller and
+    X-Cpack-Priority headers, falling back to the API key of the request.
+    """
+    if ctx.request is None:
+        return "anonymous", priority
+    headers = ctx.request.headers
+    caller = headers.get("x-cpack-caller")
+    if not caller and (key := headers.get("authorization")):
+        import hashlib
+
+        caller = "key-" + hashlib.sha256(key.encode()).hexdigest()[:12]
+    priority = headers.get("x-cpack-priority", priority)
+    if priority not in PRIORITIES:
+        raise BadInput(f"X-Cpack-Priority must be one of {', '.join(PRIORITIES)}")
+    return caller or "anonymous", priority
+
+
+def _encode_outputs(value: Any) -> Any:
+    if isinstance(value, Path):
+        return {
+            "filename": value.name,
+            "data": base64.b64encode(value.read_bytes()).decode(),
+        }
+    if isinstance(value, dict):
+        return {k: _encode_outputs(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_encode_outputs(v) for v in value]
+    return value
+
+
+def _batch_line(index: int, outputs: Any = None, error: Any = None) -> str:
+    if error is not None:
+        line = {"index": index, "ok": False, "error": str(error)}
+    else:
+        line = {"index": index, "ok": True, "outputs": _encode_outputs(outputs)}
+    return json.dumps(line) + "\n"
+
+
 @bentoml.asgi_app(app, path="/comfy")
 @bentoml.service(traffic={"timeout": REQUEST_TIMEOUT * 2}, resources={"gpu": 1})
 class ComfyService:
@@ -106,29 +360,460 @@ class ComfyService:
             else:
                 self.host = EXISTING_COMFYUI_SERVER
                 self.port = 80
+        app.state.comfyui_address = (self.host, self.port)
+        prune_staged_inputs(STAGING_DIR, STAGED_INPUT_TTL)
+        self.result_cache = None
+        if RESULT_CACHE_SIZE and is_cacheable(workflow):
+            self.result_cache = ResultCache(max_size=parse_size(RESULT_CACHE_SIZE))
+            logger.info("Caching results up to %s", RESULT_CACHE_SIZE)
+        self.batcher = None
+        # the images of a folded request depend on the batch it ran in
+        self.fold_latents = BATCH_LATENTS and self.result_cache is None
+        if BATCH_LATENTS and self.result_cache is not None:
+            logger.warning("Not folding latent batches, the result cache is on")
+        if BATCH_WINDOW > 0:
+            self.batcher = MicroBatcher(
+                self._run_merged, window=BATCH_WINDOW, max_batch=MAX_BATCH_SIZE
+            )
+            logger.info(
+                "Merging requests arriving within %ss, up to %s per prompt",
+                BATCH_WINDOW,
+                MAX_BATCH_SIZE,
+            )
+        # a merged prompt holds the slots of all its requests
+        self.scheduler = FairScheduler(
+            window=SCHEDULER_WINDOW * (MAX_BATCH_SIZE if self.batcher else 1),
+            weights=CALLER_WEIGHTS,
+        )
+        self.profiling = 0
+
+    def _stage_inputs(self, inputs: dict[str, Any]) -> dict[str, Any]:
+        """Replace the file inputs with their content-addressed copies"""
+        return {
+            k: stage_input_file(v, STAGING_DIR, COPY_THRESHOLD)
+            if isinstance(v, Path)
+            else v
+            for k, v in inputs.items()
+        }
+
+    def _run_merged(self, items: list[tuple[Path, dict, dict, str]]) -> list[Any]:
+        """
+        Run several requests as one ComfyUI prompt, see `comfy_pack.batching`.
+        An item is the output directory, the inputs, the workflow to run and
+        the session id of a request.
+        A request with invalid inputs fails alone, and if the merged prompt
+        fails, its requests are run again one by one so that only the
+        failing ones fail.
+        """
+        results: list[Any] = [None] * len(items)
+        members = []
+        for index, (output_dir, inputs, template, session_id) in enumerate(items):
+            populated = copy.deepcopy(template)
+            try:
+                comfy_pack.populate_workflow(
+                    populated, output_dir, session_id=session_id, **inputs
+                )
+            except Exception as e:
+                results[index] = e
+                continue
+            members.append((index, populated, session_id, output_dir))
+        if not members:
+            return results
+
+        try:
+            self._run_members(members, fold=self.fold_latents)
+        except Exception as e:
+            if len(members) == 1:
+                results[members[0][0]] = e
+                return results
+            logger.warning(
+                "Merged prompt failed (%s), running its %s requests one by one",
+                e,
+                len(members),
+            )
+            for member in members:
+                _, populated, session_id, output_dir = member
+                # the outputs the merged prompt wrote before failing, but
+                # not those restored from the result cache
+                for node_id, node in populated.items():
+                    if node["class_type"].startswith("CPackOutput"):
+                        for path in output_dir.glob(f"{session_id}{node_id}_*"):
+                            path.unlink()
+                try:
+                    self._run_members([member], fold=False)
+                except Exception as e:
+                    results[member[0]] = e
+                else:
+                    results[member[0]] = self._member_outputs(member)
+            return results
+        for member in members:
+            results[member[0]] = self._member_outputs(member)
+        return results
+
+    def _run_members(self, members: list[tuple], fold: bool) -> None:
+        """Run populated workflows as one prompt, raising if it fails"""
+        workflows = [populated for _, populated, _, _ in members]
+        if fold:
+            folds = fold_latent_batches(workflows)
+        else:
+            folds = [(populated, [i]) for i, populated in enumerate(workflows)]
+        merged, _ = merge_workflows([folded for folded, _ in folds])
+        prompt_id = comfy_pack.run.submit_prompt(self.host, self.port, merged)
+        for _, error in comfy_pack.run.wait_for_prompts(
+            self.host, self.port, [prompt_id], timeout=REQUEST_TIMEOUT
+        ):
+            if error is not None:
+                raise RuntimeError(error)
+        for folded, indices in folds:
+            if len(indices) > 1:
+                distribute_folded_outputs(
+                    folded,
+                    [(members[i][2], members[i][3]) for i in indices],
+                    [latent_batch_size(workflows[i]) for i in indices],
+                )
+
+    def _member_outputs(self, member: tuple) -> Any:
+        _, _, session_id, output_dir = member
+        try:
+            return self._retrieve_outputs(output_dir, session_id)
+        except Exception as e:
+            return e
 
     @bentoml.api(input_spec=InputModel)
-    def generate(
+    async def generate(
         self,
         *,
         ctx: bentoml.Context,
         **kwargs: Any,
     ) -> Path:
-        verbose = int("BENTOML_DEBUG" in os.environ)
-        ret = comfy_pack.run_workflow(
-            self.host,
-            self.port,
-            workflow,
-            output_dir=ctx.temp_dir,
-            timeout=REQUEST_TIMEOUT,
-            verbose=verbose,
-            workspace=self.server.workspace if hasattr(self, "server") else ".",
-            **kwargs,
+        deadline = time.monotonic() + _request_timeout(ctx)
+        caller, priority = _caller(ctx, "interactive")
+        request_id = _request_id(ctx)
+        profile = self._start_profile(ctx, request_id)
+        try:
+            with _active([request_id]):
+                return await self._generate(
+                    ctx, kwargs, caller, priority, deadline, request_id, profile
+                )
+        finally:
+            await self._finish_profile(profile)
+
+    async def _generate(
+        self,
+        ctx: bentoml.Context,
+        kwargs: dict[str, Any],
+        caller: str,
+        priority: str,
+        deadline: float,
+        request_id: str,
+        profile: RequestProfile | None,
+    ) -> Path:
+        with stage(profile, "stage inputs"):
+            kwargs = await asyncio.to_thread(self._stage_inputs, kwargs)
+        output_dir = Path(ctx.temp_dir)
+        session_id = os.urandom(8).hex()
+        keys: dict[str, str | None] = {}
+        cached: set[str] = set()
+        if self.result_cache is not None:
+            with stage(profile, "result cache lookup"):
+                keys = await asyncio.to_thread(output_cache_keys, workflow, kwargs)
+                cached = await asyncio.to_thread(
+                    self._restore_outputs, keys, output_dir, session_id
+                )
+            if cached and len(cached) == len(keys):
+                # not an execution for the admission controller
+                ctx.response.headers["X-Cpack-Cache"] = "hit"
+                return await asyncio.to_thread(
+                    self._retrieve_outputs, output_dir, session_id
+                )
+        template = without_outputs(workflow, cached)
+
+        with stage(profile, "scheduler wait"):
+            await self._acquire_slot(caller, priority, deadline, ctx.request)
+        try:
+            if self.batcher is not None:
+                future = self.batcher.submit((output_dir, kwargs, template, session_id))
+                try:
+                    # the node times of a merged prompt are not followed
+                    with stage(profile, "merged prompt"):
+                        ret = await asyncio.wait_for(
+                            asyncio.wrap_future(future), deadline - time.monotonic()
+                        )
+                except asyncio.TimeoutError:
+                    # the merged prompt serves other requests, let it finish
+                    raise DeadlineExceeded("The request deadline has passed")
+            else:
+                ret = await self._run_cancellable(
+                    kwargs,
+                    output_dir,
+                    deadline,
+                    request_id,
+                    ctx.request,
+                    profile,
+                    template=template,
+                    session_id=session_id,
+                )
+                if isinstance(ret, list):
+                    ret = ret[-1]
+        finally:
+            self.scheduler.release()
+        if any(key is not None and node_id not in cached for node_id, key in keys.items()):
+            with stage(profile, "result cache store"):
+                await asyncio.to_thread(
+                    self._store_outputs, keys, cached, output_dir, session_id
+                )
+        return ret
+
+    def _restore_outputs(
+        self, keys: dict[str, str | None], output_dir: Path, session_id: str
+    ) -> set[str]:
+        """Link the cached files of the outputs into `output_dir`, return their ids"""
+        return {
+            node_id
+            for node_id, key in keys.items()
+            if key is not None
+            and self.result_cache.get(key, output_dir, f"{session_id}{node_id}")
+        }
+
+    def _store_outputs(
+        self,
+        keys: dict[str, str | None],
+        cached: set[str],
+        output_dir: Path,
+        session_id: str,
+    ) -> None:
+        for node_id, key in keys.items():
+            if key is None or node_id in cached:
+                continue
+            prefix = f"{session_id}{node_id}"
+            self.result_cache.put(key, list(output_dir.glob(f"{prefix}_*")), prefix)
+
+    @staticmethod
+    def _retrieve_outputs(output_dir: Path, session_id: str) -> Any:
+        """
+        The outputs of all the output nodes of the workflow, whether they
+        ran or came from the result cache, the last file of a list
+        """
+        ret = comfy_pack.retrieve_workflow_outputs(
+            copy.deepcopy(workflow), output_dir, session_id=session_id
         )
         if isinstance(ret, list):
             ret = ret[-1]
         return ret
 
+    def _start_profile(
+        self, ctx: bentoml.Context, request_id: str
+    ) -> RequestProfile | None:
+        """
+        Profile the request if it asks for it with the X-Cpack-Profile
+        header or is drawn at CPACK_PROFILE_RATE, unless too many requests
+        are profiled already. The profile is then served at the path given
+        in the X-Cpack-Profile response header.
+        """
+        asked = ctx.request is not None and ctx.request.headers.get(
+            "x-cpack-profile", ""
+        ).lower() in ("1", "true", "yes")
+        if not asked and random.random() >= PROFILE_RATE:
+            return None
+        if self.profiling >= MAX_PROFILES:
+            logger.info("Not profiling %s, too many profiles running", request_id)
+            return None
+        self.profiling += 1
+        profile = RequestProfile(request_id, workflow)
+        profile.start()
+        ctx.response.headers["X-Cpack-Profile"] = f"/comfy/profiles/{request_id}"
+        return profile
+
+    async def _finish_profile(self, profile: RequestProfile | None) -> None:
+        if profile is None:
+            return
+        try:
+            await asyncio.to_thread(profile.stop)
+            await asyncio.to_thread(profile_store.save, profile)
+        finally:
+            self.profiling -= 1
+
+    async def _acquire_slot(
+        self, caller: str, priority: str, deadline: float, request=None
+    ) -> None:
+        """
+        Wait for the scheduler to hand this request a slot in ComfyUI's
+        queue, giving up when the deadline passes or the client disconnects.
+        """
+        task = asyncio.ensure_future(self.scheduler.acquire(caller, priority))
+        while True:
+            done, _ = await asyncio.wait(
+                {task}, timeout=min(POLL_INTERVAL, max(0, deadline - time.monotonic()))
+            )
+            if done:
+                task.result()
+                return
+            if time.monotonic() > deadline:
+                error = DeadlineExceeded("The request deadline has passed")
+            elif request is not None and await request.is_disconnected():
+                error = RuntimeError("The client disconnected")
+            else:
+                continue
+            task.cancel()
+            await asyncio.wait({task})
+            if not task.cancelled() and task.exception() is None:
+                # granted in the meantime
+                self.scheduler.release()
+            raise error
+
+    async def _run_cancellable(
+        self,
+        inputs: dict[str, Any],
+        output_dir: Path,
+        deadline: float,
+        request_id: str,
+        request=None,
+        profile: RequestProfile | None = None,
+        template: dict | None = None,
+        session_id: str | None = None,
+    ) -> Any:
+        """
+        Run the workflow, stopping it in ComfyUI as soon as the client
+        disconnects, the deadline passes or the task is cancelled. The
+        prompt is submitted with the request id as client id, which is what
+        the progress of the request is followed by.
+
+        `template` is the workflow without the outputs restored from the
+        result cache, and the outputs of the whole workflow are returned.
+        """
+        template = workflow if template is None else template
+        session_id = session_id or os.urandom(8).hex()
+        async with node_times(profile, self.host, self.port, request_id):
+            with stage(profile, f"ComfyUI prompt {request_id}"):
+                populated = copy.deepcopy(template)
+                await asyncio.to_thread(
+                    comfy_pack.populate_workflow,
+                    populated,
+                    output_dir,
+                    session_id=session_id,
+                    **inputs,
+                )
+                prompt_id = await asyncio.to_thread(
+                    comfy_pack.run.submit_prompt,
+                    self.host,
+                    self.port,
+                    populated,
+                    request_id,
+                )
+                try:
+                    while True:
+                        done, error = await asyncio.to_thread(
+                            comfy_pack.run.poll_prompt, self.host, self.port, prompt_id
+                        )
+                        if done:
+                            break
+                        if time.monotonic() > deadline:
+                            await self._cancel_prompt(prompt_id, "deadline")
+                            raise DeadlineExceeded("The request deadline has passed")
+                        if request is not None and await request.is_disconnected():
+                            await self._cancel_prompt(prompt_id, "disconnect")
+                            raise RuntimeError("The client disconnected")
+                        await asyncio.sleep(POLL_INTERVAL)
+                except asyncio.CancelledError:
+                    await self._cancel_prompt(prompt_id, "disconnect")
+                    raise
+        if error is not None:
+            raise RuntimeError(error)
+        with stage(profile, f"retrieve outputs {request_id}"):
+            return await asyncio.to_thread(
+                comfy_pack.retrieve_workflow_outputs,
+                copy.deepcopy(workflow),
+                output_dir,
+                session_id=session_id,
+            )
+
+    async def _cancel_prompt(self, prompt_id: str, reason: str) -> None:
+        action = await asyncio.to_thread(
+            comfy_pack.run.cancel_prompt, self.host, self.port, prompt_id
+        )
+        cancelled_prompts.labels(reason=reason, action=action or "finished").inc()
+        logger.info("Prompt %s %s on %s", prompt_id, action, reason)
+
+    async def _run_item(
+        self,
+        caller: str,
+        priority: str,
+        deadline: float,
+        item: Any,
+        output_dir: Path,
+        request_id: str,
+        profile: RequestProfile | None = None,
+    ) -> Any:
+        inputs = await asyncio.to_thread(self._stage_inputs, item.model_dump())
+        with stage(profile, f"scheduler wait {request_id}"):
+            await self._acquire_slot(caller, priority, deadline)
+        try:
+            return await self._run_cancellable(
+                inputs, output_dir, deadline, request_id, profile=profile
+            )
+        finally:
+            self.scheduler.release()
+
+    @bentoml.api
+    async def generate_batch(
+        self,
+        *,
+        ctx: bentoml.Context,
+        items: list[BatchItemModel],  # type: ignore
+    ) -> AsyncGenerator[str, None]:
+        """
+        Run the workflow for a list of inputs in one request.
+
+        Items go through the scheduler in the batch lane unless the
+        X-Cpack-Priority header says otherwise, so that they do not hold up
+        interactive requests. One JSON line is streamed per item as it
+        finishes, in completion order, with its index and the output files
+        inlined as base64. The progress of an item is followed with the
+        request id suffixed by `-{index}`, and the profile of the request,
+        if profiled, has the node times of every item.
+        """
+        deadline = time.monotonic() + _request_timeout(ctx)
+        caller, priority = _caller(ctx, "batch")
+        request_id = _request_id(ctx)
+        profile = self._start_profile(ctx, request_id)
+        item_ids = [f"{request_id}-{index}" for index in range(len(items))]
+        with tempfile.TemporaryDirectory() as temp_dir, _active(item_ids):
+            tasks = {}
+            for index, item in enumerate(items):
+                output_dir = Path(temp_dir) / str(index)
+                output_dir.mkdir()
+                task = asyncio.ensure_future(
+                    self._run_item(
+                        caller,
+                        priority,
+                        deadline,
+                        item,
+                        output_dir,
+                        item_ids[index],
+                        profile,
+                    )
+                )
+                tasks[task] = index
+            try:
+                pending = set(tasks)
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        if task.exception() is not None:
+                            yield _batch_line(tasks[task], error=task.exception())
+                            continue
+                        yield await asyncio.to_thread(
+                            _batch_line, tasks[task], task.result()
+                        )
+            finally:
+                # whatever is left was abandoned by the client
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await self._finish_profile(profile)
+
     @bentoml.on_deployment
     @staticmethod
     def prepare_models():
@@ -137,6 +822,7 @@ class ComfyService:
         comfy_workspace = _get_workspace()
         if not comfy_workspace.joinpath(".DONE").exists():
             raise RuntimeError("ComfyUI workspace is not ready")
+        deferred = []
         for model in snapshot["models"]:
             if model.get("disabled", False):
                 continue
@@ -165,10 +851,37 @@ class ComfyService:
                     model_path.parent.mkdir(parents=True, exist_ok=True)
                     print(f"Copying {model_file} to {model_path}")
                     model_path.symlink_to(model_file)
+                elif source.get("download_url"):
+                    deferred.append(model)
+            elif source.get("download_url"):
+                deferred.append(model)
             else:
                 print(
                     f"WARN: Unrecognized model source: {source}, the model may be missing"
                 )
+        if deferred:
+            from comfy_pack.lazy_models import defer_models, materialize
+            from comfy_pack.package import _has_comfy_pack_node
+
+            # fetched by ComfyUI on first use rather than before serving
+            defer_models(deferred, comfy_workspace)
+            if _has_comfy_pack_node(snapshot):
+                print(f"Deferring {len(deferred)} models to their first use")
+                return
+            # without the comfy-pack node, nothing would fetch them later
+            print(f"Downloading {len(deferred)} models")
+            for model in deferred:
+                try:
+                    materialize(comfy_workspace / model["filename"], comfy_workspace)
+                except RuntimeError as e:
+                    print(f"WARN: {e}, the model may be missing")
+
+
+ComfyService.add_asgi_middleware(
+    AdmissionMiddleware,
+    controller=admission,
+    paths=["/generate", "/generate_batch"],
+)
 
 
 if False and not EXISTING_COMFYUI_SERVER:
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterator
+
+from .const import (
+    MODEL_SOURCE_CACHE_FILE,
+    MODEL_SOURCE_DB_FILE,
+    SOURCE_CACHE_NEGATIVE_TTL,
+    SOURCE_CACHE_TTL,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    sha256 TEXT PRIMARY KEY,
+    info TEXT NOT NULL,
+    found INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+# Pending writes are flushed in one transaction once this many are buffered
+FLUSH_THRESHOLD = 64
+
+
+class SourceCache:
+    """
+    The model source cache, shared by all comfy-pack processes on the host.
+
+    Models that could not be resolved are stored as negative entries, which
+    expire after `negative_ttl` seconds so that they are retried eventually
+    without being looked up on every pack. Resolved sources expire after
+    `ttl` seconds, never if it is 0.
+
+    Writes are buffered and committed together by `flush()`, which also
+    happens when the cache is closed.
+    """
+
+    def __init__(
+        self,
+        path: Path = MODEL_SOURCE_DB_FILE,
+        ttl: float = SOURCE_CACHE_TTL,
+        negative_ttl: float = SOURCE_CACHE_NEGATIVE_TTL,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._pending: dict[str, dict] = {}
+        is_new = not path.exists()
+        self._conn = sqlite3.connect(str(path), timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(SCHEMA)
+        if is_new:
+            self._import_json(MODEL_SOURCE_CACHE_FILE)
+
+    def _import_json(self, json_file: Path) -> None:
+        """Carry over the entries of the legacy JSON cache."""
+        try:
+            legacy = json.loads(json_file.read_text())
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO sources VALUES (?, ?, ?, ?)",
+                [
+                    (sha, json.dumps(info), 1, now)
+                    for sha, info in legacy.items()
+                    if sha and info  # empty entries were never real misses
+                ],
+            )
+
+    def _is_fresh(self, found: bool, updated_at: float, now: float) -> bool:
+        ttl = self.ttl if found else self.negative_ttl
+        if ttl <= 0:
+            # resolved sources never expire, misses are never cached
+            return found
+        return now - updated_at < ttl
+
+    def get_many(self, model_shas: list[str]) -> dict[str, dict]:
+        """
+        Return the fresh entries among `model_shas`. A model that is known
+        to have no source maps to an empty dict.
+        """
+        now = time.time()
+        wanted = list(dict.fromkeys(model_shas))
+        results = {sha: self._pending[sha] for sha in wanted if sha in self._pending}
+        wanted = [sha for sha in wanted if sha not in results]
+        # keep well below SQLite's limit on host parameters
+        for i in range(0, len(wanted), 500):
+            chunk = wanted[i : i + 500]
+            rows = self._conn.execute(
+                "SELECT sha256, info, found, updated_at FROM sources "
+                f"WHERE sha256 IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            for sha, info, found, updated_at in rows:
+                if self._is_fresh(bool(found), updated_at, now):
+                    results[sha] = json.loads(info)
+        return results
+
+    def get(self, model_sha: str) -> dict | None:
+        """Return the cached source, {} for a known miss or None if unknown."""
+        return self.get_many([model_sha]).get(model_sha)
+
+    def iter_found(self) -> Iterator[tuple[str, dict]]:
+        """Iterate over all resolved sources, ignoring their TTL."""
+        self.flush()
+        rows = self._conn.execute(
+            "SELECT sha256, info FROM sources WHERE found = 1 ORDER BY sha256"
+        )
+        for sha, info in rows:
+            yield sha, json.loads(info)
+
+    def put(self, model_sha: str, info: dict) -> None:
+        self._pending[model_sha] = info
+        if len(self._pending) >= FLUSH_THRESHOLD:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                [
+                    (sha, json.dumps(info), int(bool(info)), now)
+                    for sha, info in self._pending.items()
+                ],
+            )
+        self._pending.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self) -> SourceCache:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
@@ -0,0 +1,161 @@
+"""
+A local, read-mostly index from model SHA-256 to model source.
+
+The index is built from a dump file so that hosts without internet access
+can resolve model sources. A dump is a JSON Lines file with one
+``{"sha256": ..., "source": {...}}`` object per line, optionally preceded
+by a header line ``{"format": "comfy-pack-source-index", "version": ...}``.
+A plain JSON object mapping SHA-256 to source is accepted as well.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from .const import MODEL_SOURCE_INDEX_FILE
+
+DUMP_FORMAT = "comfy-pack-source-index"
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE sources (sha256 TEXT PRIMARY KEY, source TEXT NOT NULL) WITHOUT ROWID;
+"""
+
+
+def _read_dump(dump: Path) -> tuple[str | None, Iterator[tuple[str, dict]]]:
+    with dump.open() as f:
+        first = f.readline()
+    try:
+        head = json.loads(first)
+    except ValueError:
+        head = None
+    if not isinstance(head, dict) or (
+        "sha256" not in head and head.get("format") != DUMP_FORMAT
+    ):
+        # not JSON Lines, a single {sha256: source} object
+        data = json.loads(dump.read_text())
+        return None, ((sha.lower(), source) for sha, source in data.items() if source)
+
+    version = None
+    if head.get("format") == DUMP_FORMAT:
+        version = str(head.get("version") or "") or None
+
+    def entries() -> Iterator[tuple[str, dict]]:
+        with dump.open() as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if item.get("sha256") and item.get("source"):
+                    yield item["sha256"].lower(), item["source"]
+
+    return version, entries()
+
+
+def import_dump(dump: str | Path, index_file: Path = MODEL_SOURCE_INDEX_FILE) -> dict:
+    """
+    Build the index from a dump, replacing the current one atomically.
+
+    Returns the metadata of the new index.
+    """
+    dump = Path(dump)
+    version, entries = _read_dump(dump)
+    tmp = index_file.with_suffix(f".{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    conn = sqlite3.connect(str(tmp))
+    try:
+        with conn:
+            conn.executescript(SCHEMA)
+            conn.executemany(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?)",
+                ((sha, json.dumps(source)) for sha, source in entries),
+            )
+            count = conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+            meta = {
+                "schema_version": str(SCHEMA_VERSION),
+                "version": version or time.strftime("%Y%m%d%H%M%S"),
+                "imported_from": str(dump.absolute()),
+                "imported_at": str(time.time()),
+                "count": str(count),
+            }
+            conn.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+    finally:
+        conn.close()
+    os.replace(tmp, index_file)
+    return meta
+
+
+def export_dump(
+    entries: Iterable[tuple[str, dict]],
+    dump: str | Path,
+    version: str | None = None,
+) -> int:
+    """Write `(sha256, source)` pairs as a dump that `import_dump` can read."""
+    count = 0
+    with Path(dump).open("w") as f:
+        header = {"format": DUMP_FORMAT, "version": version or time.strftime("%Y%m%d")}
+        f.write(json.dumps(header) + "\n")
+        for sha, source in entries:
+            f.write(json.dumps({"sha256": sha, "source": source}) + "\n")
+            count += 1
+    return count
+
+
+class SourceIndex:
+    """Read access to the index, a missing index behaves as an empty one."""
+
+    def __init__(self, index_file: Path = MODEL_SOURCE_INDEX_FILE) -> None:
+        self._conn = None
+        if index_file.exists():
+            self._conn = sqlite3.connect(
+                f"file:{index_file}?mode=ro", uri=True, check_same_thread=False
+            )
+            if self.meta.get("schema_version") != str(SCHEMA_VERSION):
+                self.close()
+
+    @property
+    def meta(self) -> dict[str, str]:
+        if self._conn is None:
+            return {}
+        return dict(self._conn.execute("SELECT key, value FROM meta"))
+
+    def get_many(self, model_shas: Iterable[str]) -> dict[str, dict]:
+        if self._conn is None:
+            return {}
+        results = {}
+        for sha in model_shas:
+            row = self._conn.execute(
+                "SELECT source FROM sources WHERE sha256 = ?", (sha.lower(),)
+            ).fetchone()
+            if row is not None:
+                results[sha] = json.loads(row[0])
+        return results
+
+    def search(self, prefix: str, limit: int = 20) -> list[tuple[str, dict]]:
+        """Find the entries whose SHA-256 starts with `prefix`."""
+        if self._conn is None:
+            return []
+        prefix = prefix.lower()
+        rows = self._conn.execute(
+            "SELECT sha256, source FROM sources "
+            "WHERE sha256 >= ? AND sha256 < ? ORDER BY sha256 LIMIT ?",
+            (prefix, prefix + "\uffff", limit),
+        )
+        return [(sha, json.loads(source)) for sha, source in rows]
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self) -> SourceIndex:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
@@ -0,0 +1,222 @@
+"""
+Timing of the phases of an install.
+
+Code marks its phases with `phase(name, category)`, which costs nothing
+unless a `recording()` is active. The time of a phase, minus that of the
+phases nested in it, is attributed to its category (git, pip resolution,
+model linking, hashing...), so the report tells where the time of an
+install went, and which stage to work on first.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class Phase:
+    name: str
+    category: str
+    start: float
+    elapsed: float = 0.0
+    children: float = 0.0
+    ok: bool = True
+    thread: str = ""
+    details: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def self_time(self) -> float:
+        return max(0.0, self.elapsed - self.children)
+
+
+class PhaseTimer:
+    def __init__(self) -> None:
+        self.started = time.time()
+        self._origin = time.perf_counter()
+        self.phases: list[Phase] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> list[Phase]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def phase(self, name: str, category: str, **details: Any) -> Iterator[Phase]:
+        stack = self._stack()
+        record = Phase(
+            name,
+            category,
+            start=time.perf_counter() - self._origin,
+            thread=threading.current_thread().name,
+            details=details,
+        )
+        stack.append(record)
+        try:
+            yield record
+        except BaseException:
+            record.ok = False
+            raise
+        finally:
+            stack.pop()
+            record.elapsed = time.perf_counter() - self._origin - record.start
+            with self._lock:
+                if stack:
+                    stack[-1].children += record.elapsed
+                self.phases.append(record)
+
+    @contextlib.contextmanager
+    def attached(self, parent: Phase | None) -> Iterator[None]:
+        """Nest the phases of this thread in `parent`, running in another thread"""
+        if parent is None:
+            yield
+            return
+        stack = self._stack()
+        stack.append(parent)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def record(self, name: str, category: str, elapsed: float, **details: Any) -> None:
+        """Add a phase measured by someone else, e.g. a subprocess, to the current one"""
+        stack = self._stack()
+        now = time.perf_counter() - self._origin
+        record = Phase(
+            name,
+            category,
+            start=now - elapsed,
+            elapsed=elapsed,
+            thread=threading.current_thread().name,
+            details=details,
+        )
+        with self._lock:
+            if stack:
+                stack[-1].children += elapsed
+            self.phases.append(record)
+
+    def categories(self) -> dict[str, float]:
+        """Seconds spent per category, phases running in parallel adding up"""
+        totals: dict[str, float] = {}
+        with self._lock:
+            for p in self.phases:
+                totals[p.category] = totals.get(p.category, 0.0) + p.self_time
+        return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+    def report(self, **extra: Any) -> dict[str, Any]:
+        with self._lock:
+            phases = sorted(self.phases, key=lambda p: p.start)
+        return {
+            **extra,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+            "elapsed": round(time.perf_counter() - self._origin, 3),
+            "categories": {k: round(v, 3) for k, v in self.categories().items()},
+            "phases": [
+                {
+                    "name": p.name,
+                    "category": p.category,
+                    "start": round(p.start, 3),
+                    "elapsed": round(p.elapsed, 3),
+                    "self": round(p.self_time, 3),
+                    "ok": p.ok,
+                    "thread": p.thread,
+                    **({"details": p.details} if p.details else {}),
+                }
+                for p in phases
+            ],
+        }
+
+    def write(self, path: Path, **extra: Any) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.report(**extra), indent=2))
+
+
+_active: PhaseTimer | None = None
+
+
+@contextlib.contextmanager
+def recording() -> Iterator[PhaseTimer]:
+    """Record the phases run in this block, from any thread"""
+    global _active
+    previous, _active = _active, PhaseTimer()
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+
+@contextlib.contextmanager
+def phase(name: str, category: str = "other", **details: Any) -> Iterator[None]:
+    if _active is None:
+        yield
+        return
+    with _active.phase(name, category, **details):
+        yield
+
+
+def record(name: str, category: str, elapsed: float, **details: Any) -> None:
+    if _active is not None:
+        _active.record(name, category, elapsed, **details)
+
+
+def propagate(fn: Callable[..., T]) -> Callable[..., T]:
+    """
+    Wrap `fn`, to be run in a worker thread, so that its phases nest in the
+    current phase. Phases running in parallel then add up in the report.
+    """
+    timer = _active
+    if timer is None:
+        return fn
+    stack = timer._stack()
+    parent = stack[-1] if stack else None
+
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        with timer.attached(parent):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+_UV_SUMMARY = re.compile(
+    r"^(Resolved|Prepared|Installed|Uninstalled|Audited) (\d+) packages? in (.+)$"
+)
+_UV_CATEGORIES = {
+    "Resolved": "pip resolution",
+    "Prepared": "pip download",
+    "Installed": "pip install",
+    "Uninstalled": "pip install",
+    "Audited": "pip resolution",
+}
+
+
+def parse_duration(text: str) -> float:
+    """Parse durations as uv prints them: 150ms, 1.23s, 1m 02s"""
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    total = 0.0
+    for value, unit in re.findall(r"([\d.]+)\s*(ms|s|m|h)\b", text):
+        total += float(value) * units[unit]
+    return total
+
+
+def record_uv_output(output: str) -> None:
+    """Attribute the time of a `uv pip install` from the summary it prints"""
+    for line in output.splitlines():
+        match = _UV_SUMMARY.match(line.strip())
+        if match:
+            step, count, duration = match.groups()
+            record(
+                f"uv {step.lower()}",
+                _UV_CATEGORIES[step],
+                parse_duration(duration),
+                packages=int(count),
+            )
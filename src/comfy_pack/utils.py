@@ -1,8 +1,13 @@
 from __future__ import annotations
 
+import hashlib
+import os
 import re
+import shutil
 import subprocess
 import sys
+import threading
+import time
 import zipfile
 from pathlib import Path
 from typing import TYPE_CHECKING, Any, Literal, Union
@@ -16,6 +21,27 @@ CPACK_PATH_INPUT_NODES = {
     "CPackInputImage",
 }
 
+# Staged input files are named STAGED_PREFIX + sha256 + suffix
+STAGED_PREFIX = "cpack-"
+# in the ComfyUI input directory
+STAGING_SUBDIR = "staged"
+_STAGED_NAME = re.compile(re.escape(STAGED_PREFIX) + r"([0-9a-f]{64})(\.[^.]*)?")
+
+
+def staged_digest(path: str | Path, input_dir: str | Path) -> str | None:
+    """
+    The sha256 of a file staged by `stage_input_file` in the staging
+    directory of `input_dir`, read from its name, or None for other files.
+    """
+    path = Path(path)
+    match = _STAGED_NAME.fullmatch(path.name)
+    if match is None:
+        return None
+    staging_dir = Path(input_dir) / STAGING_SUBDIR
+    if os.path.realpath(path.parent) != os.path.realpath(staging_dir):
+        return None
+    return match.group(1)
+
 
 def _get_node_value(node: dict) -> Any:
     return next(iter(node["inputs"].values()))
@@ -280,6 +306,95 @@ def retrieve_workflow_outputs(
     return output_zip
 
 
+FICLONE = 0x40049409  # from linux/fs.h
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+
+
+def link_or_copy(src: str | Path, dst: str | Path) -> str:
+    """
+    Place `src` at `dst` without copying the data when possible.
+
+    A reflink (copy-on-write clone) is tried first, then a hardlink, which
+    both need `src` and `dst` to be on the same filesystem. Falls back to
+    a regular copy.
+
+    Returns:
+        str: How the file was placed, one of "reflink", "hardlink" or "copy".
+    """
+    src, dst = Path(src), Path(dst)
+    if sys.platform == "linux":
+        try:
+            _reflink(src, dst)
+            return "reflink"
+        except OSError:
+            pass
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
+def stage_input_file(
+    path: str | Path, staging_dir: Path, copy_threshold: int = 10 * 1024 * 1024
+) -> Path:
+    """
+    Place an input file in `staging_dir` under a name derived from its content.
+
+    Identical files end up at the same path, so that ComfyUI's execution
+    cache recognizes inputs it has already processed. Files of at least
+    `copy_threshold` bytes are linked rather than copied when possible.
+    """
+    path = Path(path)
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    target = staging_dir / f"{STAGED_PREFIX}{digest.hexdigest()}{path.suffix.lower()}"
+    if target.exists():
+        # keep it from being pruned
+        os.utime(target)
+        return target
+
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    tmp = staging_dir / f".{target.name}.{os.getpid()}.{threading.get_ident()}"
+    try:
+        if path.stat().st_size >= copy_threshold:
+            link_or_copy(path, tmp)
+        else:
+            shutil.copyfile(path, tmp)
+        os.replace(tmp, target)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return target
+
+
+def prune_staged_inputs(staging_dir: Path, max_age: float) -> int:
+    """Remove the staged inputs unused for `max_age` seconds"""
+    if not staging_dir.exists():
+        return 0
+    removed = 0
+    deadline = time.time() - max_age
+    for entry in os.scandir(staging_dir):
+        if entry.name.startswith(STAGED_PREFIX) and entry.stat().st_mtime < deadline:
+            os.unlink(entry.path)
+            removed += 1
+    return removed
+
+
 def get_self_git_commit() -> str | None:
     """Get current git commit of the repository.
 
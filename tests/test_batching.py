@@ -0,0 +1,170 @@
+from pathlib import Path
+
+import pytest
+
+from comfy_pack.batching import (
+    MicroBatcher,
+    distribute_folded_outputs,
+    fold_latent_batches,
+    merge_workflows,
+    split_folded_outputs,
+)
+
+
+def make_workflow(seed=1, text="rocks in a bottle", session="s0", batch_size=1):
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": text, "clip": ["1", 1]}},
+        "3": {
+            "class_type": "EmptyLatentImage",
+            "inputs": {"width": 64, "height": 64, "batch_size": batch_size},
+        },
+        "4": {"class_type": "CPackInputInt", "inputs": {"name": "seed", "value": seed}},
+        "5": {
+            "class_type": "KSampler",
+            "inputs": {
+                "model": ["1", 0],
+                "positive": ["2", 0],
+                "latent_image": ["3", 0],
+                "seed": ["4", 0],
+            },
+        },
+        "6": {"class_type": "VAEDecode", "inputs": {"samples": ["5", 0], "vae": ["1", 2]}},
+        "7": {
+            "class_type": "CPackOutputImage",
+            "inputs": {"images": ["6", 0], "filename_prefix": f"/out/{session}7_"},
+        },
+    }
+
+
+def test_merge_keeps_shared_nodes_once():
+    merged, id_maps = merge_workflows(
+        [make_workflow(seed=1, session="a"), make_workflow(seed=2, session="b")]
+    )
+    classes = sorted(node["class_type"] for node in merged.values())
+    # the loader, the text encoder and the latent are shared
+    assert classes.count("CheckpointLoaderSimple") == 1
+    assert classes.count("CLIPTextEncode") == 1
+    assert classes.count("EmptyLatentImage") == 1
+    assert classes.count("KSampler") == 2
+    assert classes.count("CPackOutputImage") == 2
+    assert id_maps[0]["1"] == id_maps[1]["1"]
+    assert id_maps[0]["5"] != id_maps[1]["5"]
+    # links point into the merged workflow
+    sampler = merged[id_maps[1]["5"]]
+    assert sampler["inputs"]["seed"] == [id_maps[1]["4"], 0]
+    assert sampler["inputs"]["model"] == [id_maps[0]["1"], 0]
+
+
+def test_merge_identical_workflows():
+    merged, id_maps = merge_workflows([make_workflow(), make_workflow()])
+    assert len(merged) == 7
+    assert id_maps[0] == id_maps[1]
+
+
+def test_merge_rejects_cycles():
+    workflow = {
+        "1": {"class_type": "A", "inputs": {"x": ["2", 0]}},
+        "2": {"class_type": "B", "inputs": {"x": ["1", 0]}},
+    }
+    with pytest.raises(ValueError):
+        merge_workflows([workflow])
+
+
+def test_fold_seed_variants_into_one_latent_batch():
+    workflows = [
+        make_workflow(seed=1, session="a"),
+        make_workflow(seed=2, session="b", batch_size=2),
+        make_workflow(seed=3, session="c"),
+    ]
+    folds = fold_latent_batches(workflows)
+    assert len(folds) == 1
+    folded, members = folds[0]
+    assert members == [0, 1, 2]
+    assert folded["3"]["inputs"]["batch_size"] == 4
+    # the first member's seed and outputs
+    assert folded["4"]["inputs"]["value"] == 1
+    assert folded["7"]["inputs"]["filename_prefix"] == "/out/a7_"
+    # the inputs are left alone
+    assert workflows[0]["3"]["inputs"]["batch_size"] == 1
+
+
+def test_fold_keeps_other_variants_apart():
+    workflows = [
+        make_workflow(seed=1, session="a"),
+        make_workflow(seed=2, text="a bottle in rocks", session="b"),
+        make_workflow(seed=3, session="c"),
+    ]
+    folds = fold_latent_batches(workflows)
+    assert [members for _, members in folds] == [[0, 2], [1]]
+    assert folds[1][0] is workflows[1]
+
+
+def test_fold_needs_splittable_outputs():
+    workflows = [make_workflow(seed=1), make_workflow(seed=2)]
+    for workflow in workflows:
+        workflow["7"]["class_type"] = "CPackOutputZip"
+    assert [members for _, members in fold_latent_batches(workflows)] == [[0], [1]]
+
+
+def test_split_folded_outputs_in_batch_order():
+    files = [Path(f"/out/a7__{i:05}_.png") for i in (3, 1, 4, 2)]
+    chunks = split_folded_outputs(files, [1, 2, 1])
+    assert [[p.name for p in chunk] for chunk in chunks] == [
+        ["a7__00001_.png"],
+        ["a7__00002_.png", "a7__00003_.png"],
+        ["a7__00004_.png"],
+    ]
+    with pytest.raises(ValueError):
+        split_folded_outputs(files, [1, 1])
+
+
+def test_distribute_folded_outputs(tmp_path):
+    dirs = [tmp_path / name for name in "abc"]
+    for d in dirs:
+        d.mkdir()
+    for i in range(1, 5):
+        (dirs[0] / f"a7__{i:05}_.png").write_text(str(i))
+    distribute_folded_outputs(
+        make_workflow(), [("a", dirs[0]), ("b", dirs[1]), ("c", dirs[2])], [2, 1, 1]
+    )
+    assert sorted(p.name for p in dirs[0].iterdir()) == [
+        "a7__00001_.png",
+        "a7__00002_.png",
+    ]
+    assert [(p.name, p.read_text()) for p in dirs[1].iterdir()] == [
+        ("b7__00003_.png", "3")
+    ]
+    assert [(p.name, p.read_text()) for p in dirs[2].iterdir()] == [
+        ("c7__00004_.png", "4")
+    ]
+
+
+def test_batcher_runs_items_together():
+    batches = []
+
+    def run_batch(items):
+        batches.append(items)
+        return [ValueError(item) if item == 2 else item * 10 for item in items]
+
+    batcher = MicroBatcher(run_batch, window=0.2, max_batch=8)
+    try:
+        futures = [batcher.submit(i) for i in range(4)]
+        assert futures[0].result(5) == 0
+        assert futures[3].result(5) == 30
+        with pytest.raises(ValueError):
+            futures[2].result(5)
+    finally:
+        batcher.close()
+    assert batches == [[0, 1, 2, 3]]
+
+
+def test_batcher_fails_batches_missing_results():
+    batcher = MicroBatcher(lambda items: items[:1], window=0.05)
+    try:
+        futures = [batcher.submit(i) for i in range(3)]
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result(5)
+    finally:
+        batcher.close()
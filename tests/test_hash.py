@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from comfy_pack import hash as cpack_hash
+
+
+@pytest.fixture
+def model(tmp_path, monkeypatch):
+    cache_file = tmp_path / "sha_cache.json"
+    cache_file.write_text("{}")
+    monkeypatch.setattr(cpack_hash, "SHA_CACHE_FILE", cache_file)
+    path = tmp_path / "model.safetensors"
+    path.write_bytes(b"weights")
+    # fills the cache
+    asyncio.run(cpack_hash.async_batch_get_sha256([str(path)]))
+    return str(path)
+
+
+def stats(path: str) -> tuple[int, float]:
+    st = os.stat(path)
+    return st.st_size, st.st_ctime
+
+
+def lookup(path: str, known: tuple[int, float]) -> str:
+    results = asyncio.run(
+        cpack_hash.async_batch_get_sha256(
+            [path], cache_only=True, known_stats={path: known}
+        )
+    )
+    return results[path]
+
+
+def test_known_stats_give_the_cached_hash(model):
+    assert lookup(model, stats(model)) == hashlib.sha256(b"weights").hexdigest()
+
+
+def test_out_of_date_known_stats_are_checked(model):
+    known = stats(model)
+    # replaced in place, the inventory still has the old stats
+    with open(model, "wb") as f:
+        f.write(b"other weights")
+    assert lookup(model, known) == ""
+
+
+def test_known_stats_missing_from_the_cache(model):
+    size, ctime = stats(model)
+    assert lookup(model, (size + 1, ctime)) == ""
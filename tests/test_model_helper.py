@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import threading
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from comfy_pack import model_helper
+
+BLOB_PAGE = (
+    '<a href="/org/repo/commit/0123abcd">'
+    '<button data-target="CopyButton" data-props="{&quot;value&quot;:'
+    '&quot;https://huggingface.co/org/repo/resolve/main/model.safetensors&quot;}">'
+)
+
+
+@contextlib.asynccontextmanager
+async def serve(app: web.Application):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        yield f"http://{host}:{port}"
+    finally:
+        await runner.cleanup()
+
+
+@pytest.fixture
+def waits(monkeypatch):
+    """The backoff waits of model_helper, which are not slept"""
+    waits = []
+
+    class Asyncio:
+        def __getattr__(self, name):
+            return getattr(asyncio, name)
+
+        @staticmethod
+        async def sleep(delay):
+            waits.append(delay)
+
+    monkeypatch.setattr(model_helper, "asyncio", Asyncio())
+    return waits
+
+
+def request_with(responses: list[dict]) -> tuple[int, bytes, int]:
+    """Request a server answering `responses` in turn, the last one forever"""
+    calls = 0
+
+    async def handler(request):
+        nonlocal calls
+        calls += 1
+        return web.Response(**responses[min(calls, len(responses)) - 1])
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/", handler)
+        async with serve(app) as url, aiohttp.ClientSession() as session:
+            status, body = await model_helper._request(session, "GET", url)
+        return status, body, calls
+
+    return asyncio.run(main())
+
+
+def test_backs_off_on_server_errors(waits):
+    status, body, calls = request_with(
+        [{"status": 503}, {"status": 502}, {"text": "ok"}]
+    )
+    assert (status, body, calls) == (200, b"ok", 3)
+    assert waits == [1.0, 2.0]
+
+
+def test_honours_retry_after(waits):
+    status, _, _ = request_with(
+        [{"status": 429, "headers": {"Retry-After": "7"}}, {}]
+    )
+    assert status == 200
+    assert waits == [7.0]
+
+
+def test_gives_up_after_max_retries(waits):
+    status, _, calls = request_with([{"status": 429}])
+    assert status == 429
+    assert calls == model_helper.MAX_RETRIES + 1
+    assert waits == [1.0, 2.0, 4.0, 8.0][: model_helper.MAX_RETRIES]
+
+
+def test_client_errors_are_not_retried(waits):
+    status, _, calls = request_with([{"status": 404}])
+    assert (status, calls) == (404, 1)
+    assert waits == []
+
+
+class Peak:
+    def __init__(self) -> None:
+        self.current = self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> None:
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc_info) -> None:
+        with self._lock:
+            self.current -= 1
+
+
+def test_lookups_and_searches_are_throttled(monkeypatch):
+    searches, lookups = Peak(), Peak()
+    shas = [f"{i:064x}" for i in range(12)]
+
+    async def blob(request):
+        with lookups:
+            await asyncio.sleep(0.05)
+        if request.match_info["sha"] in shas[:6]:
+            return web.Response(text=BLOB_PAGE)
+        return web.Response(status=404)
+
+    async def civitai(request):
+        with lookups:
+            await asyncio.sleep(0.05)
+        return web.json_response({"results": [{"hits": []}]})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/org/repo/blob/{sha}", blob)
+        app.router.add_post("/search", civitai)
+        async with serve(app) as url:
+
+            def search(sha: str) -> list[str]:
+                with searches:
+                    time.sleep(0.02)
+                return [f"{url}/org/repo/blob/{sha}"]
+
+            monkeypatch.setattr(model_helper, "_search_huggingface_blobs", search)
+            monkeypatch.setattr(model_helper, "CIVITAI_SEARCH_URL", f"{url}/search")
+            return await model_helper.abatch_lookup_model_sources(
+                shas, concurrency=3
+            )
+
+    written = {}
+    monkeypatch.setattr(model_helper, "_read_sources", lambda shas: {})
+    monkeypatch.setattr(model_helper, "_write_sources", written.update)
+    results = asyncio.run(main())
+
+    assert searches.peak == model_helper.SEARCH_CONCURRENCY
+    assert lookups.peak <= 3
+    assert {sha for sha, info in results.items() if info} == set(shas[:6])
+    assert results[shas[0]]["repo"] == "org/repo"
+    assert results[shas[0]]["commit"] == "0123abcd"
+    # the misses are remembered too
+    assert json.dumps(written, sort_keys=True) == json.dumps(results, sort_keys=True)
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import hashlib
+import os
+
+from comfy_pack.model_store import ModelStore
+
+
+def make_store(tmp_path) -> ModelStore:
+    return ModelStore(tmp_path / "models", tmp_path / "models.db")
+
+
+def add_blob(store: ModelStore, data: bytes) -> str:
+    sha = hashlib.sha256(data).hexdigest()
+    store.blob_path(sha).write_bytes(data)
+    return sha
+
+
+def test_placeholders_keep_their_blob_from_gc(tmp_path):
+    with make_store(tmp_path) as store:
+        data = b"weights"
+        sha = hashlib.sha256(data).hexdigest()
+        placeholder = tmp_path / "workspace" / "model.safetensors"
+        placeholder.parent.mkdir()
+        os.symlink(store.blob_path(sha), placeholder)
+        store.add_ref(sha, placeholder)
+
+        # fetched on first use, with gc running before the ref is refreshed
+        add_blob(store, data)
+        report = store.gc(include_legacy=True)
+        assert report.removed == []
+        assert store.has(sha)
+
+
+def test_unreferenced_blobs_are_collected(tmp_path):
+    with make_store(tmp_path) as store:
+        sha = add_blob(store, b"weights")
+        assert store.gc(include_legacy=True).removed == [sha]
+
+
+def test_is_blob_from_stats(tmp_path):
+    with make_store(tmp_path) as store:
+        sha = add_blob(store, b"weights")
+        hard_link = tmp_path / "hard_link"
+        os.link(store.blob_path(sha), hard_link)
+        other_size = tmp_path / "other_size"
+        other_size.write_bytes(b"other weights")
+        copy = tmp_path / "copy"
+        copy.write_bytes(b"weights")
+
+        assert store.is_blob(sha, hard_link) is True
+        assert store.is_blob(sha, other_size) is False
+        assert store.is_blob(sha, copy) is None
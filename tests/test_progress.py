@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from comfy_pack.bench import FakeComfyUI
+from comfy_pack.progress import follow_prompt, prompt_status
+from comfy_pack.run import submit_prompt, wait_for_prompts
+
+PROMPT = {"1": {"class_type": "Noop", "inputs": {}}}
+
+
+@pytest.fixture
+def server():
+    with FakeComfyUI(node_latency=0.05) as server:
+        yield server
+
+
+def run_prompt(server: FakeComfyUI, client_id: str) -> str:
+    prompt_id = submit_prompt(server.host, server.port, PROMPT, client_id)
+    for _, error in wait_for_prompts(
+        server.host, server.port, [prompt_id], poll_interval=0.05
+    ):
+        assert error is None
+    return prompt_id
+
+
+def follow(server: FakeComfyUI, client_id: str, **kwargs) -> list[dict]:
+    async def main():
+        events = follow_prompt(server.host, server.port, client_id, **kwargs)
+        return [event async for event in events]
+
+    return asyncio.run(asyncio.wait_for(main(), 10))
+
+
+def test_status_of_a_finished_prompt(server):
+    prompt_id = run_prompt(server, "done")
+    status = asyncio.run(prompt_status(server.host, server.port, "done"))
+    assert status == {"type": "execution_success", "data": {"prompt_id": prompt_id}}
+    assert asyncio.run(prompt_status(server.host, server.port, "other")) is None
+
+
+def test_following_a_finished_prompt_ends_at_once(server):
+    prompt_id = run_prompt(server, "done")
+    events = follow(server, "done", idle_timeout=60)
+    assert events == [{"type": "execution_success", "data": {"prompt_id": prompt_id}}]
+
+
+def test_following_an_unknown_prompt_ends_when_idle(server):
+    events = follow(server, "unknown", heartbeat=0.05, idle_timeout=0.2)
+    assert events[-1] == {"type": "not_found", "data": {"client_id": "unknown"}}
+    assert {e["type"] for e in events[:-1]} == {"heartbeat"}
+
+
+def test_expected_prompts_are_waited_for(server):
+    async def main():
+        events = []
+        follower = follow_prompt(
+            server.host,
+            server.port,
+            "later",
+            heartbeat=0.05,
+            idle_timeout=0.1,
+            expected=lambda: True,
+        )
+        async for event in follower:
+            events.append(event)
+            if len(events) == 5:
+                # the request reaches ComfyUI after waiting for a slot
+                await asyncio.to_thread(run_prompt, server, "later")
+        return events
+
+    events = asyncio.run(asyncio.wait_for(main(), 10))
+    # the end of the prompt
+    assert events[-1]["type"] == "executing"
+    assert events[-1]["data"]["node"] is None
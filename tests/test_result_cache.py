@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import copy
+import sqlite3
+
+from comfy_pack.admission import AdmissionController
+from comfy_pack.result_cache import (
+    ResultCache,
+    is_cacheable,
+    output_cache_keys,
+    without_outputs,
+)
+
+WORKFLOW = {
+    "1": {
+        "class_type": "CPackInputString",
+        "inputs": {"value": "rocks"},
+        "_meta": {"title": "prompt"},
+    },
+    "2": {
+        "class_type": "CPackInputInt",
+        "inputs": {"value": 1},
+        "_meta": {"title": "seed"},
+    },
+    "3": {
+        "class_type": "KSampler",
+        "inputs": {"seed": ["2", 0], "text": ["1", 0]},
+    },
+    "4": {
+        "class_type": "CPackOutputImage",
+        "inputs": {"images": ["3", 0], "filename_prefix": "out_"},
+        "_meta": {"title": "image"},
+    },
+    "5": {
+        "class_type": "CPackOutputFile",
+        "inputs": {"filename": ["1", 0], "filename_prefix": "out_"},
+        "_meta": {"title": "caption"},
+    },
+}
+
+
+def nondeterministic(workflow: dict, node_id: str) -> dict:
+    workflow = copy.deepcopy(workflow)
+    workflow[node_id]["_meta"] = {"nondeterministic": True}
+    return workflow
+
+
+def test_keys_depend_on_upstream_inputs_only():
+    keys = output_cache_keys(WORKFLOW, {"prompt": "rocks", "seed": 1})
+    other_seed = output_cache_keys(WORKFLOW, {"prompt": "rocks", "seed": 2})
+    assert keys["5"] == other_seed["5"]
+    assert keys["4"] != other_seed["4"]
+
+
+def test_keys_ignore_the_output_prefix():
+    moved = copy.deepcopy(WORKFLOW)
+    moved["4"]["inputs"]["filename_prefix"] = "/tmp/elsewhere_"
+    assert output_cache_keys(moved, {}) == output_cache_keys(WORKFLOW, {})
+
+
+def test_nondeterministic_nodes_only_affect_their_outputs():
+    workflow = nondeterministic(WORKFLOW, "3")
+    keys = output_cache_keys(workflow, {})
+    assert keys["4"] is None
+    assert keys["5"] is not None
+    assert is_cacheable(workflow)
+    assert not is_cacheable(nondeterministic(WORKFLOW, "1"))
+
+
+def test_without_outputs():
+    assert set(without_outputs(WORKFLOW, {"4"})) == {"1", "2", "3", "5"}
+
+
+def test_outputs_are_restored_under_the_new_prefix(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    run = tmp_path / "run"
+    run.mkdir()
+    for i, data in enumerate([b"first", b"second"], start=1):
+        (run / f"aa4_{i:05}_.png").write_bytes(data)
+    cache.put("key", list(run.glob("aa4_*")), "aa4")
+
+    dest = tmp_path / "dest"
+    assert cache.get("key", dest, "bb4")
+    assert (dest / "bb4_00001_.png").read_bytes() == b"first"
+    assert (dest / "bb4_00002_.png").read_bytes() == b"second"
+    assert not cache.get("other", dest, "bb4")
+    cache.close()
+
+
+def test_results_of_the_first_version_are_dropped(tmp_path):
+    root = tmp_path / "cache"
+    root.mkdir()
+    (root / "old").mkdir()
+    conn = sqlite3.connect(root / "results.db")
+    conn.execute(
+        "CREATE TABLE results (key TEXT PRIMARY KEY, outputs TEXT NOT NULL,"
+        " size INTEGER NOT NULL, last_used REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO results VALUES ('old', '{}', 0, 0)")
+    conn.commit()
+    conn.close()
+    ResultCache(root).close()
+    assert not (root / "old").exists()
+
+
+def test_cache_hits_are_not_timed():
+    admission = AdmissionController(slo=10)
+    admitted_at = admission.admit("/generate")
+    admission.release("/generate", admitted_at, executed=False)
+    load = admission.load()
+    assert load["in_flight"] == 0
+    assert load["service_time"] == {}
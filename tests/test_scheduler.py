@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import asyncio
+
+from comfy_pack.scheduler import FairScheduler
+
+
+def test_callers_share_slots_by_weight():
+    async def main():
+        scheduler = FairScheduler(window=1, weights={"a": 2})
+        order = []
+
+        async def request(caller: str):
+            async with scheduler.slot(caller):
+                order.append(caller)
+                await asyncio.sleep(0)
+
+        await scheduler.acquire("busy")
+        tasks = [asyncio.ensure_future(request(c)) for c in "aaaabb"]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ["a", "a", "b", "a", "a", "b"]
+
+
+def test_finished_callers_are_forgotten():
+    async def main():
+        scheduler = FairScheduler(window=1)
+        for i in range(1000):
+            async with scheduler.slot(f"caller-{i}"):
+                pass
+        return scheduler
+
+    scheduler = asyncio.run(main())
+    assert len(scheduler._finish) <= 1